@@ -0,0 +1,286 @@
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from clinical_history import ClinicalHistory
+from patient import Patient
+from vital_signs import VitalSigns
+
+
+class BatchResult:
+    """
+    Class used to collect the outcome of a batch of admissions or discharges.
+    """
+
+    def __init__(self):
+        """ BatchResult constructor object. """
+        self._succeeded = []
+        self._errors = []
+
+    def add_success(self, row_number: int, bed):
+        """ Record a row processed without errors.
+
+        :param row_number: The number of the row in the batch, starting at 1.
+        :type row_number: int
+        :param bed: The bed the row was applied to.
+        :type bed: Bed
+        """
+        self._succeeded.append((row_number, bed))
+
+    def add_error(self, row_number: int, message: str):
+        """ Record a row that could not be processed.
+
+        :param row_number: The number of the row in the batch, starting at 1.
+        :type row_number: int
+        :param message: What went wrong.
+        :type message: str
+        """
+        self._errors.append((row_number, message))
+
+    @property
+    def succeeded(self) -> list:
+        """ Get the rows processed without errors.
+
+        :returns: Tuples of (row number, bed).
+        :rtype: list[tuple[int, Bed]]
+        """
+        return self._succeeded
+
+    @property
+    def errors(self) -> list:
+        """ Get the rows that could not be processed.
+
+        :returns: Tuples of (row number, error message).
+        :rtype: list[tuple[int, str]]
+        """
+        return self._errors
+
+    def __str__(self):
+        """ Returns str of the batch result
+        :returns: string batch result
+        :rtype: str
+        """
+        return f"Processed: {len(self._succeeded)} - Errors: {len(self._errors)}"
+
+
+def read_records(path: str):
+    """ Stream the records of a CSV file with a header row, or of a JSON lines file.
+
+    The format is chosen by the file extension: .jsonl or .json for JSON lines, anything else as CSV.
+    A malformed JSON line is yielded as the ValueError describing it, so admit_many and
+    discharge_many report it as an error of its row.
+
+    :param path: The path of the file.
+    :type path: str
+    :returns: The records, one dictionary per row, or a ValueError per malformed line.
+    :rtype: iterator[dict | ValueError]
+    """
+    with open(path, newline="", encoding="utf-8") as records:
+        if path.endswith((".jsonl", ".json")):
+            for line in records:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        yield ValueError(f"Invalid JSON: {error}")
+        else:
+            yield from csv.DictReader(records)
+
+
+def parse_dates(values) -> list:
+    """ Parse a column of dates, each distinct text being parsed only once.
+
+    Dates are read with datetime.fromisoformat, which accepts the YYYY-MM-DD and
+    YYYY-MM-DD HH:MM formats used by the menu and is much faster than strptime.
+
+    :param values: The dates as text. Values of other types, lists or dictionaries from JSON for example, are invalid.
+    :type values: list[str]
+    :returns: The parsed dates, or the ValueError raised by each invalid value.
+    :rtype: list[datetime | ValueError]
+    """
+    parsed = {}
+    for value in {value for value in values if isinstance(value, str)}:
+        try:
+            parsed[value] = datetime.fromisoformat(value)
+        except ValueError as error:
+            parsed[value] = ValueError(f"Invalid date {value!r}: {error}")
+    return [parsed[value] if isinstance(value, str) else ValueError(f"Invalid date {value!r}: the date must be text")
+            for value in values]
+
+
+def _chunks(records, chunk_size: int):
+    """ Split records in lists of chunk_size records, keeping their row numbers.
+
+    :returns: Lists of (row number, record) tuples.
+    :rtype: iterator[list[tuple[int, dict]]]
+    """
+    numbered = enumerate(records, 1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def admit_many(bed_pool, records, services=None, chunk_size: int = 10000) -> BatchResult:
+    """ Admit a batch of patients, reporting the invalid rows instead of stopping.
+
+    Each record needs the keys patient_id, name, gender, birth_date, blood_pressure,
+    temperature, oxygen_saturation, breathing_rate, admission_date and service, and may
+    have chronic_disease. Records are processed in chunks: the dates of a chunk are parsed
+    together and its valid rows get their beds in one allocation.
+
+    :param bed_pool: The pool giving the beds.
+    :type bed_pool: BedPool
+    :param records: The admission records, for example from read_records.
+    :type records: iterable[dict]
+    :param services: The accepted medical services, any service if None.
+    :type services: tuple[str]
+    :param chunk_size: The number of records processed together.
+    :type chunk_size: int
+    :returns: The admitted rows with their beds, and the rows with errors.
+    :rtype: BatchResult
+    """
+    result = BatchResult()
+    for chunk in _chunks(records, chunk_size):
+        birth_dates = parse_dates([_text(record, "birth_date") for _, record in chunk])
+        admission_dates = parse_dates([_text(record, "admission_date") for _, record in chunk])
+        row_numbers, admissions = [], []
+
+        for (row_number, record), birth_date, admission_date in zip(chunk, birth_dates, admission_dates):
+            try:
+                _check_record(record)
+                for date in (birth_date, admission_date):
+                    if isinstance(date, ValueError):
+                        raise date
+                service = _text(record, "service")
+                if services is not None and service not in services:
+                    raise ValueError(f"Non existent service {service!r}")
+                patient = Patient(_text(record, "patient_id"), _text(record, "name"), _text(record, "gender"),
+                                  birth_date)
+                vital_signs = VitalSigns(float(record["blood_pressure"]), float(record["temperature"]),
+                                         float(record["oxygen_saturation"]), float(record["breathing_rate"]))
+                chronic_disease = str(record.get("chronic_disease", "")).strip().lower() in ("1", "true", "y", "yes")
+            except (KeyError, TypeError, ValueError) as error:
+                result.add_error(row_number, _message(error))
+                continue
+            row_numbers.append(row_number)
+            admissions.append((ClinicalHistory(patient, vital_signs, service, admission_date,
+                                               chronic_disease=chronic_disease), service))
+
+        for row_number, bed in zip(row_numbers, bed_pool.allocate_many(admissions)):
+            if bed is None:
+                result.add_error(row_number, "No bed available")
+            else:
+                result.add_success(row_number, bed)
+    return result
+
+
+def discharge_many(bed_pool, records, registry=None, chunk_size: int = 10000) -> BatchResult:
+    """ Discharge a batch of patients, reporting the invalid rows instead of stopping.
+
+    Each record needs discharge_date and either bed, the number of the bed, or patient_id
+    when a registry is given to find the bed of the patient.
+
+    :param bed_pool: The pool owning the beds.
+    :type bed_pool: BedPool
+    :param records: The discharge records, for example from read_records.
+    :type records: iterable[dict]
+    :param registry: The registry used to find beds by patient id.
+    :type registry: PatientRegistry
+    :param chunk_size: The number of records processed together.
+    :type chunk_size: int
+    :returns: The discharged rows with their beds, and the rows with errors.
+    :rtype: BatchResult
+    """
+    result = BatchResult()
+    for chunk in _chunks(records, chunk_size):
+        discharge_dates = parse_dates([_text(record, "discharge_date") for _, record in chunk])
+        for (row_number, record), discharge_date in zip(chunk, discharge_dates):
+            try:
+                _check_record(record)
+                if isinstance(discharge_date, ValueError):
+                    raise discharge_date
+                if record.get("bed") not in (None, ""):
+                    try:
+                        bed = bed_pool.bed(int(record["bed"]))
+                    except KeyError:
+                        raise ValueError(f"Non existent bed {record['bed']}")
+                elif registry is not None and record.get("patient_id"):
+                    bed = registry.current_bed(record["patient_id"])
+                    if bed is None:
+                        raise ValueError(f"The patient {record['patient_id']} is not admitted")
+                else:
+                    raise ValueError("The record needs a bed or, with a registry, a patient_id")
+                if not bed.occupied:
+                    raise ValueError(f"The bed {bed.number} is not occupied")
+                bed.clinical_history.discharge_date = discharge_date
+                bed.release_patient()
+            except (KeyError, TypeError, ValueError) as error:
+                result.add_error(row_number, _message(error))
+                continue
+            result.add_success(row_number, bed)
+    return result
+
+
+def _check_record(record):
+    """ Check that a record is a dictionary of fields.
+
+    :param record: The record, or the ValueError yielded by read_records for a malformed line.
+    :type record: dict
+    :raises ValueError: If the record is an error or not a dictionary.
+    """
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError(f"The record must be an object, not {record!r}")
+
+
+def _text(record: dict, key: str) -> str:
+    """ Get a field of a record as stripped text, None if it is missing or the record is not a dictionary.
+
+    :param record: The record.
+    :type record: dict
+    :param key: The name of the field.
+    :type key: str
+    :returns: The field text.
+    :rtype: str
+    """
+    value = record.get(key) if isinstance(record, dict) else None
+    return value.strip() if isinstance(value, str) else value
+
+
+def _message(error: Exception) -> str:
+    """ Describe an error raised while processing a row.
+
+    :param error: The error.
+    :type error: Exception
+    :returns: The error message.
+    :rtype: str
+    """
+    if isinstance(error, KeyError):
+        return f"Missing field {error.args[0]}"
+    return str(error)
+
+
+if __name__ == "__main__":
+    import io
+    from bed import Bed
+    from bed_pool import BedPool
+
+    admissions_csv = io.StringIO(
+        "patient_id,name,gender,birth_date,blood_pressure,temperature,oxygen_saturation,breathing_rate,"
+        "admission_date,service,chronic_disease\n"
+        "1234,Andres,F,2004-05-15,120,37,95,16,2023-10-15 02:40,Cardiology,Y\n"
+        "5678,Ana,F,1990-01-01,110,36.5,97,14,2023-10-15 02:45,Neurology,N\n"
+        "9012,Juan,M,not a date,110,36.5,97,14,2023-10-15 02:45,Neurology,N\n"
+        "3456,Luis,M,1980-03-03,130,38,93,18,2023-10-15 03:00,Astrology,N\n")
+    pool = BedPool([Bed(n) for n in range(1, 11)])
+
+    admitted = admit_many(pool, csv.DictReader(admissions_csv), services=("Cardiology", "Neurology"))
+    print(admitted, admitted.errors)
+
+    discharged = discharge_many(pool, [{"bed": "1", "discharge_date": "2023-10-18 12:00"},
+                                       {"bed": "5", "discharge_date": "2023-10-18 12:00"}])
+    print(discharged, discharged.errors)
@@ -3,6 +3,8 @@ class Bed:
     Class used to represent a hospital bed.
     """
 
+    __slots__ = ("_number", "_service", "_occupied", "_clinical_history", "_listeners")
+
     def __init__(self, number: int):
         """ Bed constructor object.
 
@@ -13,6 +15,27 @@ class Bed:
         self._service = None
         self._occupied = False
         self._clinical_history = None
+        self._listeners = ()
+
+    def add_listener(self, listener):
+        """ Register a listener notified when a patient is admitted or released.
+
+        The listener must implement ``patient_admitted(bed, clinical_history)`` and
+        ``patient_released(bed, clinical_history)``.
+
+        :param listener: The object to notify.
+        :type listener: object
+        """
+        if listener not in self._listeners:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        """ Unregister a listener previously added with add_listener.
+
+        :param listener: The object to stop notifying.
+        :type listener: object
+        """
+        self._listeners = tuple(item for item in self._listeners if item is not listener)
 
     def admit_patient(self, clinical_history, service: str):
         """ Admit a patient to the bed.
@@ -27,6 +50,8 @@ class Bed:
             self._occupied = True
             self._clinical_history = clinical_history
             self._service = service
+            for listener in self._listeners:
+                listener.patient_admitted(self, clinical_history)
         else:
             raise BedOccupiedError(f"The bed {self._number} is already occupied")
 
@@ -36,8 +61,11 @@ class Bed:
         :raises BedEmptyError: If the bed is already empty.
         """
         if self._occupied:
+            clinical_history = self._clinical_history
             self._occupied = False
             self._clinical_history = None
+            for listener in self._listeners:
+                listener.patient_released(self, clinical_history)
         else:
             raise BedEmptyError(f"The bed {self._number} is already empty")
 
@@ -0,0 +1,281 @@
+import heapq
+import threading
+
+
+class BedPool:
+    """
+    Class used to allocate free hospital beds without scanning every bed.
+
+    Free beds are kept in min-heaps of bed numbers, so the lowest numbered free bed is
+    always handed out first, exactly like the linear scan it replaces. Beds can optionally
+    be reserved for a medical service; those beds live in their own free list and are
+    tried before the shared one when a patient of that service is admitted. The free lists
+    are guarded by a lock, so the pool can be shared between threads.
+
+    When the reserved and shared beds of a service run out, its patients can borrow the
+    reserved beds of other services, each lender keeping some of its beds free for its own
+    patients, and a quota can cap the beds held by a service whatever their reservation.
+    The free beds of every list and the beds held by every service are counted as beds are
+    admitted and released, so these rules cost O(1) and an allocation stays O(log n).
+    """
+
+    def __init__(self, beds, service_beds: dict = None, quotas: dict = None, borrow: dict = None,
+                 keep_free: dict = None):
+        """ BedPool constructor object.
+
+        :param beds: The beds managed by the pool.
+        :type beds: list[Bed]
+        :param service_beds: Optional mapping of medical service to the bed numbers reserved for it,
+            for example a range.
+        :type service_beds: dict[str, iterable[int]]
+        :param quotas: Optional mapping of medical service to the largest number of beds its patients hold.
+        :type quotas: dict[str, int]
+        :param borrow: Optional mapping of medical service to the services whose reserved beds its patients
+            may take when its own and the shared beds are full, in order of preference; the rule under None
+            applies to the services without one.
+        :type borrow: dict[str, list[str]]
+        :param keep_free: Optional mapping of medical service to the number of its reserved beds never lent.
+        :type keep_free: dict[str, int]
+        """
+        self._beds = {}
+        self._home_service = {}
+        self._free = {None: []}
+        self._free_count = {None: 0}
+        self._queued = set()
+        self._quotas = dict(quotas or {})
+        self._borrow = {service: tuple(lenders) for service, lenders in (borrow or {}).items()}
+        self._keep_free = dict(keep_free or {})
+        self._held = {}
+        self._taken = {}
+        self._lock = threading.RLock()
+
+        for service, numbers in (service_beds or {}).items():
+            self._free.setdefault(service, [])
+            self._free_count.setdefault(service, 0)
+            for number in numbers:
+                self._home_service[number] = service
+
+        for bed in beds:
+            self._beds[bed.number] = bed
+            bed.add_listener(self)
+            if not bed.occupied:
+                home_service = self._home_service.get(bed.number)
+                self._free[home_service].append(bed.number)
+                self._free_count[home_service] += 1
+                self._queued.add(bed.number)
+            else:
+                self._held[bed.service] = self._held.get(bed.service, 0) + 1
+
+        for free_beds in self._free.values():
+            heapq.heapify(free_beds)
+
+    def allocate(self, clinical_history, service: str):
+        """ Admit a patient to the first free bed available for the service.
+
+        Beds reserved for the service are used first, then the shared beds.
+
+        :param clinical_history: The clinical history object of the patient.
+        :type clinical_history: ClinicalHistory
+        :param service: The medical service to which the patient is admitted.
+        :type service: str
+        :returns: The bed where the patient was admitted.
+        :rtype: Bed
+        :raises NoBedAvailableError: If there is no free bed for the service.
+        """
+        with self._lock:
+            bed = self.take(service)
+            if bed is None:
+                raise NoBedAvailableError(f"No bed available for the service {service}")
+            bed.admit_patient(clinical_history, service)
+        return bed
+
+    def allocate_many(self, admissions) -> list:
+        """ Admit many patients at once, without raising when the beds run out.
+
+        :param admissions: Tuples of (clinical history, service).
+        :type admissions: list[tuple[ClinicalHistory, str]]
+        :returns: The bed of each admission, None for the admissions that found no free bed.
+        :rtype: list[Bed]
+        """
+        beds = []
+        with self._lock:
+            for clinical_history, service in admissions:
+                bed = self.take(service)
+                if bed is not None:
+                    bed.admit_patient(clinical_history, service)
+                beds.append(bed)
+        return beds
+
+    def release(self, number: int):
+        """ Release the patient from a bed and return the bed to its free list.
+
+        :param number: The number of the bed.
+        :type number: int
+        :returns: The clinical history of the released patient.
+        :rtype: ClinicalHistory
+        :raises BedEmptyError: If the bed is already empty.
+        """
+        bed = self._beds[number]
+        clinical_history = bed.clinical_history
+        bed.release_patient()
+        return clinical_history
+
+    def bed(self, number: int):
+        """ Get a bed of the pool by its number.
+
+        :param number: The number of the bed.
+        :type number: int
+        :returns: The bed object.
+        :rtype: Bed
+        """
+        return self._beds[number]
+
+    def free_count(self, service: str = None) -> int:
+        """ Count the free beds.
+
+        :param service: Count only the beds reserved for this service, or the shared beds if None.
+        :type service: str
+        :returns: The number of free beds.
+        :rtype: int
+        """
+        with self._lock:
+            return self._free_count.get(service, 0)
+
+    def held_count(self, service: str) -> int:
+        """ Count the beds held by the patients of a service, occupied or taken for them.
+
+        :param service: The medical service.
+        :type service: str
+        :returns: The number of beds.
+        :rtype: int
+        """
+        with self._lock:
+            return self._held.get(service, 0)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that counts the bed as held by its service. Beds admitted outside the pool
+        stay in their free list and are skipped lazily on allocation. """
+        with self._lock:
+            taken_service = self._taken.pop(bed.number, None)
+            if taken_service != bed.service:
+                if taken_service is not None:
+                    self._held[taken_service] -= 1
+                self._held[bed.service] = self._held.get(bed.service, 0) + 1
+            if bed.number in self._queued:
+                self._free_count[self._home_service.get(bed.number)] -= 1
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that puts the released bed back in its free list. """
+        with self._lock:
+            self._held[bed.service] -= 1
+            if bed.number in self._queued:
+                self._free_count[self._home_service.get(bed.number)] += 1
+            else:
+                self.put_back(bed)
+
+    def take(self, service: str):
+        """ Take the free bed for a service out of the free lists, without admitting a patient.
+
+        Reserved beds of the service are tried first, then the shared ones, then the beds
+        the service may borrow. The caller owns the bed until it admits a patient to it, or
+        gives it back with put_back.
+
+        :param service: The medical service of the patient.
+        :type service: str
+        :returns: The free bed or None if there is none, or if the service holds its quota of beds.
+        :rtype: Bed
+        """
+        with self._lock:
+            quota = self._quotas.get(service)
+            if quota is not None and self._held.get(service, 0) >= quota:
+                return None
+            bed = self._pop_free(service) if service in self._free else None
+            if bed is None:
+                bed = self._pop_free(None)
+            if bed is None:
+                for lender in self._borrow.get(service, self._borrow.get(None, ())):
+                    if lender != service and lender in self._free and \
+                            self._free_count[lender] > self._keep_free.get(lender, 0):
+                        bed = self._pop_free(lender)
+                        break
+            if bed is not None:
+                self._taken[bed.number] = service
+                self._held[service] = self._held.get(service, 0) + 1
+            return bed
+
+    def put_back(self, bed):
+        """ Return a free bed to its free list.
+
+        :param bed: The bed.
+        :type bed: Bed
+        """
+        with self._lock:
+            taken_service = self._taken.pop(bed.number, None)
+            if taken_service is not None:
+                self._held[taken_service] -= 1
+            if bed.number not in self._queued:
+                home_service = self._home_service.get(bed.number)
+                self._queued.add(bed.number)
+                self._free_count[home_service] += 1
+                heapq.heappush(self._free[home_service], bed.number)
+
+    def _pop_free(self, service):
+        """ Pop the lowest numbered free bed of a free list, discarding stale entries.
+
+        :param service: The service of the free list, None for the shared beds.
+        :type service: str
+        :returns: The free bed or None if the list is exhausted.
+        :rtype: Bed
+        """
+        free_beds = self._free[service]
+        while free_beds:
+            number = heapq.heappop(free_beds)
+            self._queued.discard(number)
+            bed = self._beds[number]
+            if not bed.occupied:
+                self._free_count[service] -= 1
+                return bed
+        return None
+
+    def __len__(self):
+        """ Returns the number of beds managed by the pool.
+
+        :returns: The number of beds.
+        :rtype: int
+        """
+        return len(self._beds)
+
+
+class NoBedAvailableError(Exception):
+    """Exception raised when there is no free bed to admit a patient."""
+    pass
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    pool = BedPool([Bed(n) for n in range(1, 7)], {"Cardiology": [4, 5], "Neurology": [6]},
+                   quotas={"Neurology": 2}, borrow={None: ["Cardiology"]}, keep_free={"Cardiology": 1})
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    first = pool.allocate(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date), "Cardiology")
+    second = pool.allocate(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Neurology", admission_date), "Neurology")
+    print(first)
+    print(second)
+
+    pool.release(first.number)
+    print(f"Free Cardiology beds: {pool.free_count('Cardiology')} - Free shared beds: {pool.free_count()}")
+
+    second = pool.allocate(ClinicalHistory(patient, VitalSigns(), "Neurology", admission_date), "Neurology")
+    print(f"Neurology beds held: {pool.held_count('Neurology')} - quota reached:", pool.take("Neurology") is None)
+
+    for _ in range(4):
+        bed = pool.take("Pediatrics")
+        print("Pediatrics bed:", bed.number if bed is not None else None)
+        if bed is not None:
+            bed.admit_patient(ClinicalHistory(patient, VitalSigns(), "Pediatrics", admission_date), "Pediatrics")
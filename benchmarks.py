@@ -0,0 +1,1232 @@
+import asyncio
+import gc
+import heapq
+import json
+import math
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from bed import Bed, BedEmptyError
+from bed_pool import BedPool, NoBedAvailableError
+from census import CensusTimeline
+from clinical_history import ClinicalHistory
+from discharge_archive import DischargeArchive
+from event_log import EventJournal
+from export import export_columnar, export_csv, export_jsonl, histories_from_columnar
+from image_store import ImageStore
+from instrumentation import Instrumentation
+from length_of_stay import LengthOfStay
+from medication_stats import MedicationStatistics
+from note_search import NoteIndex
+from parallel_report import ParallelReport, repository_shards
+from patient import Patient
+from report import Report, ReportAccumulator
+from simulation import Simulation, SyntheticWorkload
+from storage import SQLiteRepository
+from topology import HospitalNetwork
+from vital_signs import VitalSigns
+from vital_signs_table import VitalSignsTable
+from ward_server import WardServer
+from ward_service import WardService
+from ward_statistics import WardStatistics
+
+
+def _timed(function, *args):
+    """ Run a function and measure its wall time, starting from a collected heap.
+
+    :param function: The function to run.
+    :type function: callable
+    :returns: The result of the function and the elapsed seconds.
+    :rtype: tuple[object, float]
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+SERVICES = ("Internal Medicine", "General Surgery", "Pediatrics", "Cardiology", "Neurology",
+            "Psychiatry", "Radiology", "Rehabilitation")
+MEDICINES = ("Paracetamol 500mg", "Lisinopril", "Ibuprofen 400mg", "Amoxicillin", "Omeprazole", "Insulin")
+
+
+def generate_histories(n_histories: int, seed: int = 0):
+    """ Generate random clinical histories for the benchmarks, one at a time.
+
+    About half of the histories are discharged and a fifth have a chronic disease.
+    Patients and vital signs are shared between histories to keep memory low.
+
+    :param n_histories: The number of clinical histories.
+    :type n_histories: int
+    :param seed: The seed of the random generator.
+    :type seed: int
+    :returns: The clinical histories.
+    :rtype: iterator[ClinicalHistory]
+    """
+    rng = random.Random(seed)
+    patients = [Patient(str(n), f"Patient {n}") for n in range(1000)]
+    vital_signs = VitalSigns(120, 37, 95, 16)
+    start = datetime(2023, 1, 1)
+    for _ in range(n_histories):
+        admission_date = start + timedelta(minutes=rng.randrange(525600))
+        history = ClinicalHistory(rng.choice(patients), vital_signs, rng.choice(SERVICES), admission_date,
+                                  chronic_disease=rng.random() < 0.2)
+        if rng.random() < 0.5:
+            history.discharge_date = admission_date + timedelta(minutes=rng.randrange(30, 43200))
+        for _ in range(rng.randrange(3)):
+            history.add_medicine(rng.choice(MEDICINES))
+        yield history
+
+
+def make_histories(n_histories: int, seed: int = 0) -> list:
+    """ Build a list of random clinical histories for the benchmarks, see generate_histories.
+
+    :param n_histories: The number of clinical histories.
+    :type n_histories: int
+    :param seed: The seed of the random generator.
+    :type seed: int
+    :returns: The clinical histories.
+    :rtype: list[ClinicalHistory]
+    """
+    return list(generate_histories(n_histories, seed))
+
+
+def bench_bed_allocation(n_beds: int = 20000, n_cycles: int = 2000, seed: int = 0):
+    """ Compare the linear scan admission of main.py with BedPool on a nearly full ward.
+
+    The ward is filled up completely, then each cycle releases one random bed and admits
+    a new patient, so every admission has to find the single free bed.
+
+    :param n_beds: The number of beds of the ward.
+    :type n_beds: int
+    :param n_cycles: The number of release/admit cycles measured.
+    :type n_cycles: int
+    :param seed: The seed of the random bed releases.
+    :type seed: int
+    """
+    history = ClinicalHistory(Patient("1", "Bench"), VitalSigns(), "Cardiology", datetime(2023, 1, 1))
+    releases = random.Random(seed).choices(range(n_beds), k=n_cycles)
+
+    def scan():
+        beds = [Bed(n) for n in range(1, n_beds + 1)]
+        for bed in beds:
+            bed.admit_patient(history, "Cardiology")
+        for index in releases:
+            beds[index].release_patient()
+            for bed in beds:
+                if not bed.occupied:
+                    bed.admit_patient(history, "Cardiology")
+                    break
+
+    def pool():
+        beds = [Bed(n) for n in range(1, n_beds + 1)]
+        bed_pool = BedPool(beds)
+        for _ in beds:
+            bed_pool.allocate(history, "Cardiology")
+        for index in releases:
+            beds[index].release_patient()
+            bed_pool.allocate(history, "Cardiology")
+
+    _, scan_time = _timed(scan)
+    _, pool_time = _timed(pool)
+    print(f"Bed allocation ({n_beds} beds, {n_cycles} cycles): "
+          f"scan {scan_time:.3f} s - pool {pool_time:.3f} s - speedup x{scan_time / pool_time:.1f}")
+
+
+def bench_report(sizes=(1000, 100000, 1000000)):
+    """ Compare Report.compute_all with the five separate Report methods called by main.py.
+
+    :param sizes: The numbers of clinical histories to report on.
+    :type sizes: tuple[int]
+    :raises AssertionError: If compute_all disagrees with the separate methods.
+    """
+    for n_histories in sizes:
+        histories = make_histories(n_histories)
+
+        def separate():
+            return {
+                "admissions_and_discharges_per_service": Report.admissions_and_discharges_per_service(histories),
+                "avg_stay_per_service": Report.avg_stay_per_service(histories),
+                "patients_with_chronic_diseases": Report.patients_with_chronic_diseases(histories),
+                "meds_per_service": Report.meds_per_service(histories),
+                "occupancy_rate": Report.occupancy_rate(2 * n_histories, len(histories)),
+            }
+
+        expected, separate_time = _timed(separate)
+        result, fused_time = _timed(Report.compute_all, histories, None, 2 * n_histories)
+        assert result == expected, "compute_all disagrees with the separate Report methods"
+        print(f"Report ({n_histories} histories): separate {separate_time:.3f} s - "
+              f"compute_all {fused_time:.3f} s - speedup x{separate_time / fused_time:.1f}")
+        del histories
+
+
+def bench_report_stream(n_histories: int = 100000, n_parts: int = 4):
+    """ Compare the peak memory of a report over streamed histories and over a materialized list.
+
+    Also checks that merging the accumulators of n_parts slices of the histories gives
+    the same report as a single pass.
+
+    :param n_histories: The number of clinical histories to report on.
+    :type n_histories: int
+    :param n_parts: The number of partial accumulators merged.
+    :type n_parts: int
+    :raises AssertionError: If the streamed, materialized or merged reports disagree.
+    """
+    def peak(function):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak_bytes / 2 ** 20
+
+    streamed, stream_time, stream_peak = peak(lambda: Report.compute_all(generate_histories(n_histories), top=3))
+    listed, list_time, list_peak = peak(lambda: Report.compute_all(make_histories(n_histories), top=3))
+    assert streamed == listed, "The streamed report disagrees with the materialized one"
+
+    histories = generate_histories(n_histories)
+    merged = ReportAccumulator()
+    for part in range(n_parts):
+        accumulator = ReportAccumulator()
+        accumulator.update(islice(histories, n_histories // n_parts + (part < n_histories % n_parts)))
+        merged.merge(accumulator)
+    assert merged.result(top=3, total_beds=2 * n_histories) == Report.compute_all(
+        generate_histories(n_histories), total_beds=2 * n_histories, top=3), "The merged report disagrees"
+
+    print(f"Report ({n_histories} histories): streamed peak {stream_peak:.1f} MiB in {stream_time:.2f} s - "
+          f"list peak {list_peak:.1f} MiB in {list_time:.2f} s - {n_parts} merged parts agree")
+
+
+def bench_parallel_report(n_histories: int = 1000000, n_stored: int = 200000, worker_counts=None):
+    """ Measure how ParallelReport scales with the number of worker processes.
+
+    A list of histories in memory is shared with forked workers, and the same histories
+    streamed from a generator are sent to the workers as rows; stored histories are loaded
+    by each worker from its own shard of an SQLite repository.
+
+    :param n_histories: The number of clinical histories in memory.
+    :type n_histories: int
+    :param n_stored: The number of clinical histories stored in the repository.
+    :type n_stored: int
+    :param worker_counts: The numbers of workers measured, powers of two up to the number of CPUs if None.
+    :type worker_counts: tuple[int]
+    :raises AssertionError: If a parallel report disagrees with Report.compute_all.
+    """
+    n_cpus = os.cpu_count() or 1
+    worker_counts = worker_counts or tuple(sorted({1, 2} | {2 ** n for n in range(n_cpus.bit_length())}))
+    print(f"{n_cpus} CPUs")
+
+    histories = make_histories(n_histories)
+    expected, serial_time = _timed(Report.compute_all, histories)
+    print(f"Report ({n_histories} histories in memory): serial {serial_time:.2f} s")
+    for workers in worker_counts:
+        result, elapsed = _timed(ParallelReport(workers).compute, histories)
+        assert result == expected, "ParallelReport disagrees with Report.compute_all"
+        streamed, streamed_time = _timed(ParallelReport(workers).compute, iter(histories))
+        assert streamed == expected, "ParallelReport disagrees with Report.compute_all"
+        print(f"  {workers} workers {elapsed:.2f} s - speedup x{serial_time / elapsed:.2f} - "
+              f"as rows {streamed_time:.2f} s")
+    del histories
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "hospital.db")
+        repository = SQLiteRepository(path)
+        repository.save_histories(make_histories(n_stored))
+        expected, serial_time = _timed(lambda: Report.compute_all(
+            history for _, history in repository.iter_histories()))
+        repository.close()
+        print(f"Report ({n_stored} stored histories): serial {serial_time:.2f} s")
+        for workers in worker_counts:
+            result, elapsed = _timed(ParallelReport(workers).compute_shards, repository_shards(path, 4 * workers))
+            assert result == expected, "ParallelReport disagrees with Report.compute_all"
+            print(f"  {workers} workers {elapsed:.2f} s - speedup x{serial_time / elapsed:.2f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_length_of_stay(n_histories: int = 1000000):
+    """ Compare Report.avg_stay_per_service with the LengthOfStay statistics over the same discharged stays.
+
+    :param n_histories: The number of clinical histories, about half of them discharged.
+    :type n_histories: int
+    :raises AssertionError: If the mean stays disagree.
+    """
+    histories = make_histories(n_histories)
+    length_of_stay = LengthOfStay()
+    _, load_time = _timed(length_of_stay.add_histories, histories)
+    expected, report_time = _timed(Report.avg_stay_per_service, histories)
+    statistics, statistics_time = _timed(length_of_stay.statistics, None, False)
+    assert {service: str(values["mean"]) for service, values in statistics.items()} == expected, \
+        "LengthOfStay disagrees with Report.avg_stay_per_service"
+    print(f"Length of stay ({len(length_of_stay)} stays): Report mean {report_time:.3f} s - "
+          f"LengthOfStay mean, median, p90 and p99 {statistics_time:.3f} s (loaded in {load_time:.3f} s)")
+
+
+def bench_discharge_archive(n_histories: int = 200000):
+    """ Measure archiving discharged histories and reporting on a week of them against the whole archive.
+
+    :param n_histories: The number of clinical histories, about half of them discharged over a year.
+    :type n_histories: int
+    :raises AssertionError: If the week read from the archive disagrees with filtering every history.
+    """
+    discharged = [history for history in make_histories(n_histories) if history.discharge_date is not None]
+    directory = tempfile.mkdtemp()
+    try:
+        archive = DischargeArchive(directory)
+        _, archive_time = _timed(lambda: [archive.append(history) for history in discharged])
+        archive.close()
+        archive, load_time = _timed(DischargeArchive, directory)
+
+        since, until = datetime(2023, 6, 1), datetime(2023, 6, 8)
+        week, week_time = _timed(lambda: Report.compute_all(archive.histories(since, until)))
+        everything, scan_time = _timed(lambda: Report.compute_all(
+            history for history in archive.histories() if since <= history.discharge_date < until))
+        assert week == everything, "The archive range query disagrees with a full scan"
+        print(f"Discharge archive ({len(archive)} histories, {len(archive.partitions)} months): "
+              f"archived in {archive_time:.2f} s - index rebuilt in {load_time:.2f} s")
+        print(f"  Report of one week ({archive.count(since, until)} histories): {week_time:.3f} s - "
+              f"scanning the whole archive {scan_time:.3f} s")
+        archive.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_census(n_histories: int = 500000, n_queries: int = 10000, n_scans: int = 20, seed: int = 0):
+    """ Compare CensusTimeline queries with counting the occupied beds over every history.
+
+    :param n_histories: The number of clinical histories.
+    :type n_histories: int
+    :param n_queries: The number of timeline queries measured.
+    :type n_queries: int
+    :param n_scans: The number of queries answered by scanning every history, to compare.
+    :type n_scans: int
+    :raises AssertionError: If the timeline disagrees with the scans.
+    """
+    rng = random.Random(seed)
+    histories = make_histories(n_histories, seed)
+    census = CensusTimeline()
+    _, load_time = _timed(census.add_histories, histories)
+    moments = [datetime(2023, 1, 1) + timedelta(minutes=rng.randrange(525600)) for _ in range(n_queries)]
+
+    def scan(moment):
+        return sum(1 for history in histories if history.admission_date <= moment
+                   and (history.discharge_date is None or history.discharge_date > moment))
+
+    expected, scan_time = _timed(lambda: [scan(moment) for moment in moments[:n_scans]])
+    occupancies, query_time = _timed(lambda: [census.occupancy(moment) for moment in moments])
+    assert occupancies[:n_scans] == expected, "CensusTimeline disagrees with a scan of the histories"
+    _, peak_time = _timed(lambda: [census.max_occupancy(moment, moment + timedelta(days=7), "Cardiology")
+                                   for moment in moments])
+    print(f"Census ({n_histories} histories, loaded in {load_time:.2f} s): occupancy at a time "
+          f"{query_time / n_queries * 1e6:.1f} us - weekly peak {peak_time / n_queries * 1e6:.1f} us - "
+          f"scanning the histories {scan_time / n_scans * 1e3:.1f} ms")
+
+    beds = [Bed(n) for n in range(1, 1001)]
+    census = CensusTimeline(beds)
+    pool = BedPool(beds)
+    patient = Patient("1", "Patient 1")
+    vital_signs = VitalSigns(120, 37, 95, 16)
+    moment = datetime(2023, 1, 1)
+
+    def feed(n_events):
+        nonlocal moment
+        for _ in range(n_events):
+            moment += timedelta(minutes=1)
+            if pool.free_count() and rng.random() < 0.5:
+                pool.allocate(ClinicalHistory(patient, vital_signs, rng.choice(SERVICES), moment), "")
+            else:
+                bed = beds[rng.randrange(len(beds))]
+                if bed.occupied:
+                    bed.clinical_history.discharge_date = moment
+                    bed.release_patient()
+            if rng.random() < 0.01:
+                census.occupancy(moment)
+
+    _, feed_time = _timed(feed, 100000)
+    print(f"Census fed by the bed listener hooks: {feed_time / 100000 * 1e6:.1f} us per bed event")
+
+
+def bench_medication_stats(n_prescriptions: int = 2000000, n_medicines: int = 5000, k: int = 10, seed: int = 0):
+    """ Measure counting prescriptions and finding the top medicines per service, exactly and with sketches.
+
+    Medicines follow a Zipf-like distribution and are written with several doses and cases,
+    so the counts only agree once the names are normalized.
+
+    :param n_prescriptions: The number of prescriptions.
+    :type n_prescriptions: int
+    :param n_medicines: The number of distinct medicines.
+    :type n_medicines: int
+    :param k: The number of top medicines queried.
+    :type k: int
+    :raises AssertionError: If the sketches miss a top medicine of the exact counts.
+    """
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, n_medicines + 1)]
+    spellings = ("{} 500mg", "{}", "{} 20 mg tablets", "{}")
+    prescriptions = [(rng.choice(SERVICES), rng.choice(spellings).format(f"Medicine{medicine}").upper()
+                      if rng.random() < 0.2 else rng.choice(spellings).format(f"Medicine{medicine}"))
+                     for medicine in rng.choices(range(n_medicines), weights, k=n_prescriptions)]
+
+    for sketch in (False, True):
+        statistics = MedicationStatistics(sketch=sketch)
+        _, add_time = _timed(lambda: [statistics.add(service, medicine) for service, medicine in prescriptions])
+        top, top_time = _timed(lambda: [statistics.top(k, service) for service in SERVICES for _ in range(100)])
+        if not sketch:
+            exact = statistics
+        else:
+            for service in SERVICES:
+                assert {name for name, _ in exact.top(k // 2, service)} <= \
+                    {name for name, _ in statistics.top(k, service)}, "The sketches missed a top medicine"
+        print(f"Medication statistics ({'sketch' if sketch else 'exact'}, {n_prescriptions} prescriptions, "
+              f"{len(exact.vocabulary)} medicines): {n_prescriptions / add_time:.0f} prescriptions/s - "
+              f"top {k} of a service {top_time / (100 * len(SERVICES)) * 1e6:.0f} us")
+
+
+def _jpeg(width: int, height: int, thumbnail: bytes, payload: bytes) -> bytes:
+    """ Build a JPEG file with a thumbnail in its EXIF segment, a frame header and any scan data.
+
+    :param width: The width in pixels.
+    :type width: int
+    :param height: The height in pixels.
+    :type height: int
+    :param thumbnail: The embedded thumbnail.
+    :type thumbnail: bytes
+    :param payload: The scan data, not decoded by anything in the benchmarks.
+    :type payload: bytes
+    :returns: The file content.
+    :rtype: bytes
+    """
+    tiff = (b"II*\x00" + struct.pack("<IHI", 8, 0, 14) + struct.pack("<H", 2)
+            + struct.pack("<HHII", 0x0201, 4, 1, 44) + struct.pack("<HHII", 0x0202, 4, 1, len(thumbnail))
+            + struct.pack("<I", 0) + thumbnail)
+    exif = b"Exif\x00\x00" + tiff
+    frame = struct.pack(">BHHB", 8, height, width, 3) + bytes(9)
+    return (b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+            + b"\xff\xc0" + struct.pack(">H", len(frame) + 2) + frame + b"\xff\xda" + payload + b"\xff\xd9")
+
+
+def bench_image_store(n_images: int = 48, image_megabytes: int = 8, seed: int = 0):
+    """ Measure ingesting large diagnostic images and opening a history with all of them.
+
+    Half of the uploads repeat an earlier image. Opening the history reads the metadata and
+    thumbnail of every image, first from the files and then from the caches, and is compared
+    with reading every file into memory.
+
+    :param n_images: The number of images uploaded to the history.
+    :type n_images: int
+    :param image_megabytes: The size of every image.
+    :type image_megabytes: int
+    :param seed: The seed of the random image content.
+    :type seed: int
+    :raises AssertionError: If a duplicate is stored twice or a thumbnail is not found.
+    """
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp()
+    try:
+        uploads = []
+        for n in range(n_images // 2):
+            path = os.path.join(directory, f"upload-{n}.jpg")
+            with open(path, "wb") as upload:
+                upload.write(_jpeg(4096, 4096, rng.randbytes(8000), rng.randbytes(image_megabytes << 20)))
+            uploads.append(path)
+        uploads += uploads
+
+        store = ImageStore(os.path.join(directory, "store"))
+        history = ClinicalHistory(Patient("1", "Patient 1"), VitalSigns(120, 37, 95, 16), "Radiology",
+                                  datetime(2023, 1, 1))
+        _, ingest_time = _timed(lambda: [store.attach(history, path) for path in uploads])
+        n_stored = sum(len(files) for _, _, files in os.walk(os.path.join(directory, "store")))
+        assert n_stored == n_images // 2, "A duplicate image was stored twice"
+
+        def view():
+            return [(image.metadata, image.thumbnail) for image in store.images(history)]
+
+        def read_all():
+            images = []
+            for image in store.images(history):
+                with open(store.path(image.reference), "rb") as content:
+                    images.append(content.read())
+            return images
+
+        tracemalloc.start()
+        (shown, cold_time), cold_peak = _timed(view), tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        _, warm_time = _timed(view)
+        tracemalloc.reset_peak()
+        _, read_time = _timed(read_all)
+        read_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert all(thumbnail is not None and metadata["width"] == 4096 for metadata, thumbnail in shown)
+
+        total_megabytes = n_images * image_megabytes
+        print(f"Image store ({n_images} uploads of {image_megabytes} MB, {n_stored} stored): "
+              f"ingest {total_megabytes / ingest_time:.0f} MB/s")
+        print(f"  open the history: {cold_time * 1000:.1f} ms cold, {warm_time * 1000:.2f} ms cached, "
+              f"peak {cold_peak / 2 ** 20:.1f} MB - reading every file {read_time * 1000:.0f} ms, "
+              f"peak {read_peak / 2 ** 20:.0f} MB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_export(n_histories: int = 1000000, seed: int = 0):
+    """ Compare writing clinical histories with ClinicalHistory.__str__ in a loop and with the exporters.
+
+    A fifth of the histories have evolution notes and exam results.
+
+    :param n_histories: The number of clinical histories.
+    :type n_histories: int
+    :param seed: The seed of the random histories.
+    :type seed: int
+    :raises AssertionError: If the columnar file does not give back the same histories.
+    """
+    rng = random.Random(seed)
+    histories = make_histories(n_histories, seed)
+    for history in histories:
+        if rng.random() < 0.2:
+            history.add_evolution_note(f"Patient stable, pain {rng.randrange(10)}/10, continue treatment")
+            history.add_exam_results(f"Hemoglobin {rng.uniform(9, 17):.1f} g/dL")
+
+    directory = tempfile.mkdtemp()
+    try:
+        def str_loop(path):
+            with open(path, "w", encoding="utf-8") as file:
+                for history in histories:
+                    file.write(str(history) + "\n")
+
+        def text_export(exporter):
+            return lambda path: exporter(histories, open(path, "w", newline="", encoding="utf-8"))
+
+        def binary_export(path):
+            with open(path, "wb") as file:
+                export_columnar(histories, file)
+
+        for name, export in (("__str__ loop", str_loop), ("JSON lines", text_export(export_jsonl)),
+                             ("CSV", text_export(export_csv)), ("columnar", binary_export)):
+            path = os.path.join(directory, name)
+            _, export_time = _timed(export, path)
+            print(f"Export {n_histories} histories as {name}: {export_time:.2f} s - "
+                  f"{n_histories / export_time:.0f} histories/s - {os.path.getsize(path) / 2 ** 20:.0f} MB")
+
+        with open(os.path.join(directory, "columnar"), "rb") as file:
+            restored, read_time = _timed(lambda: list(islice(histories_from_columnar(file), 1000)))
+        assert [history.to_dict() for history in restored] == [history.to_dict() for history in histories[:1000]], \
+            "The columnar file did not give back the same histories"
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_note_search(n_notes: int = 1000000, notes_per_history: int = 10, n_beds: int = 1000, seed: int = 0):
+    """ Measure indexing evolution notes and searching them by terms and phrases.
+
+    Most notes belong to archived histories indexed in bulk; the rest are written to the
+    histories of admitted patients and indexed one by one through the listener hooks.
+
+    :param n_notes: The number of notes.
+    :type n_notes: int
+    :param notes_per_history: The number of notes of every history.
+    :type notes_per_history: int
+    :param n_beds: The number of beds with admitted patients.
+    :type n_beds: int
+    :param seed: The seed of the random notes.
+    :type seed: int
+    :raises AssertionError: If a note written to an admitted patient is not found.
+    """
+    rng = random.Random(seed)
+    words = [f"word{n}" for n in range(20000)]
+    cumulative_weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    findings = ("suspected sepsis", "blood culture positive", "chest pain", "stable", "fever", "septic shock")
+
+    def notes(n):
+        for _ in range(n):
+            note = rng.choices(words, cum_weights=cumulative_weights, k=rng.randrange(5, 25))
+            yield " ".join(note) + " " + rng.choice(findings)
+
+    def archived_histories(n_histories):
+        for history in generate_histories(n_histories, seed):
+            for note in notes(notes_per_history):
+                history.add_evolution_note(note)
+            yield history
+
+    directory = tempfile.mkdtemp()
+    try:
+        beds = [Bed(n) for n in range(n_beds)]
+        index = NoteIndex(os.path.join(directory, "notes.db"), beds)
+        n_live = n_beds * notes_per_history
+        n_histories = (n_notes - n_live) // notes_per_history
+        _, bulk_time = _timed(index.add_histories, archived_histories(n_histories))
+
+        for bed, history in zip(beds, generate_histories(n_beds, seed + 1)):
+            bed.admit_patient(history, history.service)
+        live_notes = [(rng.choice(beds), note) for note in notes(n_live)]
+        _, live_time = _timed(lambda: [bed.clinical_history.add_evolution_note(note) for bed, note in live_notes])
+        index.flush()
+        assert any(match["history"] is live_notes[-1][0].clinical_history
+                   for match in index.search(f'"{live_notes[-1][1]}"')), "A new note was not found"
+
+        print(f"Note search ({len(index)} notes): bulk {n_histories * notes_per_history / bulk_time:.0f} notes/s - "
+              f"incremental {n_live / live_time:.0f} notes/s")
+        for query in ("sepsis", "word3 sepsis", '"blood culture positive"', "word19999", "word5 word7 fever"):
+            matches, search_time = _timed(lambda: [index.search(query) for _ in range(10)])
+            _, recent_time = _timed(lambda: [index.search(query, by_relevance=False) for _ in range(10)])
+            _, active_time = _timed(lambda: [index.search(query, include_archived=False) for _ in range(10)])
+            print(f"  {query!r}: top {len(matches[0])} histories by relevance {search_time * 100:.1f} ms - "
+                  f"latest {recent_time * 100:.1f} ms - admitted only {active_time * 100:.1f} ms")
+        index.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_vital_signs(n_patients: int = 100000, seed: int = 0):
+    """ Compare screening VitalSigns objects in a loop with VitalSignsTable.alerts.
+
+    :param n_patients: The number of monitored patients.
+    :type n_patients: int
+    :param seed: The seed of the random readings.
+    :type seed: int
+    :raises AssertionError: If both screenings disagree.
+    """
+    rng = random.Random(seed)
+    readings = [VitalSigns(rng.gauss(120, 15), rng.gauss(37, 0.8), rng.gauss(95, 3), rng.gauss(16, 4))
+                for _ in range(n_patients)]
+    table = VitalSignsTable()
+    for bed_number, vital_signs in enumerate(readings):
+        table.set(bed_number, vital_signs)
+
+    def loop():
+        alerts = {}
+        for bed_number, vital_signs in enumerate(readings):
+            for name, operator, value in VitalSignsTable.DEFAULT_ALERTS:
+                reading = getattr(vital_signs, name)
+                if reading < value if operator == "<" else reading > value:
+                    alerts.setdefault(bed_number, []).append((name, operator, value))
+        return alerts
+
+    expected, loop_time = _timed(loop)
+    alerts, table_time = _timed(table.alerts)
+    assert {key: sorted(value) for key, value in alerts.items()} == \
+        {key: sorted(value) for key, value in expected.items()}, "VitalSignsTable.alerts disagrees with the loop"
+    print(f"Vital signs screening ({n_patients} patients, {len(alerts)} alerting): "
+          f"loop {loop_time * 1000:.1f} ms - table {table_time * 1000:.1f} ms - speedup x{loop_time / table_time:.1f}")
+
+
+class _DictPatient:
+    """ Patient laid out with a per-instance __dict__, as before __slots__ were added. """
+
+    def __init__(self, patient_id, name, gender, birth_date):
+        self._id = patient_id
+        self._name = name
+        self._gender = gender
+        self._birth_date = birth_date
+
+
+class _DictVitalSigns:
+    """ VitalSigns laid out with a per-instance __dict__, as before __slots__ were added. """
+
+    def __init__(self, blood_pressure, temperature, oxygen_saturation, breathing_rate):
+        self._blood_pressure = blood_pressure
+        self._temperature = temperature
+        self._oxygen_saturation = oxygen_saturation
+        self._breathing_rate = breathing_rate
+
+
+class _DictClinicalHistory:
+    """ ClinicalHistory laid out with a per-instance __dict__ and eager lists, as before __slots__ were added. """
+
+    def __init__(self, patient_obj, vital_signs_obj, service, admission, discharge_date, chronic_disease):
+        self._patient = patient_obj
+        self._vital_signs = vital_signs_obj
+        self._service = service
+        self._admission_date = admission
+        self._discharge_date = discharge_date
+        self._chronic_disease = chronic_disease
+        self._evolution_notes = []
+        self._diagnostic_images = []
+        self._exam_results = []
+        self._medicines = []
+        self._vital_signs_history = None
+        self._listeners = ()
+
+
+def _bytes_per_record(build, n_records: int) -> float:
+    """ Measure the memory allocated per record by a record builder with tracemalloc.
+
+    :param build: A function building one record from its index.
+    :type build: callable
+    :param n_records: The number of records built.
+    :type n_records: int
+    :returns: The bytes allocated per record.
+    :rtype: float
+    """
+    gc.collect()
+    tracemalloc.start()
+    records = [build(n) for n in range(n_records)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return allocated / n_records
+
+
+def bench_memory(n_records: int = 100000):
+    """ Report the bytes per archived stay with the __slots__ classes and with __dict__ based ones.
+
+    Each stay is a clinical history with its own patient and vital signs and no notes,
+    images, exams or medicines, like most historical stays.
+
+    :param n_records: The number of stays built.
+    :type n_records: int
+    """
+    admission_date = datetime(2023, 1, 1)
+    birth_date = datetime(1980, 1, 1)
+
+    def slotted(n):
+        return ClinicalHistory(Patient(str(n), "Name", "F", birth_date), VitalSigns(120.0, 37.0, 95.0, 16.0),
+                               "Cardiology", admission_date, None, False)
+
+    def with_dict(n):
+        return _DictClinicalHistory(_DictPatient(str(n), "Name", "F", birth_date),
+                                    _DictVitalSigns(120.0, 37.0, 95.0, 16.0), "Cardiology", admission_date, None, False)
+
+    before = _bytes_per_record(with_dict, n_records)
+    after = _bytes_per_record(slotted, n_records)
+    print(f"Memory per stay ({n_records} stays): __dict__ {before:.0f} B - __slots__ {after:.0f} B - "
+          f"saving {100 * (1 - after / before):.0f} %")
+
+
+def bench_event_log(n_events: int = 10000000, n_beds: int = 1000, seed: int = 0):
+    """ Measure the events written per second by EventJournal and its recovery time.
+
+    Each stay journals an admission, eight updates and a release. Recovery is measured by
+    replaying the whole journal, then again after a snapshot followed by a short tail, and
+    checks that the monitor readings of a patient admitted before the snapshot come back.
+    A restart of a ward with a single admitted patient first checks that every bed comes back.
+
+    :param n_events: The number of events written.
+    :type n_events: int
+    :param n_beds: The number of beds receiving the stays.
+    :type n_beds: int
+    :param seed: The seed of the random bed choice.
+    :type seed: int
+    """
+    directory = tempfile.mkdtemp()
+    rng = random.Random(seed)
+    patient = Patient("1", "Bench", "F", datetime(1980, 1, 1))
+    vital_signs = VitalSigns(120, 37, 95, 16)
+    admission_date = datetime(2023, 1, 1)
+    beds = [Bed(n) for n in range(1, n_beds + 1)]
+
+    def write(n_stays):
+        for _ in range(n_stays):
+            bed = beds[rng.randrange(n_beds)]
+            if bed.occupied:
+                bed.release_patient()
+            history = ClinicalHistory(patient, vital_signs, "Cardiology", admission_date)
+            bed.admit_patient(history, "Cardiology")
+            for note in range(4):
+                history.add_evolution_note(f"Evolution note {note}")
+                history.add_medicine("Paracetamol 500mg")
+            bed.release_patient()
+
+    def recover(n_recovered_beds=n_beds + 1, path=directory):
+        recovery_journal = EventJournal(path)
+        recovered = recovery_journal.recover([Bed(n) for n in range(1, n_recovered_beds + 1)])
+        recovery_journal.close()
+        return recovered
+
+    try:
+        restart_directory = os.path.join(directory, "restart")
+        journal = EventJournal(restart_directory)
+        ward = [Bed(n) for n in range(1, 301)]
+        journal.attach(ward)
+        ward[4].admit_patient(ClinicalHistory(patient, vital_signs, "Cardiology", admission_date), "Cardiology")
+        journal.close()
+        restarted = recover(300, restart_directory)
+        assert len(restarted) == 300 and [bed.number for bed in restarted if bed.occupied] == [5], \
+            "The restart lost beds"
+        shutil.rmtree(restart_directory)
+
+        journal = EventJournal(directory, snapshot_every=None)
+        journal.attach(beds)
+        _, write_time = _timed(write, n_events // 10)
+        journal.flush()
+        written = journal.sequence
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        recovered, replay_time = _timed(recover)
+        assert len(recovered) == n_beds + 1, "The replay lost beds"
+        assert {bed.number for bed in recovered if bed.occupied} == {bed.number for bed in beds if bed.occupied}, \
+            "The replay disagrees with the beds"
+
+        monitored = Bed(n_beds + 1)
+        journal.attach([monitored])
+        monitored.admit_patient(ClinicalHistory(patient, vital_signs, "Cardiology", admission_date), "Cardiology")
+        for minute in range(1500):
+            monitored.clinical_history.add_vital_signs_reading(VitalSigns(120 + minute % 7, 37, 95, 16),
+                                                               admission_date + timedelta(minutes=minute))
+        journal.snapshot()
+        write(1000)
+        journal.close()
+        recovered, snapshot_time = _timed(recover)
+        readings = {bed.number: bed for bed in recovered}[monitored.number].clinical_history.vital_signs_history
+        assert readings is not None and readings.to_dict() == monitored.clinical_history.vital_signs_history.to_dict(), \
+            "The snapshot lost the monitor readings"
+        print(f"Event journal ({written} events, {size / 2 ** 20:.0f} MiB): "
+              f"write {written / write_time:.0f} events/s - full replay {replay_time:.2f} s - "
+              f"snapshot and 10000 events replay {snapshot_time:.2f} s")
+    finally:
+        shutil.rmtree(directory)
+
+
+def _ward_workload(ward, n_operations: int, seed: int) -> list:
+    """ Run random admissions, notes and discharges on a ward from the calling thread.
+
+    :param ward: The ward receiving the operations.
+    :type ward: WardService
+    :param n_operations: The number of operations.
+    :type n_operations: int
+    :param seed: The seed of the random operations.
+    :type seed: int
+    :returns: The clinical histories admitted by this thread.
+    :rtype: list[ClinicalHistory]
+    """
+    rng = random.Random(seed)
+    numbers = [bed.number for bed in ward.beds]
+    patient = Patient(str(seed), f"Patient {seed}")
+    vital_signs = VitalSigns(120, 37, 95, 16)
+    admitted = []
+    for _ in range(n_operations):
+        choice = rng.random()
+        try:
+            if choice < 0.4:
+                history = ClinicalHistory(patient, vital_signs, rng.choice(SERVICES), datetime(2023, 1, 1))
+                ward.admit(history, history.service)
+                admitted.append(history)
+            elif choice < 0.8:
+                ward.update_history(rng.choice(numbers), lambda history: history.add_evolution_note(str(seed)))
+            else:
+                ward.discharge(rng.choice(numbers), datetime(2023, 1, 2))
+        except (BedEmptyError, NoBedAvailableError):
+            pass
+    return admitted
+
+
+def _run_ward_threads(n_threads: int, n_operations: int, n_beds: int):
+    """ Run the ward workload on several threads sharing one ward.
+
+    :returns: The ward, its statistics, the histories admitted by every thread and the elapsed seconds.
+    :rtype: tuple[WardService, WardStatistics, list[ClinicalHistory], float]
+    """
+    ward = WardService(Bed(n) for n in range(1, n_beds + 1))
+    statistics = WardStatistics(ward.beds)
+    results = [None] * n_threads
+
+    def work(index):
+        results[index] = _ward_workload(ward, n_operations // n_threads, index)
+
+    threads = [threading.Thread(target=work, args=(index,)) for index in range(n_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return ward, statistics, [history for admitted in results for history in admitted], elapsed
+
+
+def stress_ward_service(n_threads: int = 16, n_operations: int = 200000, n_beds: int = 200):
+    """ Hammer a WardService from many threads and check that no update was lost.
+
+    The interpreter switch interval is lowered while the threads run so they interleave
+    as often as possible.
+
+    :raises AssertionError: If the beds, the pool or the statistics disagree after the run.
+    """
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        ward, statistics, admitted, _ = _run_ward_threads(n_threads, n_operations, n_beds)
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    occupied = [bed for bed in ward.beds if bed.occupied]
+    in_beds = [bed.clinical_history for bed in occupied]
+    assert len(set(map(id, in_beds))) == len(in_beds), "A clinical history is in two beds"
+    assert statistics.occupied_beds == len(occupied), "The statistics lost an admission or a release"
+    assert sum(statistics.admissions_per_service.values()) == len(admitted), "The statistics lost an admission"
+    assert sum(statistics.admissions_per_service.values()) - sum(statistics.discharges_per_service.values()) == \
+        len(occupied), "Admissions and discharges do not add up"
+    assert ward.pool.free_count() == n_beds - len(occupied), "The pool lost or duplicated a free bed"
+    discharged = [history for history in admitted if history.discharge_date is not None]
+    assert len(discharged) == sum(statistics.discharges_per_service.values()), "A discharge was lost"
+    print(f"Ward stress ({n_threads} threads, {n_operations} operations): consistent - "
+          f"{len(admitted)} admissions, {len(discharged)} discharges, {len(occupied)} beds occupied")
+
+
+def bench_ward_service(thread_counts=(1, 2, 4, 8, 16), n_operations: int = 200000, n_beds: int = 2000):
+    """ Measure the WardService operations per second as the number of threads grows.
+
+    :param thread_counts: The numbers of threads measured.
+    :type thread_counts: tuple[int]
+    :param n_operations: The number of operations shared by the threads.
+    :type n_operations: int
+    :param n_beds: The number of beds of the ward.
+    :type n_beds: int
+    """
+    stress_ward_service()
+    for n_threads in thread_counts:
+        *_, elapsed = _run_ward_threads(n_threads, n_operations, n_beds)
+        print(f"Ward service ({n_threads} threads): {n_operations / elapsed:.0f} operations/s")
+
+
+async def _http_request(reader, writer, method: str, path: str, payload=None) -> tuple:
+    """ Send an HTTP request on a kept alive connection and read its JSON response.
+
+    :returns: The HTTP status and the decoded payload.
+    :rtype: tuple[int, object]
+    """
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                 + body)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def _http_load(port: int, rate: int, duration: float, n_connections: int, seed: int) -> list:
+    """ Send requests at a fixed rate over kept alive connections and measure their latency.
+
+    Requests are scheduled in advance, rate per second, and each latency is measured from the
+    scheduled time, so a slow server is not hidden by the client sending less. The mix is 40 %
+    admissions, 30 % annotations, 20 % discharges and 10 % reports.
+
+    :returns: The latencies in seconds.
+    :rtype: list[float]
+    """
+    rng = random.Random(seed)
+    connections = [await asyncio.open_connection("127.0.0.1", port) for _ in range(n_connections)]
+    idle = asyncio.Queue()
+    for connection in connections:
+        idle.put_nowait(connection)
+    latencies = []
+    n_requests = int(rate * duration)
+
+    async def send(n, scheduled):
+        choice = rng.random()
+        if choice < 0.4:
+            request = ("POST", "/admit", {
+                "patient_id": str(n), "name": f"Patient {n}", "gender": "F", "birth_date": "1990-01-01",
+                "blood_pressure": 120, "temperature": 37, "oxygen_saturation": 95, "breathing_rate": 16,
+                "admission_date": "2023-10-15 02:40", "service": rng.choice(SERVICES)})
+        elif choice < 0.7:
+            request = ("POST", "/annotate", {"bed": rng.randint(1, 300), "attribute": "medicine",
+                                             "value": rng.choice(MEDICINES)})
+        elif choice < 0.9:
+            request = ("POST", "/discharge", {"bed": rng.randint(1, 300), "discharge_date": "2023-10-18 12:00"})
+        else:
+            request = ("GET", "/report", None)
+        reader, writer = await idle.get()
+        try:
+            await _http_request(reader, writer, *request)
+        finally:
+            idle.put_nowait((reader, writer))
+        latencies.append(time.perf_counter() - scheduled)
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    start = time.perf_counter()
+    for n in range(n_requests):
+        scheduled = start + n / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(loop.create_task(send(n, scheduled)))
+    await asyncio.gather(*tasks)
+    for _, writer in connections:
+        writer.close()
+    return latencies
+
+
+def bench_ward_server(rate: int = 1000, duration: float = 10, n_connections: int = 32, seed: int = 0):
+    """ Measure the p50 and p99 latency of WardServer under a fixed request rate on localhost.
+
+    The server runs its own event loop in a thread, the load generator in the main thread.
+
+    :param rate: The requests sent per second.
+    :type rate: int
+    :param duration: The seconds the load lasts.
+    :type duration: float
+    :param n_connections: The number of kept alive connections the requests are spread over.
+    :type n_connections: int
+    """
+    loop = asyncio.new_event_loop()
+    server = WardServer([Bed(n) for n in range(1, 301)], SERVICES)
+    port = loop.run_until_complete(server.start(port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        latencies = sorted(asyncio.run(_http_load(port, rate, duration, n_connections, seed)))
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"Ward server at {rate} requests/s for {duration} s: p50 {p50:.2f} ms - p99 {p99:.2f} ms - "
+          f"max {latencies[-1] * 1000:.2f} ms")
+
+
+def bench_topology(n_sites: int = 40, n_wards: int = 25, n_beds: int = 40, fill: float = 0.75, n_updates: int = 100,
+                   seed: int = 0):
+    """ Measure admission routing and the merged reports of a hospital network.
+
+    Every site has one ward admitting any service and specialized wards for the others.
+    The network is filled by routing admissions to the least loaded ward, then its report
+    merged from the per ward accumulators is compared with a report over every admitted
+    patient, before and after some prescriptions change a few wards.
+
+    :param n_sites: The number of sites.
+    :type n_sites: int
+    :param n_wards: The number of wards of each site.
+    :type n_wards: int
+    :param n_beds: The number of beds of each ward.
+    :type n_beds: int
+    :param fill: The fraction of beds occupied.
+    :type fill: float
+    :param n_updates: The number of prescriptions added before the last report.
+    :type n_updates: int
+    :param seed: The seed of the random generator.
+    :type seed: int
+    :raises AssertionError: If the merged report disagrees with the flat one.
+    """
+    rng = random.Random(seed)
+    network = HospitalNetwork.from_config({"sites": [
+        {"name": f"Site {site}", "wards": [{"name": f"Ward {ward}", "beds": n_beds,
+                                            "services": [SERVICES[ward % len(SERVICES)]] if ward else None}
+                                           for ward in range(n_wards)]}
+        for site in range(n_sites)]})
+    total_beds = network.total_beds
+    histories = make_histories(int(total_beds * fill), seed)
+
+    def admit():
+        for history in histories:
+            network.admit(history, history.service)
+
+    def scan_routes():
+        wards = network.wards
+        for history in histories[:1000]:
+            min((ward for ward in wards if ward.accepts(history.service)), key=lambda ward: ward.load)
+
+    def flat():
+        return Report.compute_all((bed.clinical_history for bed in network.beds if bed.occupied), None, total_beds)
+
+    _, admit_time = _timed(admit)
+    _, scan_time = _timed(scan_routes)
+    expected, flat_time = _timed(flat)
+    merged, cold_time = _timed(network.report)
+    assert merged == expected, "The merged network report disagrees with the flat one"
+    occupied = [bed for bed in network.beds if bed.occupied]
+    updated = rng.choices(occupied, k=n_updates)
+    for bed in updated:
+        bed.clinical_history.add_medicine(rng.choice(MEDICINES))
+    changed = len({network.ward_of(bed.number) for bed in updated})
+    merged, warm_time = _timed(network.report)
+    assert merged == flat(), "The merged network report disagrees with the flat one after the updates"
+    _, site_time = _timed(network.site_reports)
+    print(f"Topology ({n_sites} sites, {len(network.wards)} wards, {total_beds} beds, {len(histories)} admitted): "
+          f"routed admission {admit_time / len(histories) * 1e6:.1f} us - "
+          f"scan routing {scan_time / 1000 * 1e6:.1f} us")
+    print(f"Network report: flat {flat_time:.3f} s - merged cold {cold_time:.3f} s - "
+          f"merged after {n_updates} prescriptions in {changed} wards {warm_time:.3f} s - "
+          f"every site report {site_time:.3f} s")
+
+
+def bench_bed_assignment(n_beds: int = 3000, days: int = 365, load: float = 0.9, seed: int = 0):
+    """ Replay a year of synthetic admissions with several bed assignment rules.
+
+    Every service gets a block of beds in proportion to its expected bed days, the last fifth of the
+    ward being shared. Admissions arrive at a seasonal rate filling about ``load`` of the
+    beds, with a length of stay depending on the service. Each rule is measured by the
+    cost of an allocation, the admissions refused for lack of a bed, the admissions placed
+    in a bed of their own service block, and the daily gap between the most and the least
+    occupied blocks.
+
+    :param n_beds: The number of beds of the ward.
+    :type n_beds: int
+    :param days: The number of days replayed.
+    :type days: int
+    :param load: The expected fraction of occupied beds.
+    :type load: float
+    :param seed: The seed of the random generator.
+    :type seed: int
+    """
+    rng = random.Random(seed)
+    weights = (8, 6, 4, 5, 3, 2, 1, 2)
+    mean_stays = (5, 4, 3, 6, 7, 10, 1, 12)
+    cum_weights = list(accumulate(weights))
+    mean_stay = sum(weight * stay for weight, stay in zip(weights, mean_stays)) / cum_weights[-1]
+    rate = load * n_beds / mean_stay
+    admissions, moment = [], 0.0
+    while True:
+        moment += rng.expovariate(rate * (1 + 0.2 * math.sin(2 * math.pi * moment / 365)))
+        if moment >= days:
+            break
+        service = rng.choices(range(len(SERVICES)), cum_weights=cum_weights)[0]
+        admissions.append((moment, service, rng.expovariate(1 / mean_stays[service])))
+
+    blocks, first = {}, 1
+    for service, weight, stay in zip(SERVICES, weights, mean_stays):
+        size = int(n_beds * 0.8 * weight * stay / (mean_stay * cum_weights[-1]))
+        blocks[service] = range(first, first + size)
+        first += size
+    home = {number: service for service, numbers in blocks.items() for number in numbers}
+    histories = [ClinicalHistory(Patient(str(n), service), VitalSigns(), service, datetime(2023, 1, 1))
+                 for n, service in enumerate(SERVICES)]
+    keep_free = {service: max(1, len(numbers) // 20) for service, numbers in blocks.items()}
+    quotas = {service: int(len(numbers) * 1.5) for service, numbers in blocks.items()}
+    rules = {
+        "first free": {},
+        "service blocks": {"service_beds": blocks},
+        "blocks + borrowing": {"service_beds": blocks, "borrow": {None: SERVICES}, "keep_free": keep_free},
+        "blocks + borrowing + quotas": {"service_beds": blocks, "borrow": {None: SERVICES}, "keep_free": keep_free,
+                                        "quotas": quotas},
+    }
+    print(f"Bed assignment ({n_beds} beds, {days} days, {len(admissions)} admissions):")
+    for name, options in rules.items():
+        beds = [Bed(n) for n in range(1, n_beds + 1)]
+        pool = BedPool(beds, **options)
+        discharges, allocation_time, refused, on_service, spreads, day = [], 0.0, 0, 0, [], 0
+        for moment, service, stay in admissions:
+            while discharges and discharges[0][0] <= moment:
+                beds[heapq.heappop(discharges)[1] - 1].release_patient()
+            if moment >= day:
+                rates = [sum(beds[number - 1].occupied for number in numbers) / len(numbers)
+                         for numbers in blocks.values()]
+                spreads.append(max(rates) - min(rates))
+                day += 1
+            start = time.perf_counter()
+            bed = pool.take(SERVICES[service])
+            if bed is not None:
+                bed.admit_patient(histories[service], SERVICES[service])
+            allocation_time += time.perf_counter() - start
+            if bed is None:
+                refused += 1
+                continue
+            on_service += home.get(bed.number) == SERVICES[service]
+            heapq.heappush(discharges, (moment + stay, bed.number))
+        print(f"  {name}: allocation {allocation_time / len(admissions) * 1e6:.2f} us - "
+              f"refused {refused / len(admissions):.2%} - in own service block {on_service / len(admissions):.1%} - "
+              f"daily spread of block occupancy {sum(spreads) / len(spreads):.1%}")
+
+
+def bench_simulation(n_beds: int = 3000, rates=(25, 50, 100), days: int = 7, seed: int = 0):
+    """ Run the discrete-event simulation at growing admission rates to find where the ward stops keeping up.
+
+    Each rate runs on new beds for the same simulated days, then the lowest rate runs again
+    with tracemalloc to measure the memory each operation leaves allocated.
+
+    :param n_beds: The number of beds.
+    :type n_beds: int
+    :param rates: The mean admissions per simulated hour.
+    :type rates: tuple[float]
+    :param days: The simulated days of each run.
+    :type days: int
+    :param seed: The seed of the synthetic workload.
+    :type seed: int
+    """
+    for rate in rates:
+        simulation = Simulation([Bed(n) for n in range(1, n_beds + 1)], workload=SyntheticWorkload(seed),
+                                arrival_rate=rate, report_period=6)
+        summary = simulation.run(24 * days)
+        print(f"Simulation ({n_beds} beds, {rate} admissions/hour, {days} days): {summary['wall_time']:.2f} s - "
+              f"{summary['events_per_second']:.0f} events/s - peak {summary['peak_occupied']} beds occupied")
+        for stats in simulation.stats.values():
+            print(f"  {stats}")
+    simulation = Simulation([Bed(n) for n in range(1, n_beds + 1)], workload=SyntheticWorkload(seed),
+                            arrival_rate=rates[0], report_period=6, trace_memory=True)
+    summary = simulation.run(24 * days)
+    print(f"Traced memory ({rates[0]} admissions/hour): peak {summary['peak_memory'] / 2 ** 20:.1f} MiB - " +
+          " - ".join(f"{name} {stats['bytes_per_operation']:.0f} bytes/op"
+                     for name, stats in summary["operations"].items()))
+
+
+def bench_instrumentation(n_beds: int = 100000, n_histories: int = 200000):
+    """ Measure the cost of the instrumentation on admissions, prescriptions, releases and reports.
+
+    The same work runs before enabling the instrumentation, while it is enabled and after
+    disabling it, to check that a disabled instrumentation costs nothing.
+
+    :param n_beds: The number of beds admitted, prescribed to and released.
+    :type n_beds: int
+    :param n_histories: The number of clinical histories reported on.
+    :type n_histories: int
+    """
+    beds = [Bed(n) for n in range(1, n_beds + 1)]
+    history = ClinicalHistory(Patient("1", "Bench"), VitalSigns(), "Cardiology", datetime(2023, 1, 1))
+    histories = make_histories(n_histories)
+
+    def ward():
+        for bed in beds:
+            bed.admit_patient(history, "Cardiology")
+            history.add_medicine("Lisinopril")
+        for bed in beds:
+            bed.release_patient()
+        history.medicines.clear()
+
+    def report():
+        return Report.compute_all(histories, None, n_histories)
+
+    instrumentation = Instrumentation()
+    timings = {}
+    for phase in ("before", "enabled", "disabled"):
+        if phase == "enabled":
+            instrumentation.enable()
+        elif phase == "disabled":
+            instrumentation.disable()
+        timings[phase] = (min(_timed(ward)[1] for _ in range(3)), min(_timed(report)[1] for _ in range(3)))
+    operations = 3 * n_beds
+    print(f"Instrumentation ({operations} bed and history operations, reports of {n_histories} histories):")
+    for phase, (ward_time, report_time) in timings.items():
+        print(f"  {phase}: {ward_time / operations * 1e9:.0f} ns per operation - report {report_time:.3f} s")
+    text, export_time = _timed(instrumentation.to_prometheus)
+    print(f"  Prometheus export: {len(text.splitlines())} lines in {export_time * 1000:.2f} ms")
+
+
+BENCHMARKS = {
+    "beds": bench_bed_allocation,
+    "bed_assignment": bench_bed_assignment,
+    "report": bench_report,
+    "report_stream": bench_report_stream,
+    "parallel_report": bench_parallel_report,
+    "length_of_stay": bench_length_of_stay,
+    "discharge_archive": bench_discharge_archive,
+    "census": bench_census,
+    "medication_stats": bench_medication_stats,
+    "note_search": bench_note_search,
+    "image_store": bench_image_store,
+    "export": bench_export,
+    "vital_signs": bench_vital_signs,
+    "memory": bench_memory,
+    "event_log": bench_event_log,
+    "ward_service": bench_ward_service,
+    "ward_server": bench_ward_server,
+    "topology": bench_topology,
+    "simulation": bench_simulation,
+    "instrumentation": bench_instrumentation,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,318 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta
+
+""" Origin and unit of the epoch seconds the census events are stored as """
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+class CensusTimeline:
+    """
+    Class used to know how many beds were occupied at any past time, per medical service.
+
+    Every admission adds a +1 event at its admission date and every discharge a -1 event
+    at its discharge date, on the timeline of its service and on the one of the whole
+    hospital. Each timeline keeps its events sorted by time with a segment tree of their
+    sums and highest prefix sums, so the occupancy at a time and the highest occupancy in a
+    time range are answered in O(log n). Events arriving in time order, as they do from the
+    bed listener hooks, update the tree in O(log n); late events rebuild it on the next query.
+    """
+
+    def __init__(self, beds=()):
+        """ CensusTimeline constructor object.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        self._timelines = {None: _Timeline()}
+        self._lock = threading.RLock()
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start following some beds, adding the admissions of the patients already admitted.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                self.patient_admitted(bed, bed.clinical_history)
+
+    def add_history(self, clinical_history):
+        """ Add the admission and, if discharged, the discharge of a clinical history, for example an archived one.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        """
+        self.add_histories((clinical_history,))
+
+    def add_histories(self, histories):
+        """ Add the admissions and discharges of many clinical histories, merging them into the timelines at once.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        """
+        events = {None: []}
+        for clinical_history in histories:
+            service_events = events.setdefault(clinical_history.service, [])
+            admitted = (clinical_history.admission_date - _EPOCH) // _SECOND
+            service_events.append((admitted, 1))
+            events[None].append((admitted, 1))
+            if clinical_history.discharge_date is not None:
+                discharged = (clinical_history.discharge_date - _EPOCH) // _SECOND
+                service_events.append((discharged, -1))
+                events[None].append((discharged, -1))
+        with self._lock:
+            for service, service_events in events.items():
+                if service_events:
+                    self._timelines.setdefault(service, _Timeline()).extend(service_events)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that adds the admission. """
+        with self._lock:
+            self._add_event(clinical_history.service, clinical_history.admission_date or datetime.now(), 1)
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that adds the discharge, at the discharge date or now if it is unset. """
+        with self._lock:
+            self._add_event(clinical_history.service, clinical_history.discharge_date or datetime.now(), -1)
+
+    def _add_event(self, service: str, moment: datetime, change: int):
+        """ Add an occupancy change to the timelines of a service and of the hospital. The caller holds the lock.
+
+        :param service: The medical service.
+        :type service: str
+        :param moment: The time of the change.
+        :type moment: datetime
+        :param change: +1 for an admission, -1 for a discharge.
+        :type change: int
+        """
+        seconds = (moment - _EPOCH) // _SECOND
+        timeline = self._timelines.get(service)
+        if timeline is None:
+            timeline = self._timelines[service] = _Timeline()
+        timeline.add(seconds, change)
+        self._timelines[None].add(seconds, change)
+
+    def occupancy(self, moment: datetime, service: str = None) -> int:
+        """ Get the number of occupied beds at a time.
+
+        :param moment: The time.
+        :type moment: datetime
+        :param service: The medical service, the whole hospital if None.
+        :type service: str
+        :returns: The occupied beds, counting the changes made exactly at that time.
+        :rtype: int
+        """
+        with self._lock:
+            timeline = self._timelines.get(service)
+            return timeline.occupancy((moment - _EPOCH) // _SECOND) if timeline is not None else 0
+
+    def max_occupancy(self, since: datetime, until: datetime, service: str = None) -> int:
+        """ Get the highest number of occupied beds in a time range.
+
+        :param since: The start of the range, included.
+        :type since: datetime
+        :param until: The end of the range, included.
+        :type until: datetime
+        :param service: The medical service, the whole hospital if None.
+        :type service: str
+        :returns: The highest occupancy reached in the range.
+        :rtype: int
+        """
+        with self._lock:
+            timeline = self._timelines.get(service)
+            if timeline is None:
+                return 0
+            return timeline.max_occupancy((since - _EPOCH) // _SECOND, (until - _EPOCH) // _SECOND)
+
+    def daily_peaks(self, first_day: date, last_day: date, service: str = None) -> dict:
+        """ Get the highest number of occupied beds of every day in a range of days.
+
+        :param first_day: The first day.
+        :type first_day: date
+        :param last_day: The last day, included.
+        :type last_day: date
+        :param service: The medical service, the whole hospital if None.
+        :type service: str
+        :returns: A dictionary mapping each day to its highest occupancy.
+        :rtype: dict[date, int]
+        """
+        peaks = {}
+        day = first_day
+        while day <= last_day:
+            start = datetime.combine(day, time())
+            peaks[day] = self.max_occupancy(start, start + timedelta(days=1) - _SECOND, service)
+            day += timedelta(days=1)
+        return peaks
+
+    @property
+    def services(self) -> list:
+        """ Get the medical services with a timeline.
+
+        :returns: The medical services in name order.
+        :rtype: list[str]
+        """
+        return sorted(service for service in self._timelines if service is not None)
+
+
+class _Timeline:
+    """
+    Occupancy changes of one timeline, sorted by time, with a segment tree over them.
+
+    Changes made at the same time are merged, so a patient leaving a bed as another takes
+    it does not count as a moment with both. Every node of the tree keeps the sum of the
+    changes below it and the highest sum of a prefix of them, zero for the empty prefix.
+    """
+
+    __slots__ = ("_times", "_changes", "_sums", "_best", "_size", "_dirty")
+
+    def __init__(self):
+        """ _Timeline constructor object. """
+        self._times = array("q")
+        self._changes = array("q")
+        self._size = 1
+        self._sums = array("q", [0, 0])
+        self._best = array("q", [0, 0])
+        self._dirty = False
+
+    def add(self, seconds: int, change: int):
+        """ Add an occupancy change. Changes made at the same time are kept as a single one.
+
+        :param seconds: The time of the change in epoch seconds.
+        :type seconds: int
+        :param change: The change of occupancy.
+        :type change: int
+        """
+        times, changes = self._times, self._changes
+        position = bisect_left(times, seconds)
+        if position < len(times) and times[position] == seconds:
+            changes[position] += change
+        elif position < len(times):
+            times.insert(position, seconds)
+            changes.insert(position, change)
+            self._dirty = True
+            return
+        else:
+            times.append(seconds)
+            changes.append(change)
+        if self._dirty or position >= self._size:
+            self._dirty = True
+        else:
+            self._set_leaf(position, changes[position])
+
+    def extend(self, events: list):
+        """ Add many occupancy changes, merging them with the ones already added.
+
+        :param events: Tuples of (time in epoch seconds, change of occupancy), in any order.
+        :type events: list[tuple[int, int]]
+        """
+        merged = {}
+        for seconds, change in sorted(list(zip(self._times, self._changes)) + events):
+            merged[seconds] = merged.get(seconds, 0) + change
+        self._times = array("q", merged)
+        self._changes = array("q", merged.values())
+        self._dirty = True
+
+    def _set_leaf(self, position: int, change: int):
+        """ Set the change of a leaf and update the nodes above it.
+
+        :param position: The position of the change.
+        :type position: int
+        :param change: The change of occupancy.
+        :type change: int
+        """
+        sums, best = self._sums, self._best
+        node = position + self._size
+        sums[node] = change
+        best[node] = max(0, change)
+        node >>= 1
+        while node:
+            left, right = 2 * node, 2 * node + 1
+            sums[node] = sums[left] + sums[right]
+            best[node] = max(best[left], sums[left] + best[right])
+            node >>= 1
+
+    def _rebuild(self):
+        """ Build the tree again over every change, with room for as many new ones. """
+        size = 1
+        while size < 2 * len(self._changes):
+            size *= 2
+        sums = array("q", bytes(16 * size))
+        best = array("q", bytes(16 * size))
+        for position, change in enumerate(self._changes):
+            sums[size + position] = change
+            best[size + position] = max(0, change)
+        for node in range(size - 1, 0, -1):
+            left, right = 2 * node, 2 * node + 1
+            sums[node] = sums[left] + sums[right]
+            best[node] = max(best[left], sums[left] + best[right])
+        self._size, self._sums, self._best, self._dirty = size, sums, best, False
+
+    def _query(self, start: int, stop: int) -> tuple:
+        """ Get the sum and the highest prefix sum of the changes in a range of positions.
+
+        :param start: The first position.
+        :type start: int
+        :param stop: The position after the last one.
+        :type stop: int
+        :returns: The sum and the highest prefix sum.
+        :rtype: tuple[int, int]
+        """
+        if self._dirty:
+            self._rebuild()
+        sums, best = self._sums, self._best
+        start += self._size
+        stop += self._size
+        total, highest = 0, 0
+        right_nodes = []
+        while start < stop:
+            if start & 1:
+                highest = max(highest, total + best[start])
+                total += sums[start]
+                start += 1
+            if stop & 1:
+                stop -= 1
+                right_nodes.append(stop)
+            start >>= 1
+            stop >>= 1
+        for node in reversed(right_nodes):
+            highest = max(highest, total + best[node])
+            total += sums[node]
+        return total, highest
+
+    def occupancy(self, seconds: int) -> int:
+        """ Get the occupancy after the changes made up to a time, included. """
+        return self._query(0, bisect_right(self._times, seconds))[0]
+
+    def max_occupancy(self, since: int, until: int) -> int:
+        """ Get the highest occupancy between two times, included. """
+        start = bisect_right(self._times, since)
+        occupancy = self._query(0, start)[0]
+        return occupancy + self._query(start, bisect_right(self._times, until))[1]
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+
+    beds = [Bed(n) for n in range(1, 4)]
+    census = CensusTimeline(beds)
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    start = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    for hours, bed in enumerate(beds):
+        bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology",
+                                          start + timedelta(hours=hours)), "Cardiology")
+    beds[0].clinical_history.discharge_date = start + timedelta(hours=5)
+    beds[0].release_patient()
+
+    print("Occupancy at 03:00: ", census.occupancy(start + timedelta(minutes=20)))
+    print("Highest occupancy that day: ", census.max_occupancy(start, start + timedelta(days=1), "Cardiology"))
+    print("Occupancy at 08:00: ", census.occupancy(start + timedelta(hours=6)))
+    print("Daily peaks: ", census.daily_peaks(date(2023, 10, 14), date(2023, 10, 16)))
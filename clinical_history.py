@@ -1,11 +1,19 @@
 from datetime import datetime
 
+from patient import Patient
+from vital_signs import VitalSigns
+from vital_signs_history import VitalSignsSeries
+
 
 class ClinicalHistory:
     """
     Class used to represent a patient's clinical history.
     """
 
+    __slots__ = ("_patient", "_vital_signs", "_service", "_admission_date", "_discharge_date", "_chronic_disease",
+                 "_evolution_notes", "_diagnostic_images", "_exam_results", "_medicines", "_vital_signs_history",
+                 "_listeners")
+
     def __init__(self, patient_obj: object, vital_signs_obj: object, service: str = "",
                  admission: datetime = datetime(1900, 1, 1, 00, 00),
                  discharge_date: datetime = None, chronic_disease: bool = False):
@@ -32,10 +40,43 @@ class ClinicalHistory:
         self._admission_date = admission
         self._discharge_date = discharge_date
         self._chronic_disease = chronic_disease
-        self._evolution_notes = []
-        self._diagnostic_images = []
-        self._exam_results = []
-        self._medicines = []
+        self._evolution_notes = None
+        self._diagnostic_images = None
+        self._exam_results = None
+        self._medicines = None
+        self._vital_signs_history = None
+        self._listeners = ()
+
+    def add_listener(self, listener):
+        """ Register a listener notified whenever the clinical history changes.
+
+        The listener must implement ``history_updated(clinical_history, attribute, value)``.
+
+        :param listener: The object to notify.
+        :type listener: object
+        """
+        if listener not in self._listeners:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        """ Unregister a listener previously added with add_listener.
+
+        :param listener: The object to stop notifying.
+        :type listener: object
+        """
+        self._listeners = tuple(item for item in self._listeners if item is not listener)
+
+    def _notify(self, attribute: str, value):
+        """ Notify the listeners that an attribute of the clinical history changed.
+
+        :param attribute: The name of the attribute that changed.
+        :type attribute: str
+        :param value: The new value, the item added for list attributes, or a (timestamp, vital signs)
+            tuple for a vital signs reading.
+        :type value: object
+        """
+        for listener in self._listeners:
+            listener.history_updated(self, attribute, value)
 
     def add_evolution_note(self, note: str):
         """ Add an evolution note to the clinical history.
@@ -43,7 +84,11 @@ class ClinicalHistory:
         :param note: The evolution note to add.
         :type note: str
         """
+        if self._evolution_notes is None:
+            self._evolution_notes = []
         self._evolution_notes.append(note)
+        if self._listeners:
+            self._notify("evolution_notes", note)
 
     def add_diagnostic_image(self, image: str):
         """ Add a diagnostic image to the clinical history.
@@ -51,7 +96,11 @@ class ClinicalHistory:
         :param image: The diagnostic image to add.
         :type image: str
         """
+        if self._diagnostic_images is None:
+            self._diagnostic_images = []
         self._diagnostic_images.append(image)
+        if self._listeners:
+            self._notify("diagnostic_images", image)
 
     def add_exam_results(self, results: str):
         """ Add exam results to the clinical history.
@@ -59,7 +108,11 @@ class ClinicalHistory:
         :param results: The exam results to add.
         :type results: str
         """
+        if self._exam_results is None:
+            self._exam_results = []
         self._exam_results.append(results)
+        if self._listeners:
+            self._notify("exam_results", results)
 
     def add_medicine(self, medicine: str):
         """ Add a medicine to the clinical history.
@@ -67,16 +120,61 @@ class ClinicalHistory:
         :param medicine: The medicine to add.
         :type medicine: str
         """
+        if self._medicines is None:
+            self._medicines = []
         self._medicines.append(medicine)
+        if self._listeners:
+            self._notify("medicines", medicine)
+
+    def add_vital_signs_reading(self, vital_signs, timestamp: datetime):
+        """ Add a monitor reading to the vital signs history.
+
+        :param vital_signs: The vital signs read.
+        :type vital_signs: VitalSigns
+        :param timestamp: The moment of the reading.
+        :type timestamp: datetime
+        """
+        if self._vital_signs_history is None:
+            self._vital_signs_history = VitalSignsSeries()
+        self._vital_signs_history.append(vital_signs, timestamp)
+        if self._listeners:
+            self._notify("vital_signs_history", (timestamp, vital_signs))
+
+    @property
+    def evolution_notes(self) -> list:
+        """ Get the list of evolution notes in the clinical history.
+
+        :returns: The list of evolution notes, an empty tuple if none was added, so reading it allocates nothing.
+        :rtype: list[str]
+        """
+        return self._evolution_notes if self._evolution_notes is not None else ()
+
+    @property
+    def diagnostic_images(self) -> list:
+        """ Get the list of diagnostic images in the clinical history.
+
+        :returns: The list of diagnostic images, an empty tuple if none was added, so reading it allocates nothing.
+        :rtype: list[str]
+        """
+        return self._diagnostic_images if self._diagnostic_images is not None else ()
+
+    @property
+    def exam_results(self) -> list:
+        """ Get the list of exam results in the clinical history.
+
+        :returns: The list of exam results, an empty tuple if none was added, so reading it allocates nothing.
+        :rtype: list[str]
+        """
+        return self._exam_results if self._exam_results is not None else ()
 
     @property
     def medicines(self) -> list:
         """ Get the list of medicines in the clinical history.
 
-        :returns: The list of medicines.
+        :returns: The list of medicines, an empty tuple if none was added, so reading it allocates nothing.
         :rtype: list[str]
         """
-        return self._medicines
+        return self._medicines if self._medicines is not None else ()
 
     @property
     def patient(self):
@@ -96,6 +194,15 @@ class ClinicalHistory:
         """
         return self._vital_signs
 
+    @property
+    def vital_signs_history(self):
+        """ Get the readings of the vital signs taken after admission.
+
+        :returns: The vital signs series, None if no reading was added.
+        :rtype: VitalSignsSeries
+        """
+        return self._vital_signs_history
+
     @property
     def service(self) -> str:
         """ Get the name of the medical service in the clinical history.
@@ -113,6 +220,8 @@ class ClinicalHistory:
         :type service: str
         """
         self._service = service
+        if self._listeners:
+            self._notify("service", service)
 
     @property
     def admission_date(self) -> datetime:
@@ -133,6 +242,8 @@ class ClinicalHistory:
         """
         if isinstance(admission, datetime):
             self._admission_date = admission
+            if self._listeners:
+                self._notify("admission_date", admission)
         else:
             raise ValueError("Invalid admission date")
 
@@ -155,6 +266,8 @@ class ClinicalHistory:
         """
         if isinstance(discharge_date, datetime):
             self._discharge_date = discharge_date
+            if self._listeners:
+                self._notify("discharge_date", discharge_date)
         else:
             raise ValueError("Invalid discharge date")
 
@@ -175,30 +288,75 @@ class ClinicalHistory:
         :type disease: bool
         """
         self._chronic_disease = disease
+        if self._listeners:
+            self._notify("chronic_disease", disease)
+
+    def to_dict(self, include_readings: bool = False) -> dict:
+        """ Returns the clinical history as a dictionary of JSON compatible values.
+
+        Dates are in ISO format. The vital signs readings taken after admission are only included on request.
+
+        :param include_readings: Whether to include the vital signs history, under "vital_signs_history".
+        :type include_readings: bool
+        :returns: The clinical history fields, with the patient and vital signs as nested dictionaries.
+        :rtype: dict
+        """
+        data = {"patient": self._patient.to_dict(), "vital_signs": self._vital_signs.to_dict(),
+                "service": self._service, "admission_date": self._admission_date.isoformat(),
+                "discharge_date": self._discharge_date.isoformat() if self._discharge_date else None,
+                "chronic_disease": self._chronic_disease, "evolution_notes": self._evolution_notes or [],
+                "diagnostic_images": self._diagnostic_images or [], "exam_results": self._exam_results or [],
+                "medicines": self._medicines or []}
+        if include_readings:
+            data["vital_signs_history"] = (self._vital_signs_history.to_dict()
+                                           if self._vital_signs_history is not None else None)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """ Build a clinical history from a dictionary made by to_dict, with its readings if it has them.
+
+        :param data: The clinical history fields.
+        :type data: dict
+        :returns: A ClinicalHistory object.
+        :rtype: ClinicalHistory
+        """
+        history = cls(Patient.from_dict(data["patient"]), VitalSigns.from_dict(data["vital_signs"]), data["service"],
+                      datetime.fromisoformat(data["admission_date"]),
+                      datetime.fromisoformat(data["discharge_date"]) if data["discharge_date"] else None,
+                      data["chronic_disease"])
+        if data["evolution_notes"]:
+            history._evolution_notes = list(data["evolution_notes"])
+        if data["diagnostic_images"]:
+            history._diagnostic_images = list(data["diagnostic_images"])
+        if data["exam_results"]:
+            history._exam_results = list(data["exam_results"])
+        if data["medicines"]:
+            history._medicines = list(data["medicines"])
+        if data.get("vital_signs_history"):
+            history._vital_signs_history = VitalSignsSeries.from_dict(data["vital_signs_history"])
+        return history
 
     def __str__(self) -> str:
         """ Returns str of patient
         :returns: string patient
         :rtype: str
         """
-        history_str = f"Admission Date: {self._admission_date.strftime('%Y-%m-%d %H:%M')}\n"
+        parts = [f"Admission Date: {self._admission_date.isoformat(' ', 'minutes')}\n"]
         if self._discharge_date:
-            history_str += f"Discharge Date: {self._discharge_date.strftime('%Y-%m-%d %H:%M')}\n"
-        history_str += f"{str(self._patient)}\n{str(self._vital_signs)}\n"
-        history_str += "Evolution Notes:\n"
-        history_str += "\n".join(f"- {note}" for note in self._evolution_notes) + "\n"
-        history_str += "Diagnostic Images:\n"
-        history_str += "\n".join(f"- {img}" for img in self._diagnostic_images) + "\n"
-        history_str += "Exam Results:\n"
-        history_str += "\n".join(f"- {result}" for result in self._exam_results) + "\n"
-        history_str += "Medications:\n"
-        history_str += "\n".join(f"- {med}" for med in self._medicines) + "\n"
-        return history_str
+            parts.append(f"Discharge Date: {self._discharge_date.isoformat(' ', 'minutes')}\n")
+        parts += (str(self._patient), "\n", str(self._vital_signs), "\n")
+        for title, entries in (("Evolution Notes", self._evolution_notes),
+                               ("Diagnostic Images", self._diagnostic_images),
+                               ("Exam Results", self._exam_results), ("Medications", self._medicines)):
+            parts.append(f"{title}:\n")
+            if entries:
+                parts.append("\n".join(f"- {entry}" for entry in entries))
+            parts.append("\n")
+        return "".join(parts)
 
 
 if __name__ == "__main__":
-    from patient import Patient
-    from vital_signs import VitalSigns
     patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
     vital_signs = VitalSigns(120, 37, 80, 80)
     admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
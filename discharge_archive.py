@@ -0,0 +1,291 @@
+import json
+import os
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from clinical_history import ClinicalHistory
+
+""" Origin and unit of the epoch seconds the discharge dates are indexed as """
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+class DischargeArchive:
+    """
+    Class used to keep the clinical histories of discharged patients after their beds are released.
+
+    The archive listens to the beds and appends every released clinical history to the
+    partition of the month of its discharge, an append-only file in the archive directory.
+    Each line starts with the discharge date and the service as a JSON string, so tabs and
+    line breaks in its name are escaped, followed by the history as JSON, so the in-memory index of discharge dates and file offsets per month and service
+    is rebuilt on start without decoding any history. Queries over a date range only read
+    the months of the range and, inside them, only the lines of the matching histories.
+    """
+
+    def __init__(self, directory: str, beds=()):
+        """ DischargeArchive constructor object.
+
+        :param directory: The directory holding the monthly partitions.
+        :type directory: str
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        self._directory = directory
+        self._index = {}
+        self._sizes = {}
+        self._files = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("discharges-") and name.endswith(".log"):
+                self._load_partition(name[len("discharges-"):-len(".log")])
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start archiving the histories released from some beds.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook. Only releases are archived. """
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that archives the released history. """
+        self.append(clinical_history)
+
+    def append(self, clinical_history):
+        """ Archive a discharged clinical history.
+
+        Histories without a discharge date are discharged now, so the archived history and its
+        index entry have the same date.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        """
+        if clinical_history.discharge_date is None:
+            clinical_history.discharge_date = datetime.now()
+        discharge_date = clinical_history.discharge_date
+        service = clinical_history.service or ""
+        line = (f"{discharge_date.isoformat()}\t{json.dumps(service)}\t"
+                + json.dumps(clinical_history.to_dict(), separators=(",", ":")) + "\n").encode("utf-8")
+        month = _month(discharge_date)
+        with self._lock:
+            partition = self._files.get(month)
+            if partition is None:
+                partition = self._files[month] = open(self._path(month), "ab")
+            offset = self._sizes.get(month, 0)
+            partition.write(line)
+            self._sizes[month] = offset + len(line)
+            self._add_to_index(month, service, (discharge_date - _EPOCH) // _SECOND, offset)
+
+    def histories(self, since: datetime = None, until: datetime = None, service: str = None):
+        """ Stream the archived histories discharged in a date range.
+
+        For example ``archive.histories(since=datetime.now() - timedelta(days=7))`` for the last week.
+
+        :param since: Keep only the histories discharged at or after this date.
+        :type since: datetime
+        :param until: Keep only the histories discharged before this date.
+        :type until: datetime
+        :param service: Keep only the histories of this medical service.
+        :type service: str
+        :returns: The clinical histories, month by month in archiving order.
+        :rtype: iterator[ClinicalHistory]
+        """
+        for month, offsets in self._matching_offsets(since, until, service):
+            with open(self._path(month), "rb") as partition:
+                for offset in offsets:
+                    partition.seek(offset)
+                    yield ClinicalHistory.from_dict(json.loads(partition.readline().split(b"\t", 2)[2]))
+
+    def count(self, since: datetime = None, until: datetime = None, service: str = None) -> int:
+        """ Count the archived histories discharged in a date range, from the index only.
+
+        :param since: Count only the histories discharged at or after this date.
+        :type since: datetime
+        :param until: Count only the histories discharged before this date.
+        :type until: datetime
+        :param service: Count only the histories of this medical service.
+        :type service: str
+        :returns: The number of histories.
+        :rtype: int
+        """
+        return sum(len(offsets) for _, offsets in self._matching_offsets(since, until, service))
+
+    def discharges_per_service(self, since: datetime = None, until: datetime = None) -> dict:
+        """ Count the archived discharges per medical service in a date range, from the index only.
+
+        :param since: Count only the histories discharged at or after this date.
+        :type since: datetime
+        :param until: Count only the histories discharged before this date.
+        :type until: datetime
+        :returns: A dictionary mapping medical services to discharges.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            services = {service for month in self._index.values() for service in month}
+        return {service: count for service in sorted(services)
+                if (count := self.count(since, until, service))}
+
+    def _matching_offsets(self, since: datetime, until: datetime, service: str) -> list:
+        """ Find in the index the histories of the months overlapping a date range.
+
+        Flushes the pending appends, so the offsets found can be read.
+
+        :returns: Tuples of (month, file offsets of the matching lines in archiving order).
+        :rtype: list[tuple[str, list[int]]]
+        """
+        first_month = _month(since) if since is not None else ""
+        last_month = _month(until - _SECOND) if until is not None else "9999-99"
+        since = (since - _EPOCH) // _SECOND if since is not None else None
+        until = (until - _EPOCH) // _SECOND if until is not None else None
+        matching = []
+        with self._lock:
+            self.flush()
+            for month in sorted(self._index):
+                if not first_month <= month <= last_month:
+                    continue
+                services = self._index[month]
+                if service is None:
+                    columns = services.values()
+                else:
+                    columns = [services[service]] if service in services else []
+                offsets = []
+                for discharges, line_offsets in columns:
+                    if since is None and until is None:
+                        offsets.extend(line_offsets)
+                    else:
+                        offsets.extend(offset for discharged, offset in zip(discharges, line_offsets)
+                                       if (since is None or discharged >= since)
+                                       and (until is None or discharged < until))
+                if offsets:
+                    matching.append((month, sorted(offsets)))
+        return matching
+
+    def _add_to_index(self, month: str, service: str, discharged: int, offset: int):
+        """ Add an archived line to the index. The caller holds the lock.
+
+        :param month: The partition of the line.
+        :type month: str
+        :param service: The medical service of the history.
+        :type service: str
+        :param discharged: The discharge date in epoch seconds.
+        :type discharged: int
+        :param offset: The offset of the line in the partition.
+        :type offset: int
+        """
+        columns = self._index.setdefault(month, {}).get(service)
+        if columns is None:
+            columns = self._index[month][service] = (array("q"), array("q"))
+        columns[0].append(discharged)
+        columns[1].append(offset)
+
+    def _load_partition(self, month: str):
+        """ Index the lines of a partition, cutting a last line torn by a crash in the middle of a write.
+
+        :param month: The partition.
+        :type month: str
+        """
+        offset = 0
+        with open(self._path(month), "rb+") as partition:
+            for line in partition:
+                if not line.endswith(b"\n"):
+                    partition.truncate(offset)
+                    break
+                discharge_date, service, _ = line.split(b"\t", 2)
+                discharged = (datetime.fromisoformat(discharge_date.decode()) - _EPOCH) // _SECOND
+                self._add_to_index(month, _service(service), discharged, offset)
+                offset += len(line)
+        self._sizes[month] = offset
+
+    def _path(self, month: str) -> str:
+        """ Get the path of the partition of a month.
+
+        :param month: The month, as YYYY-MM.
+        :type month: str
+        :returns: The path of the partition.
+        :rtype: str
+        """
+        return os.path.join(self._directory, f"discharges-{month}.log")
+
+    def flush(self):
+        """ Write the pending appends to the partitions. """
+        with self._lock:
+            for partition in self._files.values():
+                partition.flush()
+
+    def close(self):
+        """ Flush and close the partitions. """
+        with self._lock:
+            for partition in self._files.values():
+                partition.close()
+            self._files = {}
+
+    @property
+    def partitions(self) -> list:
+        """ Get the months with archived histories.
+
+        :returns: The months as YYYY-MM, oldest first.
+        :rtype: list[str]
+        """
+        return sorted(self._index)
+
+    def __len__(self):
+        """ Returns the number of archived histories.
+
+        :returns: The number of histories.
+        :rtype: int
+        """
+        return sum(len(columns[1]) for services in self._index.values() for columns in services.values())
+
+
+def _month(date: datetime) -> str:
+    """ Get the partition of a date.
+
+    :param date: The date.
+    :type date: datetime
+    :returns: The month as YYYY-MM.
+    :rtype: str
+    """
+    return f"{date.year:04d}-{date.month:02d}"
+
+
+def _service(field: bytes) -> str:
+    """ Read the service of an index line, a JSON string, or the bare text written by older archives.
+
+    :param field: The service field of the line.
+    :type field: bytes
+    :returns: The medical service.
+    :rtype: str
+    """
+    return json.loads(field) if field.startswith(b'"') else field.decode("utf-8")
+
+
+if __name__ == "__main__":
+    import tempfile
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from report import Report
+
+    directory = tempfile.mkdtemp()
+    beds = [Bed(n) for n in range(1, 4)]
+    archive = DischargeArchive(directory, beds)
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    for bed, (service, days) in zip(beds, [("Cardiology", 3), ("Neurology", 20), ("Cardiology", 40)]):
+        bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), service, admission_date), service)
+        bed.clinical_history.discharge_date = admission_date + timedelta(days=days)
+        bed.release_patient()
+    archive.close()
+
+    archive = DischargeArchive(directory)
+    print("Partitions: ", archive.partitions)
+    print("Discharges in November: ", archive.discharges_per_service(datetime(2023, 11, 1), datetime(2023, 12, 1)))
+    print(Report.admissions_and_discharges_per_service(archive.histories(service="Cardiology")))
@@ -0,0 +1,324 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from bed import Bed
+from clinical_history import ClinicalHistory
+from vital_signs import VitalSigns
+
+
+class EventJournal:
+    """
+    Class used to keep an append-only journal of every change made to the beds and
+    the clinical histories of their patients.
+
+    Events are appended as JSON lines by the Bed and ClinicalHistory listener hooks. They
+    are written and fsynced in groups, either every group_size events or every
+    group_interval seconds, so one fsync covers many events. Every snapshot_every events
+    the state of the beds, with the vital signs readings of their patients, is written to a
+    snapshot and a new journal segment is started, so recovery only loads the snapshot and
+    replays the events after it.
+    """
+
+    SNAPSHOT = "snapshot.json"
+
+    """ History attributes changed through a setter, with the function decoding their journaled value """
+    _SETTERS = {"service": str, "admission_date": datetime.fromisoformat,
+                "discharge_date": datetime.fromisoformat, "chronic_disease": bool}
+
+    """ History attributes changed through an add method """
+    _ADDERS = {"evolution_notes": ClinicalHistory.add_evolution_note,
+               "diagnostic_images": ClinicalHistory.add_diagnostic_image,
+               "exam_results": ClinicalHistory.add_exam_results, "medicines": ClinicalHistory.add_medicine}
+
+    def __init__(self, directory: str, group_size: int = 256, group_interval: float = 0.05,
+                 snapshot_every: int = 1000000):
+        """ EventJournal constructor object.
+
+        :param directory: The directory holding the snapshot and the journal segments.
+        :type directory: str
+        :param group_size: The number of pending events that triggers a write and fsync.
+        :type group_size: int
+        :param group_interval: The longest time in seconds an event waits before being fsynced.
+        :type group_interval: float
+        :param snapshot_every: The number of events between automatic snapshots, None to disable them.
+        :type snapshot_every: int
+        """
+        self._directory = directory
+        self._group_size = group_size
+        self._group_interval = group_interval
+        self._snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self._pending = []
+        self._beds = {}
+        self._history_beds = {}
+        self._events_since_snapshot = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._sequence = self._last_sequence()
+        self._open_segment()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def recover(self, beds=()) -> list:
+        """ Rebuild the beds from the last snapshot and the events journaled after it.
+
+        Only the beds that were snapshotted or had an event are known to the journal, so the
+        caller passes the empty beds of the whole ward and the journaled state is replayed
+        into them; journaled beds missing from them are created.
+        Lines torn by a crash in the middle of a write were never fsynced and are skipped.
+
+        :param beds: The empty beds to replay the journal into.
+        :type beds: list[Bed]
+        :returns: The given and the recovered beds in number order, empty if there are none.
+        :rtype: list[Bed]
+        """
+        beds, sequence = {bed.number: bed for bed in beds}, 0
+        snapshot_path = os.path.join(self._directory, self.SNAPSHOT)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as snapshot:
+                state = json.load(snapshot)
+            sequence = state["sequence"]
+            for bed_state in state["beds"]:
+                bed = beds.get(bed_state["number"])
+                if bed is None:
+                    bed = beds[bed_state["number"]] = Bed(bed_state["number"])
+                if bed_state["history"] is not None:
+                    bed.admit_patient(ClinicalHistory.from_dict(bed_state["history"]), bed_state["service"])
+
+        for path in self._segments():
+            with open(path, encoding="utf-8") as segment:
+                for line in segment:
+                    event = _decode(line)
+                    if event is not None and event["sequence"] > sequence:
+                        self._apply(beds, event)
+        return [beds[number] for number in sorted(beds)]
+
+    @classmethod
+    def _apply(cls, beds: dict, event: dict):
+        """ Replay one journaled event over the beds.
+
+        :param beds: The beds by number.
+        :type beds: dict[int, Bed]
+        :param event: The journaled event.
+        :type event: dict
+        """
+        bed = beds.get(event["bed"])
+        if bed is None:
+            bed = beds[event["bed"]] = Bed(event["bed"])
+        kind = event["type"]
+        if kind == "admit":
+            bed.admit_patient(ClinicalHistory.from_dict(event["history"]), event["service"])
+        elif kind == "release":
+            bed.release_patient()
+        else:
+            history, attribute, value = bed.clinical_history, event["attribute"], event["value"]
+            if attribute in cls._SETTERS:
+                setattr(history, attribute, cls._SETTERS[attribute](value) if value is not None else None)
+            elif attribute in cls._ADDERS:
+                cls._ADDERS[attribute](history, value)
+            elif attribute == "vital_signs_history":
+                history.add_vital_signs_reading(VitalSigns.from_dict(value[1]), datetime.fromisoformat(value[0]))
+
+    def attach(self, beds):
+        """ Start journaling the changes of some beds and of the histories of their patients.
+
+        :param beds: The beds to journal.
+        :type beds: list[Bed]
+        """
+        with self._lock:
+            for bed in beds:
+                self._beds[bed.number] = bed
+                bed.add_listener(self)
+                if bed.occupied:
+                    self._history_beds[bed.clinical_history] = bed.number
+                    bed.clinical_history.add_listener(self)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that journals the admission. """
+        with self._lock:
+            self._history_beds[clinical_history] = bed.number
+            clinical_history.add_listener(self)
+            self._append({"type": "admit", "bed": bed.number, "service": bed.service,
+                          "history": clinical_history.to_dict(include_readings=True)})
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that journals the release. """
+        with self._lock:
+            self._history_beds.pop(clinical_history, None)
+            clinical_history.remove_listener(self)
+            self._append({"type": "release", "bed": bed.number})
+
+    def history_updated(self, clinical_history, attribute, value):
+        """ Clinical history listener hook that journals the change. """
+        if attribute == "vital_signs_history":
+            value = (value[0].isoformat(), value[1].to_dict())
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        with self._lock:
+            self._append({"type": "update", "bed": self._history_beds[clinical_history], "attribute": attribute,
+                          "value": value})
+
+    def _append(self, event: dict):
+        """ Number an event and queue it, writing the group when it is full.
+
+        :param event: The event to journal.
+        :type event: dict
+        """
+        self._sequence += 1
+        event["sequence"] = self._sequence
+        self._pending.append(json.dumps(event, separators=(",", ":")) + "\n")
+        if len(self._pending) >= self._group_size:
+            self.flush()
+        self._events_since_snapshot += 1
+        if self._snapshot_every and self._events_since_snapshot >= self._snapshot_every:
+            self.snapshot()
+
+    def flush(self):
+        """ Write the pending events to the journal and fsync it. """
+        with self._lock:
+            if self._pending:
+                self._segment.write("".join(self._pending))
+                self._pending = []
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+
+    def snapshot(self):
+        """ Write the state of the attached beds to the snapshot and start a new journal segment.
+
+        The snapshot is written to a temporary file and renamed, so a crash leaves either the
+        old or the new snapshot. Segments fully covered by the snapshot are then deleted.
+        """
+        with self._lock:
+            self.flush()
+            state = {"sequence": self._sequence,
+                     "beds": [{"number": bed.number, "service": bed.service,
+                               "history": bed.clinical_history.to_dict(include_readings=True) if bed.occupied else None}
+                              for bed in self._beds.values()]}
+            snapshot_path = os.path.join(self._directory, self.SNAPSHOT)
+            with open(snapshot_path + ".tmp", "w", encoding="utf-8") as snapshot:
+                json.dump(state, snapshot, separators=(",", ":"))
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+
+            self._segment.close()
+            for path in self._segments():
+                os.remove(path)
+            self._open_segment()
+            self._events_since_snapshot = 0
+
+    def close(self):
+        """ Flush the pending events and close the journal. """
+        self._closed.set()
+        self._flusher.join()
+        with self._lock:
+            self.flush()
+            self._segment.close()
+
+    def _flush_periodically(self):
+        """ Flush the pending events every group_interval seconds until the journal is closed. """
+        while not self._closed.wait(self._group_interval):
+            self.flush()
+
+    def _segments(self) -> list:
+        """ Get the paths of the journal segments in sequence order.
+
+        :returns: The paths of the segments.
+        :rtype: list[str]
+        """
+        names = sorted(name for name in os.listdir(self._directory)
+                       if name.startswith("journal-") and name.endswith(".jsonl"))
+        return [os.path.join(self._directory, name) for name in names]
+
+    def _segment_path(self, first_sequence: int) -> str:
+        """ Get the path of the segment starting at a sequence number.
+
+        :param first_sequence: The sequence number of the first event of the segment.
+        :type first_sequence: int
+        :returns: The path of the segment.
+        :rtype: str
+        """
+        return os.path.join(self._directory, f"journal-{first_sequence:020d}.jsonl")
+
+    def _last_sequence(self) -> int:
+        """ Find the sequence number of the last journaled event, reading only the end of the last segment.
+
+        :returns: The last sequence number, 0 if nothing was journaled.
+        :rtype: int
+        """
+        for path in reversed(self._segments()):
+            with open(path, "rb") as segment:
+                size = segment.seek(0, os.SEEK_END)
+                for tail_size in (65536, size):
+                    segment.seek(max(0, size - tail_size))
+                    for line in reversed(segment.read().splitlines()):
+                        event = _decode(line)
+                        if event is not None:
+                            return event["sequence"]
+        snapshot_path = os.path.join(self._directory, self.SNAPSHOT)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as snapshot:
+                return json.load(snapshot)["sequence"]
+        return 0
+
+    def _open_segment(self):
+        """ Open the segment receiving the next events, ending any torn last line left by a crash. """
+        path = self._segment_path(self._sequence + 1)
+        self._segment = open(path, "a", encoding="utf-8")
+        if self._segment.tell():
+            with open(path, "rb") as segment:
+                segment.seek(-1, os.SEEK_END)
+                if segment.read(1) != b"\n":
+                    self._segment.write("\n")
+
+    @property
+    def sequence(self) -> int:
+        """ Get the sequence number of the last journaled event.
+
+        :returns: The last sequence number.
+        :rtype: int
+        """
+        return self._sequence
+
+
+def _decode(line):
+    """ Decode a journal line.
+
+    :param line: The line read from a segment.
+    :type line: str
+    :returns: The event, None if the line is empty or torn.
+    :rtype: dict
+    """
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    import tempfile
+    from patient import Patient
+
+    directory = tempfile.mkdtemp()
+    journal = EventJournal(directory, snapshot_every=None)
+    beds = [Bed(n) for n in range(1, 4)]
+    journal.attach(beds)
+
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    beds[1].admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                          "Cardiology")
+    beds[1].clinical_history.add_medicine("Lisinopril")
+    beds[1].clinical_history.chronic_disease = True
+    journal.snapshot()
+    beds[1].clinical_history.add_evolution_note("The patient is getting better")
+    journal.close()
+
+    journal = EventJournal(directory)
+    recovered = journal.recover([Bed(n) for n in range(1, 4)])
+    journal.close()
+    print(f"Recovered {len(recovered)} beds")
+    print(recovered[1].clinical_history.__str__())
@@ -0,0 +1,401 @@
+import io
+import json
+import math
+import re
+import struct
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+
+from clinical_history import ClinicalHistory
+from patient import Patient
+from vital_signs import VitalSigns
+
+""" Origin and unit of the epoch seconds the columnar format stores dates as """
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+""" Epoch seconds standing for a missing date in the columnar format """
+_NO_DATE = -2 ** 63
+
+""" Columns of the CSV export, the admission fields read by batch_admission.admit_many first """
+CSV_COLUMNS = ("patient_id", "name", "gender", "birth_date", "blood_pressure", "temperature", "oxygen_saturation",
+               "breathing_rate", "service", "admission_date", "chronic_disease", "discharge_date",
+               "evolution_notes", "diagnostic_images", "exam_results", "medicines")
+
+""" Columns of the columnar format, with their type: S text, D date, F float, B bool, L list of texts """
+COLUMNAR_COLUMNS = (("patient_id", "S"), ("name", "S"), ("gender", "S"), ("birth_date", "D"), ("service", "S"),
+                    ("admission_date", "D"), ("discharge_date", "D"), ("chronic_disease", "B"),
+                    ("blood_pressure", "F"), ("temperature", "F"), ("oxygen_saturation", "F"),
+                    ("breathing_rate", "F"), ("evolution_notes", "L"), ("diagnostic_images", "L"),
+                    ("exam_results", "L"), ("medicines", "L"))
+
+""" JSON encoder of texts, the C one of the json module when available """
+_encode_string = json.encoder.encode_basestring
+
+""" Characters that make csv.writer quote a field """
+_CSV_SPECIAL = re.compile(r'[,"\r\n]')
+
+""" First bytes of a file in the columnar format """
+COLUMNAR_MAGIC = b"HCOL\x01"
+
+
+def export_jsonl(histories, file, chunk_size: int = 10000) -> int:
+    """ Write clinical histories as JSON lines, in the format of ClinicalHistory.to_dict.
+
+    :param histories: The clinical histories, any iterable read once.
+    :type histories: iterable
+    :param file: The text file written to, opened with newline="".
+    :type file: io.TextIOBase
+    :param chunk_size: The number of histories formatted before each write.
+    :type chunk_size: int
+    :returns: The number of histories written.
+    :rtype: int
+    """
+    n_written = 0
+    for chunk in _chunks(histories, chunk_size):
+        patients = [history.patient for history in chunk]
+        vital_signs = [history.vital_signs for history in chunk]
+        patient_texts = {patient: (f'{{"id":{_quote(patient.id)},"name":{_quote(patient.name)},'
+                                   f'"gender":{_quote(patient.gender)},"birth_date":"{patient.birth_date.isoformat()}"}}')
+                         for patient in set(patients)}
+        vital_signs_texts = {signs: (f'{{"blood_pressure":{_number(signs.blood_pressure)},'
+                                     f'"temperature":{_number(signs.temperature)},'
+                                     f'"oxygen_saturation":{_number(signs.oxygen_saturation)},'
+                                     f'"breathing_rate":{_number(signs.breathing_rate)}}}')
+                             for signs in set(vital_signs)}
+        admission_dates = format_dates([history.admission_date for history in chunk])
+        discharge_dates = format_dates([history.discharge_date for history in chunk])
+        lines = [f'{{"patient":{patient_texts[patient]},"vital_signs":{vital_signs_texts[signs]},'
+                 f'"service":{_quote(history.service)},"admission_date":"{admission_date}",'
+                 f'"discharge_date":{_quote(discharge_date) if discharge_date else "null"},'
+                 f'"chronic_disease":{"true" if history.chronic_disease else "false"},'
+                 f'"evolution_notes":{_texts(history.evolution_notes)},'
+                 f'"diagnostic_images":{_texts(history.diagnostic_images)},'
+                 f'"exam_results":{_texts(history.exam_results)},"medicines":{_texts(history.medicines)}}}\n'
+                 for history, patient, signs, admission_date, discharge_date
+                 in zip(chunk, patients, vital_signs, admission_dates, discharge_dates)]
+        file.write("".join(lines))
+        n_written += len(chunk)
+    return n_written
+
+
+def export_csv(histories, file, chunk_size: int = 10000) -> int:
+    """ Write clinical histories as CSV with a header row, the lists of texts as JSON arrays.
+
+    The rows are the ones csv.writer writes, but the patient and vital signs fields, often
+    shared between histories, are formatted once per chunk. The file can be read back by
+    batch_admission.read_records.
+
+    :param histories: The clinical histories, any iterable read once.
+    :type histories: iterable
+    :param file: The text file written to, opened with newline="".
+    :type file: io.TextIOBase
+    :param chunk_size: The number of histories formatted before each write.
+    :type chunk_size: int
+    :returns: The number of histories written.
+    :rtype: int
+    """
+    file.write(",".join(CSV_COLUMNS) + "\r\n")
+    n_written = 0
+    for chunk in _chunks(histories, chunk_size):
+        patients = [history.patient for history in chunk]
+        vital_signs = [history.vital_signs for history in chunk]
+        patient_texts = {patient: (f"{_csv_field(patient.id)},{_csv_field(patient.name)},"
+                                   f"{_csv_field(patient.gender)},{patient.birth_date.isoformat()}")
+                         for patient in set(patients)}
+        vital_signs_texts = {signs: (f"{signs.blood_pressure},{signs.temperature},{signs.oxygen_saturation},"
+                                     f"{signs.breathing_rate}")
+                             for signs in set(vital_signs)}
+        admission_dates = format_dates([history.admission_date for history in chunk])
+        discharge_dates = format_dates([history.discharge_date for history in chunk])
+        file.write("".join([
+            f"{patient_texts[patient]},{vital_signs_texts[signs]},{_csv_field(history.service)},{admission_date},"
+            f"{history.chronic_disease},{discharge_date or ''},{_csv_texts(history.evolution_notes)},"
+            f"{_csv_texts(history.diagnostic_images)},{_csv_texts(history.exam_results)},"
+            f"{_csv_texts(history.medicines)}\r\n"
+            for history, patient, signs, admission_date, discharge_date
+            in zip(chunk, patients, vital_signs, admission_dates, discharge_dates)]))
+        n_written += len(chunk)
+    return n_written
+
+
+def export_columnar(histories, file, row_group_size: int = 65536, level: int = 1) -> int:
+    """ Write clinical histories in a compact columnar binary format, read back by read_columnar.
+
+    Histories are written in row groups. Each row group starts with its number of rows,
+    followed by every column of COLUMNAR_COLUMNS as its name, type, compressed size and
+    content compressed with zlib, so a reader can skip the columns it does not need.
+    Texts are dictionary encoded, dates are stored as int64 epoch seconds, dropping any
+    fraction of a second, and numbers as float64, all in little endian.
+
+    :param histories: The clinical histories, any iterable read once.
+    :type histories: iterable
+    :param file: The binary file written to.
+    :type file: io.BufferedIOBase
+    :param row_group_size: The number of histories of each row group.
+    :type row_group_size: int
+    :param level: The zlib compression level, from 0 to 9.
+    :type level: int
+    :returns: The number of histories written.
+    :rtype: int
+    """
+    file.write(COLUMNAR_MAGIC)
+    n_written = 0
+    for chunk in _chunks(histories, row_group_size):
+        patients = [history.patient for history in chunk]
+        vital_signs = [history.vital_signs for history in chunk]
+        columns = {"patient_id": [patient.id for patient in patients],
+                   "name": [patient.name for patient in patients],
+                   "gender": [patient.gender for patient in patients],
+                   "birth_date": [patient.birth_date for patient in patients],
+                   "service": [history.service for history in chunk],
+                   "admission_date": [history.admission_date for history in chunk],
+                   "discharge_date": [history.discharge_date for history in chunk],
+                   "chronic_disease": [history.chronic_disease for history in chunk],
+                   "blood_pressure": [signs.blood_pressure for signs in vital_signs],
+                   "temperature": [signs.temperature for signs in vital_signs],
+                   "oxygen_saturation": [signs.oxygen_saturation for signs in vital_signs],
+                   "breathing_rate": [signs.breathing_rate for signs in vital_signs],
+                   "evolution_notes": (history.evolution_notes for history in chunk),
+                   "diagnostic_images": (history.diagnostic_images for history in chunk),
+                   "exam_results": (history.exam_results for history in chunk),
+                   "medicines": (history.medicines for history in chunk)}
+        parts = [struct.pack("<I", len(chunk))]
+        for name, kind in COLUMNAR_COLUMNS:
+            content = zlib.compress(_ENCODERS[kind](columns[name]), level)
+            encoded_name = name.encode()
+            parts.append(struct.pack("<B", len(encoded_name)) + encoded_name + kind.encode()
+                         + struct.pack("<Q", len(content)))
+            parts.append(content)
+        file.write(b"".join(parts))
+        n_written += len(chunk)
+    return n_written
+
+
+def read_columnar(file, columns=None):
+    """ Read the row groups of a file written by export_columnar.
+
+    :param file: The binary file read from.
+    :type file: io.BufferedIOBase
+    :param columns: The names of the columns read, every column if None. The others are skipped.
+    :type columns: iterable[str]
+    :returns: A dictionary per row group mapping each column name to its values: texts as
+        str, dates as datetime or None, numbers as float, booleans as bool and lists of texts as lists.
+    :rtype: iterator[dict[str, list]]
+    :raises ValueError: If the file is not in the columnar format.
+    """
+    if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("The file is not in the columnar format")
+    wanted = set(columns) if columns is not None else None
+    while True:
+        header = file.read(4)
+        if not header:
+            return
+        n_rows, = struct.unpack("<I", header)
+        row_group = {}
+        for _ in COLUMNAR_COLUMNS:
+            name = file.read(file.read(1)[0]).decode()
+            kind = file.read(1).decode()
+            size, = struct.unpack("<Q", file.read(8))
+            if wanted is None or name in wanted:
+                row_group[name] = _DECODERS[kind](zlib.decompress(file.read(size)), n_rows)
+            else:
+                file.seek(size, io.SEEK_CUR)
+        yield row_group
+
+
+def histories_from_columnar(file):
+    """ Build the clinical histories of a file written by export_columnar.
+
+    :param file: The binary file read from.
+    :type file: io.BufferedIOBase
+    :returns: The clinical histories, in the order they were written.
+    :rtype: iterator[ClinicalHistory]
+    """
+    for row_group in read_columnar(file):
+        for (patient_id, name, gender, birth_date, service, admission_date, discharge_date, chronic_disease,
+             blood_pressure, temperature, oxygen_saturation, breathing_rate, evolution_notes, diagnostic_images,
+             exam_results, medicines) in zip(*(row_group[name] for name, _ in COLUMNAR_COLUMNS)):
+            history = ClinicalHistory(Patient(patient_id, name, gender, birth_date),
+                                      VitalSigns(blood_pressure, temperature, oxygen_saturation, breathing_rate),
+                                      service, admission_date, discharge_date, chronic_disease)
+            for note in evolution_notes:
+                history.add_evolution_note(note)
+            for image in diagnostic_images:
+                history.add_diagnostic_image(image)
+            for result in exam_results:
+                history.add_exam_results(result)
+            for medicine in medicines:
+                history.add_medicine(medicine)
+            yield history
+
+
+def format_dates(dates: list) -> list:
+    """ Format a column of dates in ISO format, each distinct date being formatted only once.
+
+    :param dates: The dates, None for the missing ones.
+    :type dates: list[datetime]
+    :returns: The dates as text, None for the missing ones.
+    :rtype: list[str]
+    """
+    formatted = {date: date.isoformat() for date in set(dates) if date is not None}
+    formatted[None] = None
+    return [formatted[date] for date in dates]
+
+
+def _quote(text: str) -> str:
+    """ Encode a text as a JSON string, None as null, as json.dumps does with ensure_ascii=False. """
+    return _encode_string(text) if text is not None else "null"
+
+
+def _number(value) -> str:
+    """ Encode a number as JSON, the infinite ones and NaN as json.dumps does. """
+    return repr(value) if math.isfinite(value) else json.dumps(value)
+
+
+def _texts(texts: list) -> str:
+    """ Encode a list of texts as a JSON array. """
+    return "[" + ",".join(map(_encode_string, texts)) + "]" if texts else "[]"
+
+
+def _csv_field(text: str) -> str:
+    """ Encode a text as a CSV field, quoted only if needed, as csv.writer does. """
+    if text is None:
+        return ""
+    if _CSV_SPECIAL.search(text):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _csv_texts(texts: list) -> str:
+    """ Encode a list of texts as a CSV field holding a JSON array. """
+    return '"[' + ",".join(map(_encode_string, texts)).replace('"', '""') + ']"' if texts else "[]"
+
+
+def _chunks(histories, chunk_size: int):
+    """ Split clinical histories in lists of chunk_size histories.
+
+    :returns: The lists of histories.
+    :rtype: iterator[list[ClinicalHistory]]
+    """
+    histories = iter(histories)
+    while True:
+        chunk = list(islice(histories, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _encode_texts(values: list) -> bytes:
+    """ Encode a text column as its distinct texts followed by the uint32 code of each value. """
+    codes = {}
+    indices = array("I", [codes.setdefault(value, len(codes)) for value in values])
+    encoded = [text.encode() for text in codes]
+    lengths = array("I", map(len, encoded))
+    return (struct.pack("<I", len(codes)) + _little_endian(lengths) + b"".join(encoded)
+            + _little_endian(indices))
+
+
+def _decode_texts(content: bytes, n_rows: int, offset: int = 0) -> list:
+    """ Decode a text column written by _encode_texts, starting at an offset of the content. """
+    n_texts, = struct.unpack_from("<I", content, offset)
+    offset += 4
+    lengths = _from_little_endian("I", content[offset:offset + 4 * n_texts])
+    offset += 4 * n_texts
+    texts = []
+    for length in lengths:
+        texts.append(content[offset:offset + length].decode())
+        offset += length
+    return [texts[index] for index in _from_little_endian("I", content[offset:offset + 4 * n_rows])]
+
+
+def _encode_dates(values: list) -> bytes:
+    """ Encode a date column as int64 epoch seconds, distinct dates being converted once. """
+    seconds = {date: (date - _EPOCH) // _SECOND for date in set(values) if date is not None}
+    seconds[None] = _NO_DATE
+    return _little_endian(array("q", [seconds[date] for date in values]))
+
+
+def _decode_dates(content: bytes, n_rows: int) -> list:
+    """ Decode a date column written by _encode_dates. """
+    values = _from_little_endian("q", content)
+    dates = {value: _EPOCH + timedelta(seconds=value) for value in set(values) if value != _NO_DATE}
+    dates[_NO_DATE] = None
+    return [dates[value] for value in values]
+
+
+def _encode_lists(values) -> bytes:
+    """ Encode a column of lists of texts as the uint32 length of each list followed by their texts.
+
+    The lists are read once, so a generator of the lists, freed as they are read, is enough.
+    """
+    lengths = array("I")
+    texts = []
+    for value in values:
+        lengths.append(len(value))
+        texts += value
+    return _little_endian(lengths) + _encode_texts(texts)
+
+
+def _decode_lists(content: bytes, n_rows: int) -> list:
+    """ Decode a column of lists written by _encode_lists. """
+    lengths = _from_little_endian("I", content[:4 * n_rows])
+    texts = _decode_texts(content, sum(lengths), 4 * n_rows)
+    lists, start = [], 0
+    for length in lengths:
+        lists.append(texts[start:start + length])
+        start += length
+    return lists
+
+
+def _little_endian(values: array) -> bytes:
+    """ Get the bytes of an array in little endian order. """
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, content: bytes) -> array:
+    """ Build an array from bytes in little endian order. """
+    values = array(typecode, content)
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        values.byteswap()
+    return values
+
+
+""" Encoders and decoders of each column type of the columnar format """
+_ENCODERS = {"S": _encode_texts, "D": _encode_dates, "L": _encode_lists,
+             "F": lambda values: _little_endian(array("d", values)),
+             "B": lambda values: bytes(map(bool, values))}
+_DECODERS = {"S": _decode_texts, "D": _decode_dates, "L": _decode_lists,
+             "F": lambda content, n_rows: _from_little_endian("d", content).tolist(),
+             "B": lambda content, n_rows: list(map(bool, content))}
+
+
+if __name__ == "__main__":
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    history = ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date)
+    history.add_evolution_note("The patient is getting better, \"stable\"")
+    history.add_medicine("Paracetamol 500mg")
+    discharged = ClinicalHistory(patient, VitalSigns(110, 36.5, 97, 14), "Neurology", admission_date,
+                                 admission_date + timedelta(days=3), True)
+
+    text = io.StringIO(newline="")
+    export_jsonl([history, discharged], text)
+    print(text.getvalue())
+    text = io.StringIO(newline="")
+    export_csv([history, discharged], text)
+    print(text.getvalue())
+
+    binary = io.BytesIO()
+    export_columnar([history, discharged], binary)
+    print("Columnar size: ", len(binary.getvalue()), "bytes")
+    binary.seek(0)
+    print("Services: ", next(read_columnar(binary, ["service", "discharge_date"])))
+    binary.seek(0)
+    print([restored.to_dict() == original.to_dict()
+           for restored, original in zip(histories_from_columnar(binary), [history, discharged])])
@@ -0,0 +1,425 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ImageStore:
+    """
+    Class used to keep the diagnostic images attached to the clinical histories.
+
+    Images are copied into the store directory under the SHA-256 of their content, so the
+    same image uploaded twice is kept once, and the clinical history keeps the reference
+    ``sha256:<digest>`` instead of the path typed by the user. Nothing is read when a history
+    is opened: its images are handles, whose metadata and thumbnail are read through ``mmap``,
+    touching only the pages of the headers, and kept in bounded LRU caches. The content of
+    an image is mapped, not copied, when it is opened.
+
+    Without an image library, thumbnails are the ones embedded by cameras and scanners in
+    the EXIF data of JPEG files; other formats have none.
+    """
+
+    """ Prefix of the references to stored images """
+    PREFIX = "sha256:"
+
+    """ Bytes read at a time when copying an image into the store """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, directory: str, metadata_cache_size: int = 4096, thumbnail_cache_bytes: int = 32 << 20):
+        """ ImageStore constructor object.
+
+        :param directory: The directory holding the images.
+        :type directory: str
+        :param metadata_cache_size: The largest number of images whose metadata is cached.
+        :type metadata_cache_size: int
+        :param thumbnail_cache_bytes: The largest number of bytes of cached thumbnails.
+        :type thumbnail_cache_bytes: int
+        """
+        self._directory = directory
+        self._metadata = _LRUCache(metadata_cache_size)
+        self._thumbnails = _LRUCache(thumbnail_cache_bytes, lambda thumbnail: len(thumbnail or b"") + 1)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def ingest(self, source) -> str:
+        """ Copy an image into the store, unless an image with the same content is already stored.
+
+        :param source: The path of the image, or its content as bytes.
+        :type source: str | bytes
+        :returns: The reference to the stored image.
+        :rtype: str
+        :raises InvalidImageError: If the content is not of a known image format.
+        """
+        digest = hashlib.sha256()
+        handle, temporary = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as copy:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    header = bytes(source[:_HEADER_SIZE])
+                    digest.update(source)
+                    copy.write(source)
+                else:
+                    with open(source, "rb") as image:
+                        header = image.read(_HEADER_SIZE)
+                        chunk = header
+                        while chunk:
+                            digest.update(chunk)
+                            copy.write(chunk)
+                            chunk = image.read(self.CHUNK_SIZE)
+            if _image_format(header) is None:
+                raise InvalidImageError(f"{source if isinstance(source, str) else 'The content'} "
+                                        "is not a PNG, JPEG, GIF, BMP, TIFF, WebP or DICOM image")
+            reference = self.PREFIX + digest.hexdigest()
+            path = self.path(reference)
+            if os.path.exists(path):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temporary, 0o444)
+                os.replace(temporary, path)
+            return reference
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def attach(self, clinical_history, source) -> str:
+        """ Store an image and add its reference to the diagnostic images of a clinical history.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        :param source: The path of the image, or its content as bytes.
+        :type source: str | bytes
+        :returns: The reference to the stored image.
+        :rtype: str
+        :raises InvalidImageError: If the content is not of a known image format.
+        """
+        reference = self.ingest(source)
+        clinical_history.add_diagnostic_image(reference)
+        return reference
+
+    def images(self, clinical_history) -> list:
+        """ Get the diagnostic images of a clinical history, without reading any of them.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        :returns: A handle per image, in the order they were added.
+        :rtype: list[StoredImage]
+        """
+        return [StoredImage(self, reference) for reference in clinical_history.diagnostic_images]
+
+    def path(self, reference: str) -> str:
+        """ Get the file of an image.
+
+        Images added to histories before the store are referenced by their path, which is returned as is.
+
+        :param reference: The reference to the image.
+        :type reference: str
+        :returns: The path of the image.
+        :rtype: str
+        """
+        if not reference.startswith(self.PREFIX):
+            return reference
+        digest = reference[len(self.PREFIX):]
+        return os.path.join(self._directory, digest[:2], digest[2:])
+
+    def open(self, reference: str) -> mmap.mmap:
+        """ Map the content of an image in memory, read only. The pages are read as they are accessed.
+
+        For example ``with store.open(reference) as content: header = content[:16]``.
+
+        :param reference: The reference to the image.
+        :type reference: str
+        :returns: The mapped content, to be closed after use.
+        :rtype: mmap.mmap
+        """
+        with open(self.path(reference), "rb") as image:
+            return mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def metadata(self, reference: str) -> dict:
+        """ Get the format, size and dimensions of an image, reading only its header.
+
+        :param reference: The reference to the image.
+        :type reference: str
+        :returns: A dictionary with the format, the size in bytes, and the width and height
+            in pixels, None for the formats whose dimensions are not read.
+        :rtype: dict
+        """
+        with self._lock:
+            metadata = self._metadata.get(reference)
+        if metadata is None:
+            with self.open(reference) as content:
+                image_format = _image_format(content[:_HEADER_SIZE])
+                try:
+                    width, height = _DIMENSIONS.get(image_format, _no_dimensions)(content)
+                except struct.error:
+                    width, height = None, None
+                metadata = {"format": image_format, "size": len(content), "width": width, "height": height}
+            with self._lock:
+                self._metadata.put(reference, metadata)
+        return metadata
+
+    def thumbnail(self, reference: str) -> bytes:
+        """ Get the thumbnail embedded in an image, reading only the segment that holds it.
+
+        :param reference: The reference to the image.
+        :type reference: str
+        :returns: The thumbnail as JPEG bytes, None if the image has none.
+        :rtype: bytes
+        """
+        with self._lock:
+            if reference in self._thumbnails:
+                return self._thumbnails.get(reference)
+        with self.open(reference) as content:
+            try:
+                thumbnail = _exif_thumbnail(content) if content[:3] == b"\xff\xd8\xff" else None
+            except struct.error:
+                thumbnail = None
+        with self._lock:
+            self._thumbnails.put(reference, thumbnail)
+        return thumbnail
+
+    def __contains__(self, reference: str) -> bool:
+        """ Returns whether an image is stored.
+
+        :param reference: The reference to the image.
+        :type reference: str
+        :returns: True if the image is in the store.
+        :rtype: bool
+        """
+        return reference.startswith(self.PREFIX) and os.path.exists(self.path(reference))
+
+
+class StoredImage:
+    """
+    Handle to a diagnostic image of a store, reading nothing until its metadata,
+    thumbnail or content is asked for.
+    """
+
+    __slots__ = ("_store", "_reference")
+
+    def __init__(self, store: ImageStore, reference: str):
+        """ StoredImage constructor object.
+
+        :param store: The store holding the image.
+        :type store: ImageStore
+        :param reference: The reference to the image.
+        :type reference: str
+        """
+        self._store = store
+        self._reference = reference
+
+    @property
+    def reference(self) -> str:
+        """ Get the reference to the image.
+
+        :returns: The reference, as kept in the clinical history.
+        :rtype: str
+        """
+        return self._reference
+
+    @property
+    def metadata(self) -> dict:
+        """ Get the format, size and dimensions of the image, see ImageStore.metadata. """
+        return self._store.metadata(self._reference)
+
+    @property
+    def thumbnail(self) -> bytes:
+        """ Get the thumbnail embedded in the image, see ImageStore.thumbnail. """
+        return self._store.thumbnail(self._reference)
+
+    def open(self) -> mmap.mmap:
+        """ Map the content of the image in memory, see ImageStore.open. """
+        return self._store.open(self._reference)
+
+    def __repr__(self):
+        """ Returns the representation of the handle. """
+        return f"StoredImage({self._reference!r})"
+
+
+class _LRUCache:
+    """
+    Mapping that forgets its least recently used entries once their total cost exceeds a limit.
+    Not thread safe; the store holds its lock around it.
+    """
+
+    __slots__ = ("_entries", "_limit", "_cost", "_total")
+
+    def __init__(self, limit: int, cost=None):
+        """ _LRUCache constructor object.
+
+        :param limit: The largest total cost of the entries.
+        :type limit: int
+        :param cost: The function giving the cost of a value, 1 per entry if None.
+        :type cost: callable
+        """
+        self._entries = OrderedDict()
+        self._limit = limit
+        self._cost = cost or (lambda value: 1)
+        self._total = 0
+
+    def get(self, key):
+        """ Get a value, marking it as the most recently used, None if it is not cached. """
+        value = self._entries.get(key)
+        if value is not None or key in self._entries:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """ Cache a value, forgetting the least recently used ones beyond the limit. """
+        if key in self._entries:
+            self._total -= self._cost(self._entries.pop(key))
+        self._entries[key] = value
+        self._total += self._cost(value)
+        while self._total > self._limit and self._entries:
+            _, forgotten = self._entries.popitem(last=False)
+            self._total -= self._cost(forgotten)
+
+    def __contains__(self, key) -> bool:
+        """ Returns whether a value is cached. """
+        return key in self._entries
+
+    def __len__(self):
+        """ Returns the number of cached values. """
+        return len(self._entries)
+
+
+""" Bytes of the start of a file needed to recognize its format """
+_HEADER_SIZE = 132
+
+
+def _image_format(header: bytes) -> str:
+    """ Recognize the format of an image from its first bytes.
+
+    :param header: The first _HEADER_SIZE bytes of the file.
+    :type header: bytes
+    :returns: The format name, None if it is not a known image format.
+    :rtype: str
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if header.startswith(b"BM") and len(header) >= 26:
+        return "BMP"
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WebP"
+    if header[128:132] == b"DICM":
+        return "DICOM"
+    return None
+
+
+def _no_dimensions(content) -> tuple:
+    """ Dimensions of the formats whose headers are not read. """
+    return None, None
+
+
+def _png_dimensions(content) -> tuple:
+    """ Read the width and height of a PNG image from its IHDR chunk. """
+    return struct.unpack_from(">II", content, 16)
+
+
+def _gif_dimensions(content) -> tuple:
+    """ Read the width and height of a GIF image from its screen descriptor. """
+    return struct.unpack_from("<HH", content, 6)
+
+
+def _bmp_dimensions(content) -> tuple:
+    """ Read the width and height of a BMP image from its info header. """
+    width, height = struct.unpack_from("<ii", content, 18)
+    return width, abs(height)
+
+
+def _jpeg_dimensions(content) -> tuple:
+    """ Read the width and height of a JPEG image, skipping the segments before its frame header. """
+    position = 2
+    while position + 9 <= len(content):
+        if content[position] != 0xFF:
+            break
+        marker = content[position + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", content, position + 5)
+            return width, height
+        position += 2 + struct.unpack_from(">H", content, position + 2)[0]
+    return None, None
+
+
+""" Readers of the dimensions of each format """
+_DIMENSIONS = {"PNG": _png_dimensions, "GIF": _gif_dimensions, "BMP": _bmp_dimensions, "JPEG": _jpeg_dimensions}
+
+
+def _exif_thumbnail(content) -> bytes:
+    """ Extract the thumbnail a JPEG image embeds in the second directory of its EXIF segment.
+
+    :param content: The content of the JPEG image.
+    :type content: mmap.mmap
+    :returns: The thumbnail as JPEG bytes, None if the image has none.
+    :rtype: bytes
+    """
+    position = 2
+    while position + 4 <= len(content) and content[position] == 0xFF:
+        marker = content[position + 1]
+        length = struct.unpack_from(">H", content, position + 2)[0]
+        if marker == 0xE1 and content[position + 4:position + 10] == b"Exif\x00\x00":
+            tiff = position + 10
+            order = "<" if content[tiff:tiff + 2] == b"II" else ">"
+            ifd = tiff + struct.unpack_from(order + "I", content, tiff + 4)[0]
+            n_entries = struct.unpack_from(order + "H", content, ifd)[0]
+            next_ifd = struct.unpack_from(order + "I", content, ifd + 2 + 12 * n_entries)[0]
+            if not next_ifd:
+                return None
+            ifd = tiff + next_ifd
+            tags = {}
+            for entry in range(struct.unpack_from(order + "H", content, ifd)[0]):
+                tag, _, _, value = struct.unpack_from(order + "HHII", content, ifd + 2 + 12 * entry)
+                tags[tag] = value
+            if 0x0201 in tags and 0x0202 in tags:
+                start = tiff + tags[0x0201]
+                return content[start:start + tags[0x0202]]
+            return None
+        if 0xC0 <= marker <= 0xCF or marker == 0xDA:
+            return None
+        position += 2 + length
+    return None
+
+
+class InvalidImageError(Exception):
+    """Exception raised when trying to store a file that is not an image."""
+    pass
+
+
+if __name__ == "__main__":
+    import zlib
+    from datetime import datetime
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+
+    def png(width, height):
+        rows = b"".join(b"\x00" + bytes(width) for _ in range(height))
+        chunk = lambda kind, data: (struct.pack(">I", len(data)) + kind + data
+                                    + struct.pack(">I", zlib.crc32(kind + data)))
+        return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+    store = ImageStore(tempfile.mkdtemp())
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    history = ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", datetime.now())
+
+    first = store.attach(history, png(640, 480))
+    second = store.attach(history, png(640, 480))
+    print("Duplicate stored once: ", first == second, first)
+    store.attach(history, png(32, 32))
+    for image in store.images(history):
+        print(image, image.metadata, image.thumbnail)
+    try:
+        store.attach(history, b"not an image")
+    except InvalidImageError as error:
+        print("Rejected: ", error)
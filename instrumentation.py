@@ -0,0 +1,427 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from bisect import bisect_left
+
+from bed import Bed
+from clinical_history import ClinicalHistory
+from report import Report
+
+""" Methods timed by the instrumentation, by class; every static method of Report """
+TARGETS = {
+    Bed: ("admit_patient", "release_patient"),
+    ClinicalHistory: ("add_evolution_note", "add_diagnostic_image", "add_exam_results", "add_medicine",
+                      "add_vital_signs_reading"),
+    Report: tuple(name for name, value in vars(Report).items() if isinstance(value, staticmethod)),
+}
+
+
+class LatencyHistogram:
+    """
+    Class used to count the runs of an operation, its failures and its latencies in fixed buckets.
+    """
+
+    """ Upper bounds of the latency buckets in seconds, from a microsecond to ten seconds """
+    BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+               0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        """ LatencyHistogram constructor object.
+
+        :param buckets: The upper bounds of the buckets in seconds, in increasing order.
+        :type buckets: tuple[float]
+        """
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, failed: bool = False):
+        """ Record one run of the operation.
+
+        :param seconds: The latency of the run.
+        :type seconds: float
+        :param failed: Whether the run raised an exception.
+        :type failed: bool
+        """
+        index = bisect_left(self._buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._errors += failed
+
+    @property
+    def count(self) -> int:
+        """ Get the number of runs.
+
+        :returns: The number of runs.
+        :rtype: int
+        """
+        return sum(self._counts)
+
+    @property
+    def errors(self) -> int:
+        """ Get the number of runs that raised an exception.
+
+        :returns: The number of failed runs.
+        :rtype: int
+        """
+        return self._errors
+
+    @property
+    def sum(self) -> float:
+        """ Get the latency of every run added up.
+
+        :returns: The seconds.
+        :rtype: float
+        """
+        return self._sum
+
+    def cumulative_buckets(self) -> list:
+        """ Get the number of runs at most as slow as each bucket bound, the last bound being infinity.
+
+        :returns: Tuples of (upper bound, runs).
+        :rtype: list[tuple[float, int]]
+        """
+        with self._lock:
+            counts = list(self._counts)
+        total, buckets = 0, []
+        for bound, count in zip(self._buckets + (float("inf"),), counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, fraction: float) -> float:
+        """ Estimate a quantile of the latency as the upper bound of the bucket holding it.
+
+        :param fraction: The quantile, between 0 and 1.
+        :type fraction: float
+        :returns: The latency in seconds, 0 if nothing ran.
+        :rtype: float
+        """
+        buckets = self.cumulative_buckets()
+        rank = fraction * buckets[-1][1]
+        for bound, total in buckets:
+            if total and total >= rank:
+                return bound
+        return 0.0
+
+
+class Instrumentation:
+    """
+    Class used to measure how often and how fast the hot methods of the beds, clinical histories and reports run.
+
+    Enabling replaces the methods listed in TARGETS by wrappers counting their runs,
+    failures and latencies, and disabling puts the original methods back, so nothing is
+    measured and nothing costs anything while the instrumentation is off. Only one
+    instrumentation can be enabled at a time. The measures can be exported in the
+    Prometheus text format to a file, for the node exporter textfile collector, or pushed
+    to a Pushgateway.
+    """
+
+    """ Instrumentation currently enabled, None if there is none """
+    _enabled = None
+
+    def __init__(self, targets: dict = None, buckets=LatencyHistogram.BUCKETS):
+        """ Instrumentation constructor object.
+
+        :param targets: Mapping of class to the names of the methods to time, TARGETS if None.
+        :type targets: dict[type, tuple[str]]
+        :param buckets: The upper bounds of the latency buckets in seconds.
+        :type buckets: tuple[float]
+        """
+        self._targets = dict(targets or TARGETS)
+        self._buckets = buckets
+        self._histograms = {f"{cls.__name__}.{name}": LatencyHistogram(buckets)
+                            for cls, names in self._targets.items() for name in names}
+        self._originals = {}
+
+    @property
+    def enabled(self) -> bool:
+        """ Check whether the methods are being measured.
+
+        :returns: True if the instrumentation is enabled.
+        :rtype: bool
+        """
+        return Instrumentation._enabled is self
+
+    def enable(self):
+        """ Start measuring the target methods.
+
+        :raises InstrumentationError: If another instrumentation is enabled.
+        """
+        if self.enabled:
+            return
+        if Instrumentation._enabled is not None:
+            raise InstrumentationError("Another instrumentation is already enabled")
+        for cls, names in self._targets.items():
+            for name in names:
+                original = vars(cls)[name]
+                self._originals[cls, name] = original
+                histogram = self._histograms[f"{cls.__name__}.{name}"]
+                if isinstance(original, staticmethod):
+                    setattr(cls, name, staticmethod(_timed(original.__func__, histogram)))
+                else:
+                    setattr(cls, name, _timed(original, histogram))
+        Instrumentation._enabled = self
+
+    def disable(self):
+        """ Stop measuring, putting the original methods back. The measures are kept. """
+        if not self.enabled:
+            return
+        for (cls, name), original in self._originals.items():
+            setattr(cls, name, original)
+        self._originals.clear()
+        Instrumentation._enabled = None
+
+    def reset(self):
+        """ Forget the measures. """
+        for name in self._histograms:
+            self._histograms[name] = LatencyHistogram(self._buckets)
+        if self.enabled:
+            self.disable()
+            self.enable()
+
+    @property
+    def histograms(self) -> dict:
+        """ Get the measures of every target method.
+
+        :returns: Mapping of "Class.method" to its histogram.
+        :rtype: dict[str, LatencyHistogram]
+        """
+        return self._histograms
+
+    def to_prometheus(self, prefix: str = "hospital") -> str:
+        """ Format the measures in the Prometheus text exposition format.
+
+        :param prefix: The prefix of the metric names.
+        :type prefix: str
+        :returns: The text, with a runs counter, an errors counter and a latency histogram labelled by operation.
+        :rtype: str
+        """
+        lines = [f"# HELP {prefix}_operations_total Runs of the instrumented operations.",
+                 f"# TYPE {prefix}_operations_total counter"]
+        lines.extend(f'{prefix}_operations_total{{operation="{name}"}} {histogram.count}'
+                     for name, histogram in self._histograms.items())
+        lines += [f"# HELP {prefix}_operation_errors_total Runs of the instrumented operations that raised.",
+                  f"# TYPE {prefix}_operation_errors_total counter"]
+        lines.extend(f'{prefix}_operation_errors_total{{operation="{name}"}} {histogram.errors}'
+                     for name, histogram in self._histograms.items())
+        lines += [f"# HELP {prefix}_operation_seconds Latency of the instrumented operations.",
+                  f"# TYPE {prefix}_operation_seconds histogram"]
+        for name, histogram in self._histograms.items():
+            buckets = histogram.cumulative_buckets()
+            lines.extend(f'{prefix}_operation_seconds_bucket{{operation="{name}",le="{_format_bound(bound)}"}} {total}'
+                         for bound, total in buckets)
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{name}"}} {histogram.sum!r}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{name}"}} {buckets[-1][1]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, prefix: str = "hospital"):
+        """ Write the measures in the Prometheus text format to a file, replacing it at once.
+
+        :param path: The path of the file, for example in the textfile directory of the node exporter.
+        :type path: str
+        :param prefix: The prefix of the metric names.
+        :type prefix: str
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.write(self.to_prometheus(prefix))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def push_prometheus(self, url: str, prefix: str = "hospital", timeout: float = 5.0):
+        """ Send the measures in the Prometheus text format to an HTTP endpoint, such as a Pushgateway.
+
+        :param url: The URL, for example ``http://localhost:9091/metrics/job/hospital``.
+        :type url: str
+        :param prefix: The prefix of the metric names.
+        :type prefix: str
+        :param timeout: The seconds to wait for the endpoint.
+        :type timeout: float
+        :raises OSError: If the endpoint cannot be reached or answers with an error.
+        """
+        request = urllib.request.Request(url, self.to_prometheus(prefix).encode(), method="PUT",
+                                         headers={"Content-Type": "text/plain; version=0.0.4"})
+        with urllib.request.urlopen(request, timeout=timeout):
+            pass
+
+    def __enter__(self):
+        """ Enable the instrumentation for a with block. """
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Disable the instrumentation at the end of a with block. """
+        self.disable()
+
+
+class Capture:
+    """
+    Class used to profile a block of code with cProfile and to trace its memory with tracemalloc.
+
+    For example ``with Capture() as capture: Report.compute_all(histories)`` then
+    ``print(capture.profile_text())`` and ``print(capture.memory_text())``. Both tools slow
+    the code down several times, so a capture is for finding where the time and memory go,
+    not for measuring latency.
+    """
+
+    def __init__(self, frames: int = 1):
+        """ Capture constructor object.
+
+        :param frames: The number of stack frames kept for every memory allocation.
+        :type frames: int
+        """
+        self._frames = frames
+        self._profiler = None
+        self._snapshot = None
+
+    def __enter__(self):
+        """ Start profiling and tracing the memory. """
+        self._profiler = cProfile.Profile()
+        tracemalloc.start(self._frames)
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Stop profiling and take the memory snapshot. """
+        self._profiler.disable()
+        self._snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        tracemalloc.stop()
+
+    @property
+    def stats(self) -> pstats.Stats:
+        """ Get the profile of the block.
+
+        :returns: The profile statistics.
+        :rtype: pstats.Stats
+        """
+        return pstats.Stats(self._profiler)
+
+    @property
+    def snapshot(self) -> tracemalloc.Snapshot:
+        """ Get the memory still allocated at the end of the block.
+
+        :returns: The memory snapshot.
+        :rtype: tracemalloc.Snapshot
+        """
+        return self._snapshot
+
+    def profile_text(self, limit: int = 20, sort: str = "cumulative") -> str:
+        """ Format the functions that took the most time.
+
+        :param limit: The number of functions.
+        :type limit: int
+        :param sort: The pstats sort key, for example "cumulative" or "tottime".
+        :type sort: str
+        :returns: The pstats table.
+        :rtype: str
+        """
+        output = io.StringIO()
+        pstats.Stats(self._profiler, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def memory_text(self, limit: int = 20) -> str:
+        """ Format the source lines holding the most memory at the end of the block.
+
+        :param limit: The number of lines.
+        :type limit: int
+        :returns: One line per source line, with its bytes and allocations.
+        :rtype: str
+        """
+        return "\n".join(str(statistic) for statistic in self._snapshot.statistics("lineno")[:limit])
+
+    def dump(self, directory: str):
+        """ Save the profile, readable with pstats or snakeviz, and the memory snapshot.
+
+        :param directory: The directory, created if missing, receiving profile.pstats and memory.snapshot.
+        :type directory: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._profiler.dump_stats(os.path.join(directory, "profile.pstats"))
+        self._snapshot.dump(os.path.join(directory, "memory.snapshot"))
+
+
+def _timed(function, histogram: LatencyHistogram):
+    """ Wrap a function to record the latency of every call in a histogram.
+
+    :param function: The function.
+    :type function: callable
+    :param histogram: The histogram receiving the latencies.
+    :type histogram: LatencyHistogram
+    :returns: The wrapper.
+    :rtype: callable
+    """
+    perf_counter = time.perf_counter
+    observe = histogram.observe
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            observe(perf_counter() - start, True)
+            raise
+        observe(perf_counter() - start)
+        return result
+    return wrapper
+
+
+def _format_bound(bound: float) -> str:
+    """ Format a bucket bound as Prometheus expects, +Inf for infinity. """
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class InstrumentationError(Exception):
+    """Exception raised when enabling an instrumentation while another one is enabled."""
+    pass
+
+
+if __name__ == "__main__":
+    from bed import BedOccupiedError
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from datetime import datetime
+
+    instrumentation = Instrumentation()
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    beds = [Bed(n) for n in range(1, 101)]
+
+    with instrumentation:
+        for bed in beds:
+            bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                              "Cardiology")
+            bed.clinical_history.add_medicine("Lisinopril")
+        Report.compute_all(bed.clinical_history for bed in beds)
+        try:
+            beds[0].admit_patient(beds[1].clinical_history, "Cardiology")
+        except BedOccupiedError as error:
+            print("Failed admission:", error)
+    beds[1].release_patient()
+
+    for name, histogram in instrumentation.histograms.items():
+        if histogram.count:
+            print(f"{name}: {histogram.count} runs - {histogram.errors} errors - p99 <= {histogram.quantile(0.99)} s")
+    print(instrumentation.to_prometheus().splitlines()[2])
+
+    with Capture() as capture:
+        Report.compute_all([bed.clinical_history for bed in beds if bed.occupied] * 1000)
+    print(capture.profile_text(5))
+    print(capture.memory_text(3))
@@ -0,0 +1,218 @@
+import threading
+from array import array
+from datetime import datetime, timedelta
+from operator import sub
+
+""" Origin and unit of the epoch seconds the stays are stored as """
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+class LengthOfStay:
+    """
+    Class used to measure how long patients stay, per medical service.
+
+    Finished stays are kept as admission and discharge times, in seconds since the epoch,
+    in one pair of int64 arrays per service, so they survive the release of the bed and
+    cost 16 bytes each. Patients still admitted are followed through the bed listener hooks
+    and counted as stays censored at the time of the statistics, so a service whose patients
+    stay for long is not reported as having short stays only because they were not discharged.
+    """
+
+    """ Percentiles reported by statistics, by name """
+    PERCENTILES = {"median": 0.5, "p90": 0.9, "p99": 0.99}
+
+    def __init__(self, beds=()):
+        """ LengthOfStay constructor object.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        self._admitted = {}
+        self._discharged = {}
+        self._inpatients = {}
+        self._lock = threading.RLock()
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start following some beds, counting the patients already admitted as inpatients.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                self.patient_admitted(bed, bed.clinical_history)
+
+    def add_history(self, clinical_history):
+        """ Add the stay of a discharged clinical history, for example one loaded from the archive.
+
+        Histories without a discharge date are ignored; inpatients are followed through the beds.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        """
+        self.add_histories((clinical_history,))
+
+    def add_histories(self, histories):
+        """ Add the stays of discharged clinical histories, see add_history.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        """
+        with self._lock:
+            for clinical_history in histories:
+                discharge_date = clinical_history.discharge_date
+                if discharge_date is not None:
+                    self._add_stay(clinical_history.service, clinical_history.admission_date, discharge_date)
+
+    def _add_stay(self, service: str, admission_date: datetime, discharge_date: datetime):
+        """ Store a finished stay as epoch seconds. The caller holds the lock.
+
+        :param service: The medical service of the stay.
+        :type service: str
+        :param admission_date: The date of admission.
+        :type admission_date: datetime
+        :param discharge_date: The date of discharge.
+        :type discharge_date: datetime
+        """
+        admitted = self._admitted.get(service)
+        if admitted is None:
+            admitted = self._admitted[service] = array("q")
+            self._discharged[service] = array("q")
+        admitted.append((admission_date - _EPOCH) // _SECOND)
+        self._discharged[service].append((discharge_date - _EPOCH) // _SECOND)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that starts following an inpatient. """
+        with self._lock:
+            self._inpatients[clinical_history] = bed
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that stores the finished stay, ending at the discharge date or now if it is unset. """
+        with self._lock:
+            if self._inpatients.pop(clinical_history, None) is not None:
+                self._add_stay(clinical_history.service, clinical_history.admission_date,
+                               clinical_history.discharge_date or datetime.now())
+
+    def stays(self, service: str, now: datetime = None, include_inpatients: bool = True) -> array:
+        """ Get the lengths of the stays of a medical service, sorted.
+
+        :param service: The medical service.
+        :type service: str
+        :param now: The time at which the stays of inpatients are censored, the current time if None.
+        :type now: datetime
+        :param include_inpatients: Whether to count the inpatients, censored at now.
+        :type include_inpatients: bool
+        :returns: The lengths of the stays in seconds, shortest first.
+        :rtype: array[int]
+        """
+        with self._lock:
+            stays = array("q", map(sub, self._discharged.get(service, ()), self._admitted.get(service, ())))
+            if include_inpatients:
+                now = _epoch_seconds(now or datetime.now())
+                stays.extend(now - _epoch_seconds(history.admission_date)
+                             for history in self._inpatients if history.service == service)
+        return array("q", sorted(stays))
+
+    def statistics(self, now: datetime = None, include_inpatients: bool = True) -> dict:
+        """ Get the mean, median, 90th and 99th percentile length of stay per medical service.
+
+        Percentiles are linearly interpolated between the two closest stays.
+
+        :param now: The time at which the stays of inpatients are censored, the current time if None.
+        :type now: datetime
+        :param include_inpatients: Whether to count the inpatients, censored at now.
+        :type include_inpatients: bool
+        :returns: A dictionary mapping medical services to a dictionary with the number of
+            stays, the number of them censored, and the mean, median, p90 and p99 lengths.
+        :rtype: dict[str, dict[str, int | timedelta]]
+        """
+        now = _epoch_seconds(now or datetime.now())
+        with self._lock:
+            stays_per_service = {service: array("q", map(sub, self._discharged[service], admitted))
+                                 for service, admitted in self._admitted.items()}
+            censored_per_service = {}
+            if include_inpatients:
+                for history in self._inpatients:
+                    service = history.service
+                    stays_per_service.setdefault(service, array("q")).append(
+                        now - _epoch_seconds(history.admission_date))
+                    censored_per_service[service] = censored_per_service.get(service, 0) + 1
+
+        statistics = {}
+        for service, stays in stays_per_service.items():
+            stays = sorted(stays)
+            statistics[service] = {"stays": len(stays), "censored": censored_per_service.get(service, 0),
+                                   "mean": timedelta(seconds=sum(stays) / len(stays))}
+            for name, fraction in self.PERCENTILES.items():
+                statistics[service][name] = timedelta(seconds=_percentile(stays, fraction))
+        return statistics
+
+    @property
+    def inpatients(self) -> int:
+        """ Get the number of patients still admitted.
+
+        :returns: The number of inpatients.
+        :rtype: int
+        """
+        return len(self._inpatients)
+
+    def __len__(self):
+        """ Returns the number of finished stays.
+
+        :returns: The number of finished stays.
+        :rtype: int
+        """
+        return sum(len(admitted) for admitted in self._admitted.values())
+
+
+def _epoch_seconds(date: datetime) -> int:
+    """ Convert a date to whole seconds since the epoch.
+
+    :param date: The date.
+    :type date: datetime
+    :returns: The seconds since the epoch.
+    :rtype: int
+    """
+    return (date - _EPOCH) // _SECOND
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    """ Get a percentile of sorted values, interpolating linearly between the two closest values.
+
+    :param sorted_values: The values, sorted.
+    :type sorted_values: list[int]
+    :param fraction: The percentile, between 0 and 1.
+    :type fraction: float
+    :returns: The percentile.
+    :rtype: float
+    """
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+
+    beds = [Bed(n) for n in range(1, 6)]
+    length_of_stay = LengthOfStay(beds)
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    for bed, days in zip(beds, (1, 2, 3, 10, 30)):
+        bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                          "Cardiology")
+        if days < 10:
+            bed.clinical_history.discharge_date = admission_date + timedelta(days=days)
+            bed.release_patient()
+
+    now = admission_date + timedelta(days=20)
+    print("Discharged only: ", length_of_stay.statistics(now, include_inpatients=False)["Cardiology"]["mean"])
+    print("With inpatients: ", {name: str(value) for name, value in length_of_stay.statistics(now)["Cardiology"].items()})
@@ -1,20 +1,123 @@
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
+from itertools import chain, islice
 from patient import Patient
+from patient_registry import PatientRegistry
 from vital_signs import VitalSigns
-from bed import Bed
+from bed_pool import NoBedAvailableError
+from census import CensusTimeline
 from clinical_history import ClinicalHistory
+from discharge_archive import DischargeArchive
+from image_store import ImageStore, InvalidImageError
+from instrumentation import Instrumentation
+from length_of_stay import LengthOfStay
+from medication_stats import MedicationStatistics
 from report import Report
+from storage import SQLiteRepository
+from topology import HospitalNetwork
+from ward_statistics import WardStatistics
 
 """ List of available medical services """
 medical_services_available = ("Internal Medicine", "General Surgery", "Pediatrics", "Cardiology", "Neurology",
                               "Psychiatry", "Radiology", "Rehabilitation")
 
-""" List to create 300 beds """
-beds = [Bed(n) for n in range(1, 301)]
+""" Database keeping the beds and clinical histories between runs. Every admission, discharge and finished history
+update is saved to it right away, so the menu does not attach an EventJournal, which suits the ward server where
+changes are not saved one by one """
+repository = SQLiteRepository("hospital.db")
+
+""" Sites and wards of the hospital, beds numbered from 1 across them. Every service has a block of 30 beds,
+the last 60 beds are shared, and a full service borrows the beds of the others while they keep 2 free """
+topology = {"sites": [{"name": "San Vicente", "wards": [{
+    "name": "General", "beds": 300,
+    "service_beds": {service: range(30 * n + 1, 30 * n + 31) for n, service in enumerate(medical_services_available)},
+    "borrow": {None: medical_services_available},
+    "keep_free": {service: 2 for service in medical_services_available}}]}]}
+
+""" Network routing admissions to its wards, with the beds saved by the previous run if any. New beds are saved
+once, then every admission and discharge only saves its own bed """
+saved_beds = repository.load_beds()
+network = HospitalNetwork.from_config(topology, saved_beds)
+beds = network.beds
+if not saved_beds:
+    repository.save_beds(beds)
+ward_statistics = WardStatistics(beds)
+
+""" Index of the admitted patients by id and name, so the menu finds their beds without walking them """
+registry = PatientRegistry(beds)
+
+""" Archive keeping the clinical histories of the discharged patients """
+discharge_archive = DischargeArchive("hospital_archive", beds)
+
+""" Content-addressed store of the diagnostic images """
+image_store = ImageStore("hospital_images")
+
+""" Occupancy timeline, prescriptions with normalized medicine names and length of stay of the admitted patients """
+census = CensusTimeline(beds)
+medication_statistics = MedicationStatistics(beds)
+length_of_stay = LengthOfStay(beds)
+
+""" Add the archived patients to the three of them, reading the archive once, 100000 histories at a time """
+archived_histories = discharge_archive.histories()
+while True:
+    archived_chunk = list(islice(archived_histories, 100000))
+    if not archived_chunk:
+        break
+    for archived_statistics in (census, medication_statistics, length_of_stay):
+        archived_statistics.add_histories(archived_chunk)
+
+""" Opt-in measures of the admissions, history changes and reports, written in the Prometheus text format
+to the file named by the HOSPITAL_METRICS environment variable after every option """
+metrics_path = os.environ.get("HOSPITAL_METRICS")
+instrumentation = Instrumentation()
+if metrics_path:
+    instrumentation.enable()
+
+
+
+def find_bed(action: str):
+    """ Ask for the bed number, the id or the start of the name of a patient, and find the bed.
+
+    :param action: What is done to the patient, shown in the prompts.
+    :type action: str
+    :returns: The bed, None if it was not found.
+    :rtype: Bed
+    """
+    print(f"Find the patient to {action} by: 1. Bed number 2. Patient id 3. Name")
+    how = input("Enter The Option: ")
+    if how == "1":
+        n_bed = int(input("Number of bed: "))
+        if not 1 <= n_bed <= len(beds):
+            print(f"Non existent bed {n_bed}")
+            return None
+        return beds[n_bed - 1]
+    if how == "2":
+        found_id = input("Patient id: ")
+    elif how == "3":
+        admitted = [found for found in registry.find_by_name_prefix(input("Name: "))
+                    if registry.current_bed(found.id) is not None]
+        if not admitted:
+            print("No admitted patient has that name")
+            return None
+        if len(admitted) == 1:
+            return registry.current_bed(admitted[0].id)
+        for found in admitted:
+            print(f"{found.id} - {found.name} - bed {registry.current_bed(found.id).number}")
+        found_id = input("Patient id: ")
+    else:
+        print("Invalid option, please select numbers from 1 - 3")
+        return None
+    bed = registry.current_bed(found_id)
+    if bed is None:
+        print(f"The patient {found_id} is not admitted")
+    return bed
+
 
 print("\n\t\tHospital San Vicente´s System")
 
 while True:
+    if metrics_path:
+        instrumentation.write_prometheus(metrics_path)
     print("\n\tMain Menu")
     print("1. Admit Patient")
     print("2. Add To Clinical History")
@@ -54,24 +157,20 @@ while True:
 
         clinical_history = ClinicalHistory(patient, vital_signs, service, admission_date)
 
-        """ Find an available bed to admit the patient """
-        available_bed = None
-        for bed in beds:
-            if not bed.occupied:
-                available_bed = bed
-                break
-
-        if available_bed:
-            available_bed.admit_patient(clinical_history, service)
+        """ Take the first available bed of the service in the least loaded ward to admit the patient """
+        try:
+            available_bed = network.admit(clinical_history, service)
+            repository.save_bed(available_bed)
             print(f"Patient {patient.name} admitted in bed {available_bed.number}")
-        else:
+        except NoBedAvailableError:
             print("No bed available")
 
     elif op == "2":
-        n_bed = int(input("Number of bed of patient to actualize: "))
-        bed = beds[n_bed - 1]
+        bed = find_bed("actualize")
 
-        if bed.occupied:
+        if bed is None:
+            pass
+        elif bed.occupied:
             while True:
                 print("\n\tClinical History Menu")
                 print("1. Add Chronic Disease")
@@ -101,7 +200,10 @@ while True:
 
                 elif sub_op == "3":
                     img = input("Paste the image route: ")
-                    bed.clinical_history.add_diagnostic_image(img)
+                    try:
+                        image_store.attach(bed.clinical_history, img)
+                    except (OSError, InvalidImageError) as error:
+                        print(error)
 
                 elif sub_op == "4":
                     result = input("Enter the exam result: ")
@@ -113,6 +215,7 @@ while True:
 
                 elif sub_op == "6":
                     print("Saving...")
+                    repository.save_history(bed.clinical_history)
                     break
 
                 else:
@@ -122,56 +225,61 @@ while True:
             print(f"The bed {bed.number} is not occupied")
 
     elif op == "3":
-        n_bed = int(input("Number of bed of patient to discharge: "))
-        bed = beds[n_bed - 1]
+        bed = find_bed("discharge")
 
-        if bed.occupied:
+        if bed is None:
+            pass
+        elif bed.occupied:
             discharge_date_str = input("Discharge date (YYYY-MM-DD HH:mm): ")
             discharge_date = datetime.strptime(discharge_date_str, '%Y-%m-%d %H:%M')
 
             bed.clinical_history.discharge_date = discharge_date
 
+            repository.save_history(bed.clinical_history)
             bed.release_patient()
+            repository.save_bed(bed)
             print(f"Patient Discharged from Bed {bed.number}")
 
         else:
             print(f"The bed {bed.number} is not occupied")
 
     elif op == "4":
-        clinical_histories = [bed.clinical_history for bed in beds if bed.occupied]
-
-        if not clinical_histories:
-            print("No occupied beds to generate a report.")
+        if not ward_statistics.occupied_beds and not len(discharge_archive):
+            print("No occupied beds or discharged patients to generate a report.")
         else:
-            total_beds = len(beds)
-            occupied_beds = sum(1 for bed in beds if bed.occupied)
-            occupied_beds_per_service = {}
-
-            for bed in beds:
-                if bed.occupied:
-                    service = bed.service
-                    if service in occupied_beds_per_service:
-                        occupied_beds_per_service[service] += 1
-                    else:
-                        occupied_beds_per_service[service] = 1
-
-            admissions, discharges = Report.admissions_and_discharges_per_service(clinical_histories)
-            occupation_rate = Report.occupancy_rate(total_beds, occupied_beds)
-            average_stay = Report.avg_stay_per_service(clinical_histories)
-            chronic_patients = Report.patients_with_chronic_diseases(clinical_histories)
-            medicines = Report.meds_per_service(clinical_histories)
+            clinical_histories = chain(ward_statistics.clinical_histories(), discharge_archive.histories())
+
+            report = Report.compute_all(clinical_histories, ("admissions_and_discharges_per_service",
+                                                             "avg_stay_per_service", "patients_with_chronic_diseases",
+                                                             "meds_per_service"))
+            admissions, discharges = report["admissions_and_discharges_per_service"]
+            occupation_rate = ward_statistics.occupancy_rate
+            average_stay = report["avg_stay_per_service"]
+            chronic_patients = report["patients_with_chronic_diseases"]
+            medicines = report["meds_per_service"]
 
             print("\nAdmissions Per Service: ", admissions)
             print("Discharges Per Service: ", discharges)
             print(f"Hospital Occupancy Rate: {occupation_rate} %")
+            print("Occupied Beds Per Service: ", ward_statistics.occupied_per_service)
+            now = datetime.now()
+            print("Highest Occupied Beds Per Service In The Last 24 Hours: ",
+                  {service: census.max_occupancy(now - timedelta(days=1), now, service) for service in census.services})
             print("Average Length Of Stay By Service: ", average_stay)
+            print("Length Of Stay By Service (Mean / Median / P90 / P99), Counting Admitted Patients: ",
+                  {service: " / ".join(str(stay[name]).split(".")[0] for name in ("mean", "median", "p90", "p99"))
+                   for service, stay in length_of_stay.statistics().items()})
             print("Patients With Chronic Diseases: ", chronic_patients)
             print("Prescription Of Medications By Service: ", medicines)
+            print("Most Prescribed Medicines By Service: ",
+                  {service: medication_statistics.top(3, service) for service in medication_statistics.services})
 
     elif op == "5":
         confirm_exit = input("Are you sure you want to exit? (Y/N): ")
         if confirm_exit.upper() == "Y":
             print("\n\n\t\tHave a great day :)\n\n")
+            repository.close()
+            discharge_archive.close()
             break
 
     else:
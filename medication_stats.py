@@ -0,0 +1,422 @@
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+
+""" Doses, units and pharmaceutical forms removed from medicine names, as in "Paracetamol 500 mg tablets" """
+_DOSE = re.compile(r"(?:(?<=\s)|^)\d+(?:[.,]\d+)?(?:/\d+(?:[.,]\d+)?)?\s*(?:mg|mcg|ug|g|ml|l|ui|iu|%)?"
+                   r"(?:\s*/\s*(?:ml|l|dose|g|kg|h))?(?=\s|$)")
+_FORMS = frozenset({"tablet", "tablets", "tab", "tabs", "capsule", "capsules", "cap", "caps", "syrup", "drops",
+                    "injection", "inj", "solution", "suspension", "cream", "ointment", "inhaler", "oral", "iv"})
+
+
+class MedicineVocabulary:
+    """
+    Class used to give every medicine a small integer id, after normalizing its name.
+
+    Names are normalized once per distinct spelling: "Paracetamol 500mg" and "paracetamol"
+    both become "paracetamol" and get the same id, and the counters only store ids. The
+    normalized names of the spellings are cached, the cache being emptied whenever it holds
+    max_spellings of them; the interned names themselves are kept, one per distinct medicine.
+    """
+
+    def __init__(self, max_spellings: int = 65536):
+        """ MedicineVocabulary constructor object.
+
+        :param max_spellings: The largest number of spellings whose normalized name is cached.
+        :type max_spellings: int
+        """
+        self._ids = {}
+        self._names = []
+        self._spellings = {}
+        self._max_spellings = max_spellings
+
+    def normalize(self, medicine: str) -> str:
+        """ Normalize a medicine name with normalize_medicine, through the cache of spellings.
+
+        :param medicine: The medicine as prescribed.
+        :type medicine: str
+        :returns: The normalized name.
+        :rtype: str
+        """
+        name = self._spellings.get(medicine)
+        if name is None:
+            name = normalize_medicine(medicine)
+            if len(self._spellings) >= self._max_spellings:
+                self._spellings.clear()
+            self._spellings[medicine] = name
+        return name
+
+    def intern(self, medicine: str) -> int:
+        """ Get the id of a medicine, adding its normalized name to the vocabulary if needed.
+
+        :param medicine: The medicine as prescribed.
+        :type medicine: str
+        :returns: The id of the normalized name.
+        :rtype: int
+        """
+        name = self.normalize(medicine)
+        medicine_id = self._ids.get(name)
+        if medicine_id is None:
+            medicine_id = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return medicine_id
+
+    def find(self, medicine: str) -> int:
+        """ Get the id of a medicine without adding it.
+
+        :param medicine: The medicine, in any spelling.
+        :type medicine: str
+        :returns: The id, None if the medicine is not in the vocabulary.
+        :rtype: int
+        """
+        return self._ids.get(self.normalize(medicine))
+
+    def name(self, medicine_id: int) -> str:
+        """ Get the normalized name of a medicine id.
+
+        :param medicine_id: The id.
+        :type medicine_id: int
+        :returns: The normalized name.
+        :rtype: str
+        """
+        return self._names[medicine_id]
+
+    def __len__(self):
+        """ Returns the number of distinct normalized medicines.
+
+        :returns: The number of medicines.
+        :rtype: int
+        """
+        return len(self._names)
+
+
+class CountMinSketch:
+    """
+    Class used to estimate how many times each item was counted, in fixed memory.
+
+    Estimates are never below the true count and exceed it by at most 2/width of the
+    total count with a probability of 1 - 1/2**depth. The column of each row comes from a
+    single hash of the item, combined as h1 + row * h2, so counting costs one hash.
+    """
+
+    """ Prime modulus and coefficients of the item hash """
+    _PRIME = (1 << 61) - 1
+    _MULTIPLIER = 0x9E3779B97F4A7C15 % _PRIME
+    _OFFSET = 0xBF58476D1CE4E5B9 % _PRIME
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        """ CountMinSketch constructor object.
+
+        :param width: The number of counters of each row.
+        :type width: int
+        :param depth: The number of rows.
+        :type depth: int
+        """
+        self._width = width
+        self._counters = array("q", bytes(8 * width * depth))
+        self._rows = range(0, width * depth, width)
+
+    def _columns(self, item: int) -> list:
+        """ Get the position of the counter of an item in every row.
+
+        :param item: The item.
+        :type item: int
+        :returns: The positions in the counters array.
+        :rtype: list[int]
+        """
+        width = self._width
+        hashed = (self._MULTIPLIER * item + self._OFFSET) % self._PRIME
+        first, step = hashed % width, (hashed // width) % width | 1
+        return [row + (first + index * step) % width for index, row in enumerate(self._rows)]
+
+    def add(self, item: int, count: int = 1):
+        """ Count an item.
+
+        :param item: The item.
+        :type item: int
+        :param count: How many times it is counted.
+        :type count: int
+        """
+        counters = self._counters
+        for position in self._columns(item):
+            counters[position] += count
+
+    def estimate(self, item: int) -> int:
+        """ Estimate how many times an item was counted.
+
+        :param item: The item.
+        :type item: int
+        :returns: The estimate, never below the true count.
+        :rtype: int
+        """
+        return min(map(self._counters.__getitem__, self._columns(item)))
+
+
+class SpaceSaving:
+    """
+    Class used to find the most frequent items in fixed memory, with the Space-Saving algorithm.
+
+    At most capacity items are monitored. An item that is not monitored replaces the one with
+    the lowest count, inheriting that count as its overestimation error, so every item counted
+    more than total / capacity times is always monitored.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """ SpaceSaving constructor object.
+
+        :param capacity: The number of monitored items.
+        :type capacity: int
+        """
+        self._capacity = capacity
+        self._counts = {}
+        self._errors = {}
+        self._heap = []
+
+    def add(self, item: str, count: int = 1):
+        """ Count an item.
+
+        The monitored items are kept in a min-heap whose entries may lag behind their
+        counts; outdated entries are refreshed only when they reach the top, so counting a
+        monitored item is O(1) and replacing the lowest one O(log capacity) amortized.
+
+        :param item: The item.
+        :type item: str
+        :param count: How many times it is counted.
+        :type count: int
+        """
+        counts = self._counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self._capacity:
+            counts[item] = count
+            self._errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+        else:
+            heap = self._heap
+            while heap[0][0] != counts[heap[0][1]]:
+                heapq.heapreplace(heap, (counts[heap[0][1]], heap[0][1]))
+            lowest, evicted = heap[0]
+            del counts[evicted], self._errors[evicted]
+            counts[item] = lowest + count
+            self._errors[item] = lowest
+            heapq.heapreplace(heap, (lowest + count, item))
+
+    def top(self, k: int) -> list:
+        """ Get the k items with the highest counts.
+
+        :param k: The number of items.
+        :type k: int
+        :returns: Tuples of (item, count, overestimation error), highest count first.
+        :rtype: list[tuple[str, int, int]]
+        """
+        return [(item, count, self._errors[item])
+                for item, count in heapq.nlargest(k, self._counts.items(), key=lambda entry: entry[1])]
+
+
+class MedicationStatistics:
+    """
+    Class used to count prescriptions per medical service and find the most prescribed medicines.
+
+    The statistics listen to the beds and to the clinical histories of their patients, so
+    every medicine added to a history is counted as it is prescribed. Medicine names are
+    normalized through a MedicineVocabulary. Counts are exact by default, by the id of each
+    medicine interned in the vocabulary; in sketch mode each service keeps a CountMinSketch of
+    the hashes of the names and a SpaceSaving summary of the names instead, and nothing is
+    interned, so the memory used is fixed whatever the number of distinct medicines.
+    """
+
+    def __init__(self, beds=(), sketch: bool = False, width: int = 2048, depth: int = 4, capacity: int = 64):
+        """ MedicationStatistics constructor object.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        :param sketch: Whether to count with sketches instead of exact counters.
+        :type sketch: bool
+        :param width: The number of counters of each row of the Count-Min sketches.
+        :type width: int
+        :param depth: The number of rows of the Count-Min sketches.
+        :type depth: int
+        :param capacity: The number of medicines monitored by the Space-Saving summaries.
+        :type capacity: int
+        """
+        self._vocabulary = MedicineVocabulary()
+        self._sketch = sketch
+        self._width = width
+        self._depth = depth
+        self._capacity = capacity
+        self._counters = {}
+        self._lock = threading.RLock()
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start following some beds, counting the medicines of the patients already admitted.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                self.patient_admitted(bed, bed.clinical_history)
+
+    def add(self, service: str, medicine: str, count: int = 1):
+        """ Count the prescription of a medicine.
+
+        :param service: The medical service of the patient.
+        :type service: str
+        :param medicine: The medicine as prescribed.
+        :type medicine: str
+        :param count: How many prescriptions are counted.
+        :type count: int
+        """
+        with self._lock:
+            if self._sketch:
+                name = self._vocabulary.normalize(medicine)
+                hashed = hash(name)
+            else:
+                medicine_id = self._vocabulary.intern(medicine)
+            for key in (service, None):
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = self._new_counter()
+                if self._sketch:
+                    counter[0].add(hashed, count)
+                    counter[1].add(name, count)
+                else:
+                    counter[medicine_id] = counter.get(medicine_id, 0) + count
+
+    def _new_counter(self):
+        """ Make the counter of a service: a dictionary of counts, or a Count-Min sketch and a Space-Saving summary.
+
+        :returns: The counter.
+        :rtype: dict[int, int] | tuple[CountMinSketch, SpaceSaving]
+        """
+        if self._sketch:
+            return CountMinSketch(self._width, self._depth), SpaceSaving(self._capacity)
+        return {}
+
+    def add_histories(self, histories):
+        """ Count the medicines of many clinical histories, for example archived ones.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        """
+        with self._lock:
+            for clinical_history in histories:
+                for medicine in clinical_history.medicines:
+                    self.add(clinical_history.service, medicine)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that counts the medicines already prescribed and follows the history. """
+        with self._lock:
+            for medicine in clinical_history.medicines:
+                self.add(clinical_history.service, medicine)
+            clinical_history.add_listener(self)
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that stops following the history. Its prescriptions stay counted. """
+        clinical_history.remove_listener(self)
+
+    def history_updated(self, clinical_history, attribute, value):
+        """ Clinical history listener hook that counts every new prescription. """
+        if attribute == "medicines":
+            self.add(clinical_history.service, value)
+
+    def count(self, medicine: str, service: str = None) -> int:
+        """ Get how many times a medicine was prescribed, estimated from above in sketch mode.
+
+        :param medicine: The medicine, in any spelling.
+        :type medicine: str
+        :param service: The medical service, the whole hospital if None.
+        :type service: str
+        :returns: The number of prescriptions.
+        :rtype: int
+        """
+        with self._lock:
+            counter = self._counters.get(service)
+            if counter is None:
+                return 0
+            if self._sketch:
+                return counter[0].estimate(hash(self._vocabulary.normalize(medicine)))
+            medicine_id = self._vocabulary.find(medicine)
+            return counter.get(medicine_id, 0) if medicine_id is not None else 0
+
+    def top(self, k: int = 10, service: str = None) -> list:
+        """ Get the most prescribed medicines.
+
+        In sketch mode the counts come from the Space-Saving summary and may exceed the true
+        counts by the count of the medicine they replaced.
+
+        :param k: The number of medicines.
+        :type k: int
+        :param service: The medical service, the whole hospital if None.
+        :type service: str
+        :returns: Tuples of (normalized name, number of prescriptions), most prescribed first.
+        :rtype: list[tuple[str, int]]
+        """
+        with self._lock:
+            counter = self._counters.get(service)
+            if counter is None:
+                return []
+            if self._sketch:
+                return [(name, count) for name, count, _ in counter[1].top(k)]
+            top = heapq.nlargest(k, counter.items(), key=lambda entry: entry[1])
+            return [(self._vocabulary.name(medicine_id), count) for medicine_id, count in top]
+
+    @property
+    def services(self) -> list:
+        """ Get the medical services with prescriptions.
+
+        :returns: The medical services in name order.
+        :rtype: list[str]
+        """
+        return sorted(service for service in self._counters if service is not None)
+
+    @property
+    def vocabulary(self):
+        """ Get the vocabulary of normalized medicine names, empty in sketch mode.
+
+        :returns: The vocabulary.
+        :rtype: MedicineVocabulary
+        """
+        return self._vocabulary
+
+
+def normalize_medicine(medicine: str) -> str:
+    """ Normalize a medicine name, removing case, accents, doses, units and pharmaceutical forms.
+
+    For example "Paracetamol 500mg", "PARACETAMOL 500 MG tablets" and "paracetamol" all
+    become "paracetamol".
+
+    :param medicine: The medicine as prescribed.
+    :type medicine: str
+    :returns: The normalized name, or the lower case text if nothing is left of it.
+    :rtype: str
+    """
+    decomposed = unicodedata.normalize("NFKD", medicine.casefold())
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    words = (word.strip(".,;:()") for word in _DOSE.sub(" ", text).split())
+    return " ".join(word for word in words if word and word not in _FORMS) or " ".join(text.split())
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    beds = [Bed(n) for n in range(1, 3)]
+    statistics = MedicationStatistics(beds)
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    beds[0].admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                          "Cardiology")
+    for medicine in ("Paracetamol 500mg", "paracetamol", "Lisinopril 10 mg tablets", "PARACETAMOL 1 g"):
+        beds[0].clinical_history.add_medicine(medicine)
+
+    print("Normalized: ", normalize_medicine("Ibuprofeno 400 mg cápsulas"), "-", normalize_medicine("Vitamin B12"))
+    print("Top in Cardiology: ", statistics.top(3, "Cardiology"))
+    print("Paracetamol 500mg prescriptions: ", statistics.count("Paracetamol 500mg"))
@@ -0,0 +1,350 @@
+import re
+import sqlite3
+import threading
+
+
+class NoteIndex:
+    """
+    Class used to search the evolution notes and exam results of the clinical histories.
+
+    The notes are kept in an SQLite FTS5 full-text index, which tokenizes them ignoring case
+    and accents, answers term and phrase queries from its inverted index and ranks the
+    matches with BM25. The index listens to the beds and to the clinical histories of their
+    patients, so every note is searchable as soon as it is written; archived histories can
+    be added too, so a search covers current and past stays. Every note also indexes the
+    state of its stay, admitted or archived, so searching the admitted patients only is
+    answered inside the index; the notes of a released history are reindexed as archived.
+    Histories still admitted when the index is closed are dropped when it is opened again,
+    as the beds add them back.
+
+    An index kept in a file is written in WAL mode and searched through a read connection
+    per thread, so a search never holds the lock taken by the listener hooks and sees the
+    notes committed before it started; call flush to make the latest notes searchable. An
+    index in memory has a single connection, so its searches hold the lock.
+    """
+
+    """ History attributes indexed, with the kind of note they hold """
+    KINDS = {"evolution_notes": "note", "exam_results": "exam"}
+
+    def __init__(self, path: str = ":memory:", beds=(), commit_every: int = 1000):
+        """ NoteIndex constructor object.
+
+        :param path: The path of the SQLite database holding the index, in memory by default.
+        :type path: str
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        :param commit_every: The number of indexed notes between commits.
+        :type commit_every: int
+        """
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS histories (
+                id INTEGER PRIMARY KEY, patient_id TEXT, name TEXT, service TEXT,
+                admission_date TEXT, discharge_date TEXT, archived INTEGER NOT NULL);
+            CREATE VIRTUAL TABLE IF NOT EXISTS notes USING fts5(
+                text, state, kind UNINDEXED, history_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2');
+            INSERT INTO notes (notes, rank) VALUES ('rank', 'bm25(1.0, 0.0)');
+            DELETE FROM notes WHERE notes MATCH 'state : admitted';
+            DELETE FROM histories WHERE NOT archived;
+        """)
+        self._connection.commit()
+        self._commit_every = commit_every
+        self._pending = 0
+        self._history_ids = {}
+        self._histories = {}
+        self._note_ids = {}
+        self._lock = threading.RLock()
+        self._readers = [] if path != ":memory:" else None
+        self._local = threading.local()
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start following some beds, indexing the notes of the patients already admitted.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                self.patient_admitted(bed, bed.clinical_history)
+
+    def add_history(self, clinical_history, archived: bool = True) -> int:
+        """ Index the notes of a clinical history, for example an archived one.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        :param archived: Whether the history is of a past stay.
+        :type archived: bool
+        :returns: The id of the history in the index.
+        :rtype: int
+        """
+        with self._lock:
+            patient = clinical_history.patient
+            history_id = self._connection.execute(
+                "INSERT INTO histories (patient_id, name, service, admission_date, discharge_date, archived) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (patient.id, patient.name, clinical_history.service, _format_date(clinical_history.admission_date),
+                 _format_date(clinical_history.discharge_date), int(archived))).lastrowid
+            if archived:
+                self._connection.executemany(
+                    "INSERT INTO notes (text, state, kind, history_id) VALUES (?, 'archived', ?, ?)",
+                    ((text, kind, history_id) for attribute, kind in self.KINDS.items()
+                     for text in getattr(clinical_history, attribute)))
+            else:
+                self._note_ids[history_id] = [self._insert_admitted_note(text, kind, history_id)
+                                              for attribute, kind in self.KINDS.items()
+                                              for text in getattr(clinical_history, attribute)]
+            self._count_writes(1)
+            return history_id
+
+    def add_histories(self, histories, archived: bool = True):
+        """ Index the notes of many clinical histories, see add_history.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        :param archived: Whether the histories are of past stays.
+        :type archived: bool
+        """
+        with self._lock:
+            for clinical_history in histories:
+                self.add_history(clinical_history, archived)
+            self.flush()
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that indexes the notes already written and follows the history. """
+        with self._lock:
+            history_id = self.add_history(clinical_history, archived=False)
+            self._history_ids[clinical_history] = history_id
+            self._histories[history_id] = clinical_history
+            clinical_history.add_listener(self)
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that keeps the notes of the history as an archived stay. """
+        with self._lock:
+            clinical_history.remove_listener(self)
+            history_id = self._history_ids.pop(clinical_history, None)
+            if history_id is not None:
+                del self._histories[history_id]
+                self._connection.execute("UPDATE histories SET archived = 1, discharge_date = ? WHERE id = ?",
+                                         (_format_date(clinical_history.discharge_date), history_id))
+                note_ids = self._note_ids.pop(history_id)
+                self._connection.executemany("UPDATE notes SET state = 'archived' WHERE rowid = ?",
+                                             ((note_id,) for note_id in note_ids))
+                self._count_writes(1 + len(note_ids))
+
+    def history_updated(self, clinical_history, attribute, value):
+        """ Clinical history listener hook that indexes every new note or exam result. """
+        kind = self.KINDS.get(attribute)
+        if kind is not None:
+            with self._lock:
+                history_id = self._history_ids.get(clinical_history)
+                if history_id is not None:
+                    self._note_ids[history_id].append(self._insert_admitted_note(value, kind, history_id))
+                    self._count_writes(1)
+
+    def _insert_admitted_note(self, text: str, kind: str, history_id: int) -> int:
+        """ Index a note of an admitted patient. The caller holds the lock.
+
+        :param text: The note.
+        :type text: str
+        :param kind: The kind of note.
+        :type kind: str
+        :param history_id: The id of the history in the index.
+        :type history_id: int
+        :returns: The id of the note, to archive it on release.
+        :rtype: int
+        """
+        return self._connection.execute(
+            "INSERT INTO notes (text, state, kind, history_id) VALUES (?, 'admitted', ?, ?)",
+            (text, kind, history_id)).lastrowid
+
+    def search(self, query: str, limit: int = 20, service: str = None, include_archived: bool = True,
+               kind: str = None, by_relevance: bool = True) -> list:
+        """ Find the clinical histories whose notes match a query, best matches first.
+
+        Words must all appear in the same note, in any order; text between double quotes
+        must appear as a phrase. For example ``'sepsis "blood culture"'``. Case and accents
+        are ignored. Histories are ranked by the BM25 score of their best matching note, which
+        FTS5 computes for every matching note; for frequent words, sorting by the latest note
+        instead reads only the notes needed to fill the results.
+
+        :param query: The words and phrases to find.
+        :type query: str
+        :param limit: The largest number of histories returned.
+        :type limit: int
+        :param service: Keep only the histories of this medical service.
+        :type service: str
+        :param include_archived: Whether to include the histories of past stays.
+        :type include_archived: bool
+        :param kind: Search only the evolution notes with "note" or the exam results with "exam".
+        :type kind: str
+        :param by_relevance: Whether to sort by BM25 score, or else by the latest matching note first.
+        :type by_relevance: bool
+        :returns: The matches, as dictionaries with the history id, patient id, name, service,
+            admission and discharge dates, whether it is archived, the score, a snippet of the
+            best note with the matched words in brackets, and the live clinical history of
+            admitted patients (None for archived ones).
+        :rtype: list[dict]
+        """
+        match = _match_expression(query)
+        if not match:
+            return []
+        if not include_archived:
+            match = f"text : ({match}) AND state : admitted"
+        else:
+            match = f"text : ({match})"
+        sql, parameters = "SELECT rowid, history_id, rank FROM notes WHERE notes MATCH ?", [match]
+        if kind is not None:
+            sql += " AND kind = ?"
+            parameters.append(kind)
+        sql += " ORDER BY rank" if by_relevance else " ORDER BY rowid DESC"
+        if self._readers is None:
+            with self._lock:
+                matches = self._find(self._connection, match, sql, parameters, limit, service, include_archived)
+        else:
+            matches = self._find(self._reader(), match, sql, parameters, limit, service, include_archived)
+        with self._lock:
+            for found in matches:
+                found["history"] = self._histories.get(found["history_id"])
+        return matches
+
+    @staticmethod
+    def _find(connection, match: str, sql: str, parameters: list, limit: int, service: str,
+              include_archived: bool) -> list:
+        """ Run a search query, see search.
+
+        :param connection: The connection reading the index.
+        :type connection: sqlite3.Connection
+        :param match: The FTS5 expression.
+        :type match: str
+        :param sql: The query of the matching notes, best first.
+        :type sql: str
+        :param parameters: The parameters of the query.
+        :type parameters: list
+        :param limit: The largest number of histories returned.
+        :type limit: int
+        :param service: Keep only the histories of this medical service.
+        :type service: str
+        :param include_archived: Whether to include the histories of past stays.
+        :type include_archived: bool
+        :returns: The matches, without their live clinical history.
+        :rtype: list[dict]
+        """
+        if service is None:
+            accepted = None
+        else:
+            accepted = {history_id for history_id, in connection.execute(
+                "SELECT id FROM histories WHERE service = ?" + ("" if include_archived else " AND NOT archived"),
+                (service,))}
+        best_notes = {}
+        for note_id, history_id, rank in connection.execute(sql, parameters):
+            if history_id not in best_notes and (accepted is None or history_id in accepted):
+                best_notes[history_id] = (note_id, -rank)
+                if len(best_notes) == limit:
+                    break
+        matches = []
+        for history_id, (note_id, score) in best_notes.items():
+            patient_id, name, history_service, admission_date, discharge_date, archived = connection.execute(
+                "SELECT patient_id, name, service, admission_date, discharge_date, archived FROM histories "
+                "WHERE id = ?", (history_id,)).fetchone()
+            snippet = connection.execute(
+                "SELECT snippet(notes, 0, '[', ']', '...', 12) FROM notes WHERE notes MATCH ? AND rowid = ?",
+                (match, note_id)).fetchone()[0]
+            matches.append({"history_id": history_id, "patient_id": patient_id, "name": name,
+                            "service": history_service, "admission_date": admission_date,
+                            "discharge_date": discharge_date, "archived": bool(archived), "score": score,
+                            "snippet": snippet})
+        return matches
+
+    def _reader(self):
+        """ Get the read connection of the calling thread, opening it on first use.
+
+        :returns: The connection.
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self._path, check_same_thread=False)
+            with self._lock:
+                self._readers.append(connection)
+        return connection
+
+    def _count_writes(self, n_writes: int):
+        """ Count indexed changes, committing every commit_every of them. The caller holds the lock. """
+        self._pending += n_writes
+        if self._pending >= self._commit_every:
+            self.flush()
+
+    def flush(self):
+        """ Commit the indexed changes. """
+        with self._lock:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        """ Commit the indexed changes and close the index and its read connections. """
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+            for connection in self._readers or ():
+                connection.close()
+
+    def __len__(self):
+        """ Returns the number of indexed notes and exam results.
+
+        :returns: The number of notes.
+        :rtype: int
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+
+def _match_expression(query: str) -> str:
+    """ Turn a search query into an FTS5 expression of quoted phrases, so no word is read as an operator.
+
+    :param query: The words and the phrases between double quotes.
+    :type query: str
+    :returns: The FTS5 expression, empty if the query has no words.
+    :rtype: str
+    """
+    phrases = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        words = re.findall(r"\w+", phrase or word)
+        if words:
+            phrases.append('"' + " ".join(words) + '"')
+    return " ".join(phrases)
+
+
+def _format_date(date) -> str:
+    """ Format a date as ISO text, None if it is unset. """
+    return date.isoformat(sep=" ") if date is not None else None
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    beds = [Bed(n) for n in range(1, 4)]
+    index = NoteIndex(beds=beds)
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    for bed, (name, notes) in zip(beds, [("Andres", ["Fever, suspected sepsis", "Blood culture positive"]),
+                                         ("Ana", ["Septic shock ruled out", "Sepsis protocol started"]),
+                                         ("Juan", ["Stable, no fever"])]):
+        patient = Patient(name[:2], name, "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+        bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                          "Cardiology")
+        for note in notes:
+            bed.clinical_history.add_evolution_note(note)
+    beds[1].release_patient()
+
+    for query in ("sepsis", '"blood culture"', "fever"):
+        print(query, "->", [(match["name"], match["archived"], match["snippet"]) for match in index.search(query)])
+    print("Admitted patients with sepsis: ", [match["name"] for match in index.search("sepsis", include_archived=False)])
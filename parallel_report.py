@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from report import Report, ReportAccumulator
+from storage import SQLiteRepository
+
+
+class ParallelReport:
+    """
+    Class used to compute the Report statistics on several processes at once.
+
+    The histories are split in shards, every worker process fills a ReportAccumulator
+    with one shard, and the partial accumulators are merged in shard order, so the results
+    are exactly those of Report.compute_all. A list of histories in memory is inherited by
+    forked workers, which only receive the index ranges of their shards; other iterables,
+    or platforms without fork, send the histories to the workers as plain rows. Shards can
+    also be loaded by the workers themselves, for example from an SQLite repository with
+    repository_shards, so nothing has to be sent at all.
+    """
+
+    def __init__(self, workers: int = None, chunk_size: int = 50000):
+        """ ParallelReport constructor object.
+
+        :param workers: The number of worker processes, the number of CPUs if None.
+        :type workers: int
+        :param chunk_size: The number of histories in memory sent to a worker at once.
+        :type chunk_size: int
+        """
+        self._workers = workers or os.cpu_count() or 1
+        self._chunk_size = chunk_size
+
+    def compute(self, histories, metrics=None, total_beds: int = None, top: int = None) -> dict:
+        """ Compute several statistics of clinical histories in memory, as Report.compute_all.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        :param metrics: The names of the statistic methods to compute, all of them if None.
+        :type metrics: list[str]
+        :param total_beds: The total number of beds in the hospital, needed for the occupancy rate.
+        :type total_beds: int
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each requested statistic method name to its result.
+        :rtype: dict[str, object]
+        :raises ValueError: If a metric is unknown or the occupancy rate is requested without total_beds.
+        """
+        global _shared_histories
+        if isinstance(histories, Sequence) and "fork" in multiprocessing.get_all_start_methods():
+            _shared_histories = histories
+            try:
+                ranges = [(start, min(start + self._chunk_size, len(histories)))
+                          for start in range(0, len(histories), self._chunk_size)]
+                return self._merge(_accumulate_range, ranges, metrics, total_beds, top,
+                                   multiprocessing.get_context("fork"))
+            finally:
+                _shared_histories = None
+        rows = map(ReportAccumulator.row, histories)
+        chunks = iter(lambda: list(islice(rows, self._chunk_size)), [])
+        return self._merge(_accumulate_rows, chunks, metrics, total_beds, top)
+
+    def compute_shards(self, shards, metrics=None, total_beds: int = None, top: int = None) -> dict:
+        """ Compute several statistics of clinical histories loaded by the worker processes.
+
+        :param shards: Functions without arguments returning the clinical histories of a shard.
+            They are sent to the workers, so they must be picklable: module functions or
+            functools.partial objects of them, such as the ones made by repository_shards.
+        :type shards: list[callable]
+        :param metrics: The names of the statistic methods to compute, all of them if None.
+        :type metrics: list[str]
+        :param total_beds: The total number of beds in the hospital, needed for the occupancy rate.
+        :type total_beds: int
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each requested statistic method name to its result.
+        :rtype: dict[str, object]
+        :raises ValueError: If a metric is unknown or the occupancy rate is requested without total_beds.
+        """
+        return self._merge(_accumulate_shard, shards, metrics, total_beds, top)
+
+    def _merge(self, accumulate, items, metrics, total_beds: int, top: int, context=None) -> dict:
+        """ Accumulate every item on the workers and merge the partial accumulators in item order.
+
+        At most two items per worker are in flight, so the items are produced as the workers
+        need them instead of all at once.
+
+        :param accumulate: The worker function, receiving the metrics and one item.
+        :type accumulate: callable
+        :param items: The items given to the workers.
+        :type items: iterable
+        :param context: The multiprocessing context starting the workers, the default one if None.
+        :type context: multiprocessing.context.BaseContext
+        :returns: The merged statistics.
+        :rtype: dict[str, object]
+        """
+        if metrics is None:
+            metrics = Report.METRICS if total_beds is not None else Report.METRICS[:-1]
+        if "occupancy_rate" in metrics and total_beds is None:
+            raise ValueError("total_beds is required to compute the occupancy rate")
+        merged = ReportAccumulator(metrics)
+        metrics = tuple(metrics)
+
+        with ProcessPoolExecutor(self._workers, context) as executor:
+            pending = deque()
+            for item in items:
+                pending.append(executor.submit(accumulate, metrics, item))
+                if len(pending) >= 2 * self._workers:
+                    merged.merge(pending.popleft().result())
+            while pending:
+                merged.merge(pending.popleft().result())
+        return merged.result(total_beds, top)
+
+
+def repository_shards(path: str, n_shards: int) -> list:
+    """ Split the histories stored in an SQLite repository in shards of consecutive ids.
+
+    :param path: The path of the SQLite database.
+    :type path: str
+    :param n_shards: The number of shards.
+    :type n_shards: int
+    :returns: The shards, for ParallelReport.compute_shards.
+    :rtype: list[callable]
+    """
+    repository = SQLiteRepository(path, readers=1)
+    try:
+        first_id, last_id = repository.history_id_range()
+    finally:
+        repository.close()
+    if first_id is None:
+        return []
+    size = -(-(last_id - first_id + 1) // n_shards)
+    return [partial(_load_repository_shard, path, start, min(start + size - 1, last_id))
+            for start in range(first_id, last_id + 1, size)]
+
+
+def _load_repository_shard(path: str, first_id: int, last_id: int):
+    """ Stream the histories of a repository shard.
+
+    :returns: The clinical histories with ids from first_id to last_id.
+    :rtype: iterator[ClinicalHistory]
+    """
+    repository = SQLiteRepository(path, readers=1)
+    try:
+        for _, history in repository.iter_histories(first_id=first_id, last_id=last_id):
+            yield history
+    finally:
+        repository.close()
+
+
+""" Histories of the running ParallelReport.compute, inherited by its forked workers """
+_shared_histories = None
+
+
+def _accumulate_range(metrics: tuple, bounds: tuple):
+    """ Worker function accumulating a range of the histories inherited from the parent process. """
+    accumulator = ReportAccumulator(metrics)
+    accumulator.update(_shared_histories[bounds[0]:bounds[1]])
+    return accumulator
+
+
+def _accumulate_rows(metrics: tuple, rows: list):
+    """ Worker function accumulating a chunk of rows. """
+    accumulator = ReportAccumulator(metrics)
+    accumulator.update_rows(rows)
+    return accumulator
+
+
+def _accumulate_shard(metrics: tuple, shard):
+    """ Worker function accumulating the histories of a shard. """
+    accumulator = ReportAccumulator(metrics)
+    accumulator.update(shard())
+    return accumulator
+
+
+if __name__ == "__main__":
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime, timedelta
+
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    histories = []
+    for n in range(1000):
+        history = ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), ("Cardiology", "Neurology")[n % 2],
+                                  admission_date, chronic_disease=n % 3 == 0)
+        history.discharge_date = admission_date + timedelta(hours=n)
+        history.add_medicine("Lisinopril")
+        histories.append(history)
+
+    report = ParallelReport(workers=2, chunk_size=100).compute(histories)
+    print(report["avg_stay_per_service"])
+    print("Same as Report.compute_all: ", report == Report.compute_all(histories))
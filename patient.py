@@ -5,6 +5,8 @@ class Patient:
     """
     Class used to represent a Patient information
     """
+    __slots__ = ("_id", "_name", "_gender", "_birth_date")
+
     def __init__(self, patient_id: str = "", name: str = "", gender: str = "",
                  birth_date: datetime = datetime(1900, 1, 1)):
         """ Patient Constructor Object.
@@ -97,13 +99,33 @@ class Patient:
         """
         self._birth_date = birth_date
 
+    def to_dict(self) -> dict:
+        """ Returns the patient as a dictionary of JSON compatible values.
+
+        :returns: The patient fields, with the birth date in ISO format.
+        :rtype: dict
+        """
+        return {"id": self._id, "name": self._name, "gender": self._gender,
+                "birth_date": self._birth_date.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """ Build a patient from a dictionary made by to_dict.
+
+        :param data: The patient fields.
+        :type data: dict
+        :returns: A patient object.
+        :rtype: Patient
+        """
+        return cls(data["id"], data["name"], data["gender"], datetime.fromisoformat(data["birth_date"]))
+
     def __str__(self):
         """ Returns str of patient
         :returns: string patient
         :rtype: str
         """
         return (f"ID: {self._id}\nName: {self._name}\nGender: {self._gender}\n"
-                f"Birth Date: {self._birth_date.strftime('%Y-%m-%d')}")
+                f"Birth Date: {self._birth_date.isoformat()[:10]}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,232 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+
+class PatientRegistry:
+    """
+    Class used to find patients by id or name without walking the beds.
+
+    The registry listens to the beds, so it learns every admitted patient and keeps, for
+    each patient id, the current bed and every clinical history seen. Names are indexed
+    by prefix, in a sorted list, and by trigrams, for searches anywhere in the name. Updates
+    and searches hold a lock, so the registry can be shared between threads.
+    """
+
+    def __init__(self, beds=()):
+        """ PatientRegistry constructor object.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        self._patients = {}
+        self._current_beds = {}
+        self._histories = {}
+        self._indexed_names = {}
+        self._sorted_names = []
+        self._trigrams = {}
+        self._lock = threading.RLock()
+        self.attach(beds)
+
+    def attach(self, beds):
+        """ Start following some beds, registering the patients already admitted.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        for bed in beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                self.patient_admitted(bed, bed.clinical_history)
+
+    def register(self, patient):
+        """ Add or update a patient in the id and name indexes.
+
+        Call it again after changing the name of a registered patient.
+
+        :param patient: The patient to register.
+        :type patient: Patient
+        """
+        with self._lock:
+            patient_id = patient.id
+            self._patients[patient_id] = patient
+            name = _normalize(patient.name)
+            old_name = self._indexed_names.get(patient_id)
+            if old_name == name:
+                return
+            if old_name is not None:
+                self._unindex_name(patient_id, old_name)
+            self._indexed_names[patient_id] = name
+            insort(self._sorted_names, (name, patient_id))
+            for trigram in _trigrams(name):
+                self._trigrams.setdefault(trigram, set()).add(patient_id)
+
+    def _unindex_name(self, patient_id: str, name: str):
+        """ Remove a patient from the name indexes.
+
+        :param patient_id: The id of the patient.
+        :type patient_id: str
+        :param name: The normalized name the patient was indexed with.
+        :type name: str
+        """
+        position = bisect_left(self._sorted_names, (name, patient_id))
+        del self._sorted_names[position]
+        for trigram in _trigrams(name):
+            patient_ids = self._trigrams[trigram]
+            patient_ids.discard(patient_id)
+            if not patient_ids:
+                del self._trigrams[trigram]
+
+    def get(self, patient_id: str):
+        """ Get a registered patient by id.
+
+        :param patient_id: The id of the patient.
+        :type patient_id: str
+        :returns: The patient, None if the id is not registered.
+        :rtype: Patient
+        """
+        return self._patients.get(patient_id)
+
+    def current_bed(self, patient_id: str):
+        """ Get the bed where a patient is admitted.
+
+        :param patient_id: The id of the patient.
+        :type patient_id: str
+        :returns: The bed, None if the patient is not admitted.
+        :rtype: Bed
+        """
+        return self._current_beds.get(patient_id)
+
+    def histories(self, patient_id: str) -> list:
+        """ Get the clinical histories of every stay of a patient, oldest first.
+
+        :param patient_id: The id of the patient.
+        :type patient_id: str
+        :returns: The clinical histories, including the current one.
+        :rtype: list[ClinicalHistory]
+        """
+        with self._lock:
+            return list(self._histories.get(patient_id, ()))
+
+    def find_by_name_prefix(self, prefix: str, limit: int = 20) -> list:
+        """ Find the patients whose name starts with a prefix, ignoring case and accents.
+
+        :param prefix: The start of the name.
+        :type prefix: str
+        :param limit: The largest number of patients returned.
+        :type limit: int
+        :returns: The matching patients in name order.
+        :rtype: list[Patient]
+        """
+        with self._lock:
+            prefix = _normalize(prefix)
+            found = []
+            position = bisect_left(self._sorted_names, (prefix,))
+            while position < len(self._sorted_names) and len(found) < limit:
+                name, patient_id = self._sorted_names[position]
+                if not name.startswith(prefix):
+                    break
+                found.append(self._patients[patient_id])
+                position += 1
+            return found
+
+    def search_name(self, text: str, limit: int = 20) -> list:
+        """ Find the patients whose name contains a text, ignoring case and accents.
+
+        Texts of three characters or more are looked up in the trigram index, shorter ones
+        fall back to the prefix index.
+
+        :param text: The text to find in the names.
+        :type text: str
+        :param limit: The largest number of patients returned.
+        :type limit: int
+        :returns: The matching patients in name order.
+        :rtype: list[Patient]
+        """
+        with self._lock:
+            text = _normalize(text)
+            trigrams = _trigrams(text)
+            if not trigrams:
+                return self.find_by_name_prefix(text, limit)
+            candidates = sorted((self._trigrams.get(trigram, set()) for trigram in trigrams), key=len)
+            patient_ids = set(candidates[0]).intersection(*candidates[1:])
+            matches = sorted((self._indexed_names[patient_id], patient_id) for patient_id in patient_ids
+                             if text in self._indexed_names[patient_id])
+            return [self._patients[patient_id] for _, patient_id in matches[:limit]]
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that registers the patient and its new stay. """
+        with self._lock:
+            patient = clinical_history.patient
+            self.register(patient)
+            self._current_beds[patient.id] = bed
+            self._histories.setdefault(patient.id, []).append(clinical_history)
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that keeps the stay as a past one. """
+        with self._lock:
+            patient_id = clinical_history.patient.id
+            if self._current_beds.get(patient_id) is bed:
+                del self._current_beds[patient_id]
+
+    def __len__(self):
+        """ Returns the number of registered patients.
+
+        :returns: The number of patients.
+        :rtype: int
+        """
+        return len(self._patients)
+
+    def __contains__(self, patient_id):
+        """ Check if a patient id is registered.
+
+        :returns: True if the patient is registered, False otherwise.
+        :rtype: bool
+        """
+        return patient_id in self._patients
+
+
+def _normalize(name: str) -> str:
+    """ Normalize a name for searching, removing case, accents and repeated spaces.
+
+    :param name: The name.
+    :type name: str
+    :returns: The normalized name.
+    :rtype: str
+    """
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def _trigrams(text: str) -> set:
+    """ Get the set of three character substrings of a text.
+
+    :param text: The text.
+    :type text: str
+    :returns: The trigrams.
+    :rtype: set[str]
+    """
+    return {text[position:position + 3] for position in range(len(text) - 2)}
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    beds = [Bed(n) for n in range(1, 4)]
+    registry = PatientRegistry(beds)
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    for bed, (patient_id, name) in zip(beds, [("1234", "Andrés Hernández"), ("5678", "Ana María"),
+                                              ("9012", "Juan Pérez")]):
+        patient = Patient(patient_id, name, "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+        bed.admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                          "Cardiology")
+    beds[0].release_patient()
+
+    print("Prefix 'an': ", [patient.name for patient in registry.find_by_name_prefix("an")])
+    print("Contains 'perez': ", [patient.name for patient in registry.search_name("perez")])
+    print("Bed of 5678: ", registry.current_bed("5678"))
+    print("Bed of 1234: ", registry.current_bed("1234"), "- Stays: ", len(registry.histories("1234")))
@@ -1,4 +1,6 @@
+from collections import Counter
 from datetime import timedelta
+from operator import attrgetter
 
 
 class Report:
@@ -24,8 +26,8 @@ class Report:
     def avg_stay_per_service(histories) -> dict:
         """ Calculate the average length of stay for patients in each medical service.
 
-        :param histories: A list of clinical histories.
-        :type histories: list
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
         :returns: A dictionary mapping medical services to their average length of stay.
         :rtype: dict[str, str]
         """
@@ -53,8 +55,8 @@ class Report:
     def admissions_and_discharges_per_service(histories) -> tuple:
         """ Count the number of admissions and discharges per medical service.
 
-        :param histories: A list of clinical histories.
-        :type histories: list
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
         :returns: Two dictionaries - one for admissions and one for discharges - mapping medical services to counts.
         :rtype: tuple[dict[str, int], dict[str, int]]
         """
@@ -75,8 +77,8 @@ class Report:
     def patients_with_chronic_diseases(histories) -> set:
         """ Identify patients with chronic diseases.
 
-        :param histories: A list of clinical histories.
-        :type histories: list
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
         :returns: A set containing the names of patients with chronic diseases.
         :rtype: set
         """
@@ -87,23 +89,270 @@ class Report:
         return chronic_patients
 
     @staticmethod
-    def meds_per_service(histories) -> dict:
-        """ Count the number of medicines prescribed per medical service.
+    def meds_per_service(histories, top: int = None) -> dict:
+        """ Count the prescriptions of each medicine per medical service.
 
-        :param histories: A list of clinical histories.
-        :type histories: list
-        :returns: A dictionary mapping medical services to lists of prescribed medicines.
-        :rtype: dict[str, list]
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping medical services to the prescription count of each medicine, most prescribed first.
+        :rtype: dict[str, dict[str, int]]
         """
         medicines_per_service = {}
         for clinical_history in histories:
             service = clinical_history.service
-            medicines = clinical_history.medicines
             if service:
                 if service not in medicines_per_service:
-                    medicines_per_service[service] = []
-                medicines_per_service[service].extend(medicines)
-        return medicines_per_service
+                    medicines_per_service[service] = Counter()
+                medicines_per_service[service].update(clinical_history.medicines)
+        return {service: dict(counts.most_common(top)) for service, counts in medicines_per_service.items()}
+
+    METRICS = ("admissions_and_discharges_per_service", "avg_stay_per_service", "patients_with_chronic_diseases",
+               "meds_per_service", "occupancy_rate")
+
+    @staticmethod
+    def compute_all(histories, metrics=None, total_beds: int = None, top: int = None) -> dict:
+        """ Compute several statistics in a single pass over the clinical histories.
+
+        The results are the same as calling each statistic method separately, but every
+        history is read only once, so histories can be streamed from a generator. The
+        occupancy rate counts every history as an occupied bed.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        :param metrics: The names of the statistic methods to compute, all of them if None.
+        :type metrics: list[str]
+        :param total_beds: The total number of beds in the hospital, needed for the occupancy rate.
+        :type total_beds: int
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each requested statistic method name to its result.
+        :rtype: dict[str, object]
+        :raises ValueError: If a metric is unknown or the occupancy rate is requested without total_beds.
+        """
+        if metrics is None:
+            metrics = Report.METRICS if total_beds is not None else Report.METRICS[:-1]
+        if "occupancy_rate" in metrics and total_beds is None:
+            raise ValueError("total_beds is required to compute the occupancy rate")
+        accumulator = ReportAccumulator(metrics)
+        accumulator.update(histories)
+        return accumulator.result(total_beds, top)
+
+
+""" Getter of the fields read by the statistics, in the order of a ReportAccumulator row """
+_row_fields = attrgetter("service", "admission_date", "discharge_date", "chronic_disease", "patient.name", "medicines")
+
+
+class ReportAccumulator:
+    """
+    Class used to compute the Report statistics incrementally, in memory bounded by the
+    number of services, medicines and chronic patients rather than by the number of histories.
+
+    Histories are added one by one or from any iterable, and the partial results of
+    accumulators fed with different histories, for example one per month or per process,
+    can be merged before reading the final statistics.
+    """
+
+    def __init__(self, metrics=Report.METRICS):
+        """ ReportAccumulator constructor object.
+
+        :param metrics: The names of the Report statistic methods to accumulate.
+        :type metrics: list[str]
+        :raises ValueError: If a metric is unknown.
+        """
+        unknown = set(metrics).difference(Report.METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+        self._metrics = tuple(metric for metric in Report.METRICS if metric in metrics)
+        self._admissions_per_service = {}
+        self._discharges_per_service = {}
+        self._stay_per_service = {}
+        self._n_patients = {}
+        self._chronic_patients = set()
+        self._medicines_per_service = {}
+        self._n_histories = 0
+
+    def add(self, clinical_history):
+        """ Add one clinical history to the statistics.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        """
+        self.update((clinical_history,))
+
+    def update(self, histories):
+        """ Add clinical histories to the statistics.
+
+        The fields are read straight from the histories rather than through rows, see
+        update_rows, which would build a tuple for every history.
+
+        :param histories: The clinical histories, any iterable read once.
+        :type histories: iterable
+        """
+        want_movements = "admissions_and_discharges_per_service" in self._metrics
+        want_stay = "avg_stay_per_service" in self._metrics
+        want_chronic = "patients_with_chronic_diseases" in self._metrics
+        want_meds = "meds_per_service" in self._metrics
+
+        admissions_per_service = self._admissions_per_service
+        discharges_per_service = self._discharges_per_service
+        stay_per_service = self._stay_per_service
+        n_patients = self._n_patients
+        chronic_patients = self._chronic_patients
+        medicines_per_service = self._medicines_per_service
+        n_histories = 0
+
+        for clinical_history in histories:
+            n_histories += 1
+            service = clinical_history.service
+            if want_movements or want_stay:
+                discharge_date = clinical_history.discharge_date
+                if discharge_date is None:
+                    if want_movements:
+                        admissions_per_service[service] = admissions_per_service.get(service, 0) + 1
+                else:
+                    if want_movements:
+                        discharges_per_service[service] = discharges_per_service.get(service, 0) + 1
+                    if want_stay and discharge_date and service:
+                        length_of_stay = discharge_date - clinical_history.admission_date
+                        if service in stay_per_service:
+                            stay_per_service[service] += length_of_stay
+                            n_patients[service] += 1
+                        else:
+                            stay_per_service[service] = length_of_stay
+                            n_patients[service] = 1
+            if want_chronic and clinical_history.chronic_disease:
+                chronic_patients.add(clinical_history.patient.name)
+            if want_meds and service:
+                if service not in medicines_per_service:
+                    medicines_per_service[service] = Counter()
+                medicines_per_service[service].update(clinical_history.medicines)
+        self._n_histories += n_histories
+
+    @staticmethod
+    def row(clinical_history) -> tuple:
+        """ Extract the fields the statistics read from a clinical history.
+
+        Rows are plain tuples, cheap to send to other processes.
+
+        :param clinical_history: The clinical history.
+        :type clinical_history: ClinicalHistory
+        :returns: The service, admission date, discharge date, chronic disease, patient name and medicines.
+        :rtype: tuple[str, datetime, datetime, bool, str, list[str]]
+        """
+        return _row_fields(clinical_history)
+
+    def update_rows(self, rows):
+        """ Add clinical histories, extracted as rows by ReportAccumulator.row, to the statistics.
+
+        Rows are what parallel_report sends from its worker processes; histories at hand go to update.
+
+        :param rows: The rows, any iterable read once.
+        :type rows: iterable[tuple]
+        """
+        want_movements = "admissions_and_discharges_per_service" in self._metrics
+        want_stay = "avg_stay_per_service" in self._metrics
+        want_chronic = "patients_with_chronic_diseases" in self._metrics
+        want_meds = "meds_per_service" in self._metrics
+
+        admissions_per_service = self._admissions_per_service
+        discharges_per_service = self._discharges_per_service
+        stay_per_service = self._stay_per_service
+        n_patients = self._n_patients
+        chronic_patients = self._chronic_patients
+        medicines_per_service = self._medicines_per_service
+        n_histories = 0
+
+        for service, admission_date, discharge_date, chronic_disease, name, medicines in rows:
+            n_histories += 1
+            if discharge_date is None:
+                if want_movements:
+                    admissions_per_service[service] = admissions_per_service.get(service, 0) + 1
+            else:
+                if want_movements:
+                    discharges_per_service[service] = discharges_per_service.get(service, 0) + 1
+                if want_stay and discharge_date and service:
+                    length_of_stay = discharge_date - admission_date
+                    if service in stay_per_service:
+                        stay_per_service[service] += length_of_stay
+                        n_patients[service] += 1
+                    else:
+                        stay_per_service[service] = length_of_stay
+                        n_patients[service] = 1
+            if want_chronic and chronic_disease:
+                chronic_patients.add(name)
+            if want_meds and service:
+                if service not in medicines_per_service:
+                    medicines_per_service[service] = Counter()
+                medicines_per_service[service].update(medicines)
+        self._n_histories += n_histories
+
+    def merge(self, other):
+        """ Add the partial statistics of another accumulator to this one.
+
+        :param other: An accumulator of other clinical histories, with the same metrics.
+        :type other: ReportAccumulator
+        :returns: This accumulator.
+        :rtype: ReportAccumulator
+        :raises ValueError: If the accumulators do not have the same metrics.
+        """
+        if other._metrics != self._metrics:
+            raise ValueError("Only accumulators of the same metrics can be merged")
+        for mine, theirs in ((self._admissions_per_service, other._admissions_per_service),
+                             (self._discharges_per_service, other._discharges_per_service),
+                             (self._n_patients, other._n_patients)):
+            for service, count in theirs.items():
+                mine[service] = mine.get(service, 0) + count
+        for service, stay in other._stay_per_service.items():
+            if service in self._stay_per_service:
+                self._stay_per_service[service] += stay
+            else:
+                self._stay_per_service[service] = stay
+        self._chronic_patients |= other._chronic_patients
+        for service, counts in other._medicines_per_service.items():
+            self._medicines_per_service.setdefault(service, Counter()).update(counts)
+        self._n_histories += other._n_histories
+        return self
+
+    def result(self, total_beds: int = None, top: int = None) -> dict:
+        """ Get the statistics of the histories added so far.
+
+        :param total_beds: The total number of beds in the hospital, needed for the occupancy rate.
+        :type total_beds: int
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each accumulated statistic method name to its result, as Report.compute_all.
+        :rtype: dict[str, object]
+        :raises ValueError: If the occupancy rate is accumulated but total_beds is not given.
+        """
+        if "occupancy_rate" in self._metrics and total_beds is None:
+            raise ValueError("total_beds is required to compute the occupancy rate")
+        results = {}
+        if "admissions_and_discharges_per_service" in self._metrics:
+            results["admissions_and_discharges_per_service"] = (dict(self._admissions_per_service),
+                                                                dict(self._discharges_per_service))
+        if "avg_stay_per_service" in self._metrics:
+            results["avg_stay_per_service"] = {
+                service: str(timedelta(seconds=stay.total_seconds() / self._n_patients[service]))
+                for service, stay in self._stay_per_service.items()}
+        if "patients_with_chronic_diseases" in self._metrics:
+            results["patients_with_chronic_diseases"] = set(self._chronic_patients)
+        if "meds_per_service" in self._metrics:
+            results["meds_per_service"] = {service: dict(counts.most_common(top))
+                                           for service, counts in self._medicines_per_service.items()}
+        if "occupancy_rate" in self._metrics:
+            results["occupancy_rate"] = Report.occupancy_rate(total_beds, self._n_histories)
+        return results
+
+    @property
+    def n_histories(self) -> int:
+        """ Get the number of histories added so far.
+
+        :returns: The number of histories.
+        :rtype: int
+        """
+        return self._n_histories
 
 
 if __name__ == '__main__':
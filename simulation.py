@@ -0,0 +1,499 @@
+import heapq
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bed_pool import BedPool, NoBedAvailableError
+from clinical_history import ClinicalHistory
+from patient import Patient
+from report import Report
+from vital_signs import VitalSigns
+
+""" Medical services the synthetic patients are admitted to, with their relative demand and mean stay in hours """
+SERVICES = {"Internal Medicine": (8, 120), "General Surgery": (6, 96), "Pediatrics": (4, 72), "Cardiology": (5, 144),
+            "Neurology": (3, 168), "Psychiatry": (2, 240), "Radiology": (1, 24), "Rehabilitation": (2, 288)}
+
+
+class SyntheticWorkload:
+    """
+    Class used to generate reproducible synthetic patients, vital signs, notes and prescriptions.
+
+    Everything comes from one seeded random generator, so two workloads with the same seed
+    produce the same data in the same order.
+    """
+
+    """ Words the synthetic names, notes and exam results are made of """
+    FIRST_NAMES = ("Ana", "Andres", "Camila", "Carlos", "Daniela", "David", "Isabel", "Juan", "Laura", "Luis",
+                   "Maria", "Mateo", "Paula", "Santiago", "Sofia", "Valentina")
+    LAST_NAMES = ("Garcia", "Gomez", "Lopez", "Martinez", "Ramirez", "Rodriguez", "Torres", "Vargas")
+    FINDINGS = ("fever", "stable", "pain", "nausea", "dyspnea", "tachycardia", "hypertension", "improving",
+                "sepsis", "edema", "cough", "headache", "confusion", "wound healing", "no complications")
+    PLANS = ("continue treatment", "adjust dose", "request blood culture", "start antibiotics", "monitor vitals",
+             "physical therapy", "discharge planning", "consult cardiology", "repeat imaging")
+    EXAMS = ("Hemoglobin {:.1f} g/dL", "Glucose {:.0f} mg/dL", "Creatinine {:.2f} mg/dL", "Leukocytes {:.1f} x10^3/uL")
+    MEDICINES = ("Paracetamol 500mg", "Ibuprofen 400mg", "Amoxicillin 500mg", "Omeprazole 20mg", "Lisinopril 10mg",
+                 "Insulin", "Enoxaparin 40mg", "Metformin 850mg", "Furosemide 40mg", "Ceftriaxone 1g")
+
+    def __init__(self, seed: int = 0, services: dict = None, chronic_rate: float = 0.2):
+        """ SyntheticWorkload constructor object.
+
+        :param seed: The seed of the random generator.
+        :type seed: int
+        :param services: Mapping of medical service to its relative demand and mean stay in hours.
+        :type services: dict[str, tuple[float, float]]
+        :param chronic_rate: The fraction of patients with a chronic disease.
+        :type chronic_rate: float
+        """
+        self._random = random.Random(seed)
+        self._services = dict(services or SERVICES)
+        self._service_names = list(self._services)
+        self._service_weights = [weight for weight, _ in self._services.values()]
+        self._chronic_rate = chronic_rate
+        self._patients = 0
+
+    @property
+    def services(self) -> dict:
+        """ Get the medical services generated.
+
+        :returns: Mapping of medical service to its relative demand and mean stay in hours.
+        :rtype: dict[str, tuple[float, float]]
+        """
+        return self._services
+
+    def service(self) -> str:
+        """ Draw the medical service of an admission, following the demand of each service.
+
+        :returns: The medical service.
+        :rtype: str
+        """
+        return self._random.choices(self._service_names, self._service_weights)[0]
+
+    def stay(self, service: str) -> timedelta:
+        """ Draw the length of stay of an admission, exponential around the mean stay of its service.
+
+        :param service: The medical service.
+        :type service: str
+        :returns: The length of stay.
+        :rtype: timedelta
+        """
+        return timedelta(hours=self._random.expovariate(1 / self._services[service][1]))
+
+    def patient(self, now: datetime) -> Patient:
+        """ Generate a new patient with a unique id.
+
+        :param now: The current date, to draw an adult or child birth date before it.
+        :type now: datetime
+        :returns: The patient.
+        :rtype: Patient
+        """
+        rng = self._random
+        self._patients += 1
+        return Patient(f"P{self._patients:08d}", f"{rng.choice(self.FIRST_NAMES)} {rng.choice(self.LAST_NAMES)}",
+                       rng.choice("MF"), now - timedelta(days=rng.randrange(365, 365 * 95)))
+
+    def vital_signs(self) -> VitalSigns:
+        """ Generate vital signs around normal values.
+
+        :returns: The vital signs.
+        :rtype: VitalSigns
+        """
+        rng = self._random
+        return VitalSigns(round(rng.gauss(120, 15)), round(rng.gauss(37, 0.6), 1), round(min(100.0, rng.gauss(96, 2))),
+                          round(rng.gauss(16, 3)))
+
+    def note(self) -> str:
+        """ Generate an evolution note.
+
+        :returns: The note.
+        :rtype: str
+        """
+        rng = self._random
+        findings = rng.sample(self.FINDINGS, rng.randrange(1, 4))
+        return f"Patient {', '.join(findings)}. Plan: {rng.choice(self.PLANS)}."
+
+    def exam_result(self) -> str:
+        """ Generate an exam result.
+
+        :returns: The exam result.
+        :rtype: str
+        """
+        rng = self._random
+        return rng.choice(self.EXAMS).format(rng.uniform(0.5, 200))
+
+    def medicine(self) -> str:
+        """ Generate a prescription.
+
+        :returns: The medicine prescribed.
+        :rtype: str
+        """
+        return self._random.choice(self.MEDICINES)
+
+    def clinical_history(self, service: str, admission_date: datetime) -> ClinicalHistory:
+        """ Generate the clinical history of a new admission.
+
+        :param service: The medical service of the admission.
+        :type service: str
+        :param admission_date: The admission date.
+        :type admission_date: datetime
+        :returns: The clinical history.
+        :rtype: ClinicalHistory
+        """
+        return ClinicalHistory(self.patient(admission_date), self.vital_signs(), service, admission_date,
+                               chronic_disease=self._random.random() < self._chronic_rate)
+
+    def annotation(self):
+        """ Draw a change of a clinical history: a note, an exam result, a prescription or a vital signs reading.
+
+        :returns: A function applying the change to a clinical history at a date.
+        :rtype: callable
+        """
+        kind = self._random.choices(("note", "exam", "medicine", "vital_signs"), (4, 2, 2, 2))[0]
+        if kind == "note":
+            note = self.note()
+            return lambda history, now: history.add_evolution_note(note)
+        if kind == "exam":
+            result = self.exam_result()
+            return lambda history, now: history.add_exam_results(result)
+        if kind == "medicine":
+            medicine = self.medicine()
+            return lambda history, now: history.add_medicine(medicine)
+        vital_signs = self.vital_signs()
+        return lambda history, now: history.add_vital_signs_reading(vital_signs, now)
+
+    @property
+    def random(self) -> random.Random:
+        """ Get the random generator, to draw the event times from the same seed.
+
+        :returns: The random generator.
+        :rtype: random.Random
+        """
+        return self._random
+
+
+class OperationStats:
+    """
+    Class used to record the latency and the memory of one kind of simulated operation.
+    """
+
+    def __init__(self, name: str):
+        """ OperationStats constructor object.
+
+        :param name: The name of the operation.
+        :type name: str
+        """
+        self._name = name
+        self._latencies = []
+        self._memory = 0
+        self._failures = 0
+
+    def add(self, latency: float, memory: int = 0, failed: bool = False):
+        """ Record one run of the operation.
+
+        :param latency: The wall time of the run in seconds.
+        :type latency: float
+        :param memory: The bytes the run left allocated, negative if it freed more, when memory is traced.
+        :type memory: int
+        :param failed: Whether the run failed, as an admission without a free bed.
+        :type failed: bool
+        """
+        self._latencies.append(latency)
+        self._memory += memory
+        self._failures += failed
+
+    @property
+    def name(self) -> str:
+        """ Get the name of the operation.
+
+        :returns: The name.
+        :rtype: str
+        """
+        return self._name
+
+    @property
+    def count(self) -> int:
+        """ Get the number of runs.
+
+        :returns: The number of runs.
+        :rtype: int
+        """
+        return len(self._latencies)
+
+    @property
+    def failures(self) -> int:
+        """ Get the number of failed runs.
+
+        :returns: The number of failed runs.
+        :rtype: int
+        """
+        return self._failures
+
+    @property
+    def total_time(self) -> float:
+        """ Get the wall time of every run.
+
+        :returns: The time in seconds.
+        :rtype: float
+        """
+        return sum(self._latencies)
+
+    @property
+    def throughput(self) -> float:
+        """ Get the runs per second of operation time.
+
+        :returns: The runs per second, 0 if nothing ran.
+        :rtype: float
+        """
+        total_time = self.total_time
+        return self.count / total_time if total_time else 0.0
+
+    @property
+    def memory_per_operation(self) -> float:
+        """ Get the mean bytes left allocated by a run, when memory is traced.
+
+        :returns: The bytes per run.
+        :rtype: float
+        """
+        return self._memory / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """ Get a percentile of the latency.
+
+        :param fraction: The percentile, between 0 and 1.
+        :type fraction: float
+        :returns: The latency in seconds, 0 if nothing ran.
+        :rtype: float
+        """
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def summary(self) -> dict:
+        """ Get the statistics of the operation.
+
+        :returns: The count, failures, throughput, mean, median, p99 and max latency in microseconds,
+            and the bytes left allocated per run.
+        :rtype: dict[str, float]
+        """
+        latencies = self._latencies
+        return {"count": self.count, "failures": self._failures, "throughput": self.throughput,
+                "mean_us": statistics.fmean(latencies) * 1e6 if latencies else 0.0,
+                "p50_us": self.percentile(0.5) * 1e6, "p99_us": self.percentile(0.99) * 1e6,
+                "max_us": max(latencies, default=0.0) * 1e6, "bytes_per_operation": self.memory_per_operation}
+
+    def __str__(self):
+        """ Returns str of operation statistics """
+        summary = self.summary()
+        text = (f"{self._name}: {summary['count']} runs - {summary['throughput']:.0f} ops/s - "
+                f"p50 {summary['p50_us']:.1f} us - p99 {summary['p99_us']:.1f} us - max {summary['max_us']:.1f} us")
+        if self._failures:
+            text += f" - {self._failures} failed"
+        if self._memory:
+            text += f" - {summary['bytes_per_operation']:.0f} bytes/op"
+        return text
+
+
+class Simulation:
+    """
+    Class used to drive the beds and clinical histories with a discrete-event simulation.
+
+    Events wait in a heap ordered by simulated time. Admissions arrive as a Poisson
+    process; each admitted patient schedules its discharge after a length of stay drawn
+    for its service and changes to its history at a Poisson rate until then, and reports
+    run at a fixed period. Every operation is timed, and with trace_memory the bytes it
+    leaves allocated are measured with tracemalloc, which slows the whole run down.
+    """
+
+    """ Kinds of operation recorded """
+    OPERATIONS = ("admit", "annotate", "discharge", "report")
+
+    def __init__(self, beds, allocator=None, workload: SyntheticWorkload = None, arrival_rate: float = 10.0,
+                 annotation_rate: float = 0.25, report_period: float = 24.0, start: datetime = datetime(2024, 1, 1),
+                 trace_memory: bool = False):
+        """ Simulation constructor object.
+
+        :param beds: The beds of the hospital.
+        :type beds: list[Bed]
+        :param allocator: The object admitting patients with allocate(clinical_history, service), or admit
+            as HospitalNetwork; a BedPool over the beds if None.
+        :type allocator: object
+        :param workload: The generator of the synthetic data, seeded with 0 if None.
+        :type workload: SyntheticWorkload
+        :param arrival_rate: The mean admissions per simulated hour.
+        :type arrival_rate: float
+        :param annotation_rate: The mean changes per admitted patient and simulated hour.
+        :type annotation_rate: float
+        :param report_period: The simulated hours between reports, None for no reports.
+        :type report_period: float
+        :param start: The simulated date of the start.
+        :type start: datetime
+        :param trace_memory: Whether to measure the memory each operation leaves allocated.
+        :type trace_memory: bool
+        """
+        self._beds = list(beds)
+        allocator = allocator if allocator is not None else BedPool(self._beds)
+        self._allocate = getattr(allocator, "allocate", None) or allocator.admit
+        self._workload = workload if workload is not None else SyntheticWorkload()
+        self._arrival_rate = arrival_rate
+        self._annotation_rate = annotation_rate
+        self._report_period = report_period
+        self._start = start
+        self._trace_memory = trace_memory
+        self._events = []
+        self._sequence = 0
+        self._now = 0.0
+        self._stats = {name: OperationStats(name) for name in self.OPERATIONS}
+        self._occupied = 0
+        self._peak_occupied = 0
+        self._peak_memory = 0
+        self._wall_time = 0.0
+
+    def _schedule(self, hours: float, kind: str, payload=None):
+        """ Add an event to the queue.
+
+        :param hours: The simulated hours from the start when the event happens.
+        :type hours: float
+        :param kind: The kind of operation.
+        :type kind: str
+        :param payload: The bed a discharge is about, or the bed and clinical history of the admission
+            a change is about.
+        :type payload: object
+        """
+        self._sequence += 1
+        heapq.heappush(self._events, (hours, self._sequence, kind, payload))
+
+    def run(self, hours: float) -> dict:
+        """ Run the simulation for some simulated hours, continuing from where a previous run stopped.
+
+        :param hours: The simulated hours to run.
+        :type hours: float
+        :returns: The statistics of every operation, see summary.
+        :rtype: dict
+        """
+        rng = self._workload.random
+        if not self._sequence:
+            self._schedule(rng.expovariate(self._arrival_rate), "admit")
+            if self._report_period:
+                self._schedule(self._report_period, "report")
+        end = self._now + hours
+        if self._trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        try:
+            while self._events and self._events[0][0] <= end:
+                self._now, _, kind, payload = heapq.heappop(self._events)
+                getattr(self, "_" + kind)(payload)
+        finally:
+            self._wall_time += time.perf_counter() - wall_start
+            if self._trace_memory:
+                self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        self._now = end
+        return self.summary()
+
+    def _measure(self, name: str, operation, *args):
+        """ Run an operation, recording its latency and the memory it leaves allocated.
+
+        :param name: The kind of operation.
+        :type name: str
+        :param operation: The function to run.
+        :type operation: callable
+        :returns: What the operation returns, None if no bed was available.
+        :rtype: object
+        """
+        memory = tracemalloc.get_traced_memory()[0] if self._trace_memory else 0
+        start = time.perf_counter()
+        try:
+            result, failed = operation(*args), False
+        except NoBedAvailableError:
+            result, failed = None, True
+        latency = time.perf_counter() - start
+        if self._trace_memory:
+            memory = tracemalloc.get_traced_memory()[0] - memory
+        self._stats[name].add(latency, memory, failed)
+        return result
+
+    def _date(self) -> datetime:
+        """ Get the simulated date of the current event. """
+        return self._start + timedelta(hours=self._now)
+
+    def _admit(self, _):
+        """ Admit a synthetic patient and schedule the next admission, the discharge and the first change. """
+        workload = self._workload
+        service = workload.service()
+        clinical_history = workload.clinical_history(service, self._date())
+        bed = self._measure("admit", self._allocate, clinical_history, service)
+        if bed is not None:
+            self._occupied += 1
+            self._peak_occupied = max(self._peak_occupied, self._occupied)
+            self._schedule(self._now + workload.stay(service) / timedelta(hours=1), "discharge", bed)
+            if self._annotation_rate:
+                self._schedule(self._now + workload.random.expovariate(self._annotation_rate), "annotate",
+                               (bed, clinical_history))
+        self._schedule(self._now + workload.random.expovariate(self._arrival_rate), "admit")
+
+    def _annotate(self, admission):
+        """ Apply a change to the history of an admitted patient, and schedule the next one.
+
+        The chain of changes of an admission stops once its patient left the bed, even if
+        another patient took it since.
+        """
+        bed, clinical_history = admission
+        if bed.clinical_history is not clinical_history:
+            return
+        self._measure("annotate", self._workload.annotation(), clinical_history, self._date())
+        self._schedule(self._now + self._workload.random.expovariate(self._annotation_rate), "annotate", admission)
+
+    def _discharge(self, bed):
+        """ Discharge the patient in a bed. """
+        self._measure("discharge", self._release, bed)
+        self._occupied -= 1
+
+    def _release(self, bed):
+        """ Set the discharge date of the patient in a bed and release the bed. """
+        bed.clinical_history.discharge_date = self._date()
+        bed.release_patient()
+
+    def _report(self, _):
+        """ Compute the report of the admitted patients and schedule the next one. """
+        self._measure("report", lambda: Report.compute_all(
+            (bed.clinical_history for bed in self._beds if bed.occupied), None, len(self._beds)))
+        self._schedule(self._now + self._report_period, "report")
+
+    @property
+    def stats(self) -> dict:
+        """ Get the statistics recorded for every operation.
+
+        :returns: Mapping of operation name to its statistics.
+        :rtype: dict[str, OperationStats]
+        """
+        return self._stats
+
+    def summary(self) -> dict:
+        """ Get the statistics of the simulation so far.
+
+        :returns: The simulated hours, wall seconds, events per wall second, occupied and peak occupied
+            beds, peak traced memory in bytes, and the summary of every operation.
+        :rtype: dict
+        """
+        events = sum(stats.count for stats in self._stats.values())
+        return {"hours": self._now, "wall_time": self._wall_time,
+                "events_per_second": events / self._wall_time if self._wall_time else 0.0,
+                "occupied": self._occupied, "peak_occupied": self._peak_occupied, "peak_memory": self._peak_memory,
+                "operations": {name: stats.summary() for name, stats in self._stats.items()}}
+
+
+if __name__ == "__main__":
+    from bed import Bed
+
+    beds = [Bed(n) for n in range(1, 301)]
+    simulation = Simulation(beds, workload=SyntheticWorkload(seed=1), arrival_rate=2.0, trace_memory=True)
+    summary = simulation.run(24 * 30)
+    print(f"30 days simulated in {summary['wall_time']:.2f} s - {summary['events_per_second']:.0f} events/s - "
+          f"{summary['occupied']} beds occupied, peak {summary['peak_occupied']} - "
+          f"peak memory {summary['peak_memory'] / 2 ** 20:.1f} MiB")
+    for stats in simulation.stats.values():
+        print(stats)
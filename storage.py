@@ -0,0 +1,529 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from bed import Bed
+from clinical_history import ClinicalHistory
+from patient import Patient
+from report import Report
+from vital_signs import VitalSigns
+
+
+class SQLiteRepository:
+    """
+    Class used to store patients, clinical histories and beds in a SQLite database.
+
+    The database runs in WAL mode, so a pool of reader connections can query it while the
+    single writer connection saves changes. Saved histories keep their database id in an
+    identity map, so saving the beds again updates them instead of duplicating them.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS patients (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            birth_date TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS clinical_histories (
+            id INTEGER PRIMARY KEY,
+            patient_id TEXT NOT NULL REFERENCES patients (id),
+            service TEXT NOT NULL,
+            admission_date TEXT NOT NULL,
+            discharge_date TEXT,
+            chronic_disease INTEGER NOT NULL,
+            blood_pressure REAL NOT NULL,
+            temperature REAL NOT NULL,
+            oxygen_saturation REAL NOT NULL,
+            breathing_rate REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS history_entries (
+            history_id INTEGER NOT NULL REFERENCES clinical_histories (id),
+            kind TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            PRIMARY KEY (history_id, kind, position)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS beds (
+            number INTEGER PRIMARY KEY,
+            service TEXT,
+            history_id INTEGER REFERENCES clinical_histories (id)
+        );
+        CREATE INDEX IF NOT EXISTS histories_patient_id ON clinical_histories (patient_id);
+        CREATE INDEX IF NOT EXISTS histories_service ON clinical_histories (service, admission_date);
+        CREATE INDEX IF NOT EXISTS histories_admission_date ON clinical_histories (admission_date);
+        CREATE INDEX IF NOT EXISTS entries_kind ON history_entries (kind, history_id);
+    """
+
+    """ Kinds of history entries, mapped to the attribute of ClinicalHistory holding them and the method adding them """
+    ENTRY_KINDS = {"evolution_note": ("evolution_notes", ClinicalHistory.add_evolution_note),
+                   "diagnostic_image": ("diagnostic_images", ClinicalHistory.add_diagnostic_image),
+                   "exam_result": ("exam_results", ClinicalHistory.add_exam_results),
+                   "medicine": ("medicines", ClinicalHistory.add_medicine)}
+
+    _UPSERT_PATIENT = ("INSERT INTO patients (id, name, gender, birth_date) VALUES (?, ?, ?, ?) "
+                       "ON CONFLICT (id) DO UPDATE SET name = excluded.name, gender = excluded.gender, "
+                       "birth_date = excluded.birth_date")
+    _UPSERT_HISTORY = ("INSERT OR REPLACE INTO clinical_histories (id, patient_id, service, admission_date, "
+                       "discharge_date, chronic_disease, blood_pressure, temperature, oxygen_saturation, "
+                       "breathing_rate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    _DELETE_ENTRIES = "DELETE FROM history_entries WHERE history_id = ?"
+    _INSERT_ENTRY = "INSERT INTO history_entries (history_id, kind, position, content) VALUES (?, ?, ?, ?)"
+    _SELECT_HISTORIES = ("SELECT h.id, p.id, p.name, p.gender, p.birth_date, h.service, h.admission_date, "
+                         "h.discharge_date, h.chronic_disease, h.blood_pressure, h.temperature, "
+                         "h.oxygen_saturation, h.breathing_rate FROM clinical_histories h "
+                         "JOIN patients p ON p.id = h.patient_id")
+
+    def __init__(self, path: str, readers: int = 4, batch_size: int = 1000):
+        """ SQLiteRepository constructor object.
+
+        :param path: The path of the database file. In-memory databases are not supported,
+            since every connection would see its own database.
+        :type path: str
+        :param readers: The number of reader connections in the pool.
+        :type readers: int
+        :param batch_size: The number of rows sent to each executemany call.
+        :type batch_size: int
+        """
+        self._path = path
+        self._batch_size = batch_size
+        self._history_ids = {}
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._writer.execute("PRAGMA synchronous = NORMAL")
+        self._writer.executescript(self.SCHEMA)
+        self._next_history_id = self._writer.execute(
+            "SELECT COALESCE(MAX(id), 0) + 1 FROM clinical_histories").fetchone()[0]
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Open a connection to the database shareable between threads.
+
+        :returns: The connection.
+        :rtype: sqlite3.Connection
+        """
+        connection = sqlite3.connect(self._path, check_same_thread=False, cached_statements=256)
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    @contextmanager
+    def _reading(self):
+        """ Borrow a reader connection from the pool for the duration of a with block. """
+        connection = self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    @contextmanager
+    def _writing(self):
+        """ Run a with block in a transaction of the writer connection. """
+        with self._write_lock, self._writer:
+            yield self._writer
+
+    def _executemany(self, connection: sqlite3.Connection, sql: str, rows):
+        """ Run a statement over many rows, in batches of batch_size rows.
+
+        :param connection: The connection to use.
+        :type connection: sqlite3.Connection
+        :param sql: The statement.
+        :type sql: str
+        :param rows: The parameters of each row.
+        :type rows: iterable
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self._batch_size:
+                connection.executemany(sql, batch)
+                batch = []
+        if batch:
+            connection.executemany(sql, batch)
+
+    def save_patients(self, patients):
+        """ Insert or update patients.
+
+        :param patients: The patients to save.
+        :type patients: list[Patient]
+        """
+        with self._writing() as connection:
+            self._executemany(connection, self._UPSERT_PATIENT, (_patient_row(patient) for patient in patients))
+
+    def save_histories(self, histories) -> list:
+        """ Insert or update clinical histories, with their patients and entries.
+
+        Histories already saved or loaded through this repository are updated, the others get a new id.
+
+        :param histories: The clinical histories to save.
+        :type histories: list[ClinicalHistory]
+        :returns: The id of each history.
+        :rtype: list[int]
+        """
+        histories = list(histories)
+        with self._writing() as connection:
+            known = [history in self._history_ids for history in histories]
+            ids = [self._assign_id(history) for history in histories]
+            patients = {history.patient.id: history.patient for history in histories}
+            self._executemany(connection, self._UPSERT_PATIENT, (_patient_row(patient) for patient in patients.values()))
+            self._executemany(connection, self._UPSERT_HISTORY,
+                              (_history_row(history_id, history) for history_id, history in zip(ids, histories)))
+            self._executemany(connection, self._DELETE_ENTRIES,
+                              ((history_id,) for history_id, saved in zip(ids, known) if saved))
+            self._executemany(connection, self._INSERT_ENTRY,
+                              (row for history_id, history in zip(ids, histories)
+                               for row in _entry_rows(history_id, history)))
+        return ids
+
+    def save_history(self, history) -> int:
+        """ Insert or update one clinical history, with its patient and entries, see save_histories.
+
+        :param history: The clinical history to save.
+        :type history: ClinicalHistory
+        :returns: The id of the history.
+        :rtype: int
+        """
+        return self.save_histories([history])[0]
+
+    def save_bed(self, bed):
+        """ Save the state of one bed, together with the clinical history of its patient, see save_beds.
+
+        Saving only the bed that changed keeps an admission or a discharge independent of the number of beds.
+
+        :param bed: The bed to save.
+        :type bed: Bed
+        """
+        self.save_beds([bed])
+
+    def save_beds(self, beds):
+        """ Save the state of the beds, together with the clinical histories of the admitted patients.
+
+        :param beds: The beds to save.
+        :type beds: list[Bed]
+        """
+        beds = list(beds)
+        occupied = [bed for bed in beds if bed.occupied]
+        self.save_histories(bed.clinical_history for bed in occupied)
+        with self._writing() as connection:
+            self._executemany(connection, "INSERT OR REPLACE INTO beds (number, service, history_id) VALUES (?, ?, ?)",
+                              ((bed.number, bed.service,
+                                self._history_ids[bed.clinical_history] if bed.occupied else None) for bed in beds))
+
+    def load_beds(self) -> list:
+        """ Load the saved beds, admitting the saved patients again.
+
+        :returns: The beds in number order.
+        :rtype: list[Bed]
+        """
+        with self._reading() as connection:
+            rows = connection.execute("SELECT number, service, history_id FROM beds ORDER BY number").fetchall()
+        histories = {history_id: history for history_id, history in
+                     self.find_histories(ids=[row[2] for row in rows if row[2] is not None])}
+        beds = []
+        for number, service, history_id in rows:
+            bed = Bed(number)
+            if history_id is not None:
+                bed.admit_patient(histories[history_id], service)
+            beds.append(bed)
+        return beds
+
+    def get_history(self, history_id: int):
+        """ Load a clinical history by its id.
+
+        :param history_id: The id of the clinical history.
+        :type history_id: int
+        :returns: The clinical history.
+        :rtype: ClinicalHistory
+        :raises KeyError: If there is no history with that id.
+        """
+        found = self.find_histories(ids=[history_id])
+        if not found:
+            raise KeyError(history_id)
+        return found[0][1]
+
+    def history_id_range(self) -> tuple:
+        """ Get the smallest and the largest stored history ids.
+
+        :returns: The smallest and the largest ids, (None, None) if nothing is stored.
+        :rtype: tuple[int, int]
+        """
+        with self._reading() as connection:
+            return connection.execute("SELECT MIN(id), MAX(id) FROM clinical_histories").fetchone()
+
+    def history_id(self, history):
+        """ Get the id of a clinical history saved or loaded through this repository.
+
+        :param history: The clinical history.
+        :type history: ClinicalHistory
+        :returns: The id, None if the history was never saved.
+        :rtype: int
+        """
+        return self._history_ids.get(history)
+
+    def find_histories(self, ids=None, patient_id: str = None, service: str = None,
+                       admitted_from: datetime = None, admitted_to: datetime = None) -> list:
+        """ Load the clinical histories matching all the given filters.
+
+        :param ids: Keep only these history ids.
+        :type ids: list[int]
+        :param patient_id: Keep only the histories of this patient.
+        :type patient_id: str
+        :param service: Keep only the histories of this medical service.
+        :type service: str
+        :param admitted_from: Keep only the histories admitted at or after this date.
+        :type admitted_from: datetime
+        :param admitted_to: Keep only the histories admitted before this date.
+        :type admitted_to: datetime
+        :returns: Tuples of (id, clinical history) in id order.
+        :rtype: list[tuple[int, ClinicalHistory]]
+        """
+        where, parameters = _filters(patient_id, service, admitted_from, admitted_to)
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return []
+            where.append(f"h.id IN ({', '.join('?' * len(ids))})")
+            parameters.extend(ids)
+        sql = self._SELECT_HISTORIES + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY h.id"
+
+        with self._reading() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+            histories = {row[0]: _history_from_row(row) for row in rows}
+            for history_id, kind, content in _select_entries(connection, list(histories)):
+                self.ENTRY_KINDS[kind][1](histories[history_id], content)
+
+        for history_id, history in histories.items():
+            self._history_ids[history] = history_id
+        return list(histories.items())
+
+    def iter_histories(self, patient_id: str = None, service: str = None, admitted_from: datetime = None,
+                       admitted_to: datetime = None, first_id: int = None, last_id: int = None):
+        """ Stream the clinical histories matching all the given filters, batch_size histories at a time.
+
+        Only one batch is in memory at once, so the histories can feed Report.compute_all
+        or a ReportAccumulator whatever their number. Streamed histories are not kept in
+        the identity map of the repository.
+
+        :param first_id: Keep only the histories with this id or a greater one.
+        :type first_id: int
+        :param last_id: Keep only the histories with this id or a smaller one.
+        :type last_id: int
+        :returns: Tuples of (id, clinical history) in id order.
+        :rtype: iterator[tuple[int, ClinicalHistory]]
+        """
+        where, parameters = _filters(patient_id, service, admitted_from, admitted_to)
+        if last_id is not None:
+            where.append("h.id <= ?")
+            parameters.append(last_id)
+        after_id = (first_id or 1) - 1
+        while True:
+            sql = (self._SELECT_HISTORIES + " WHERE " + " AND ".join(where + ["h.id > ?"])
+                   + f" ORDER BY h.id LIMIT {self._batch_size}")
+            with self._reading() as connection:
+                rows = connection.execute(sql, parameters + [after_id]).fetchall()
+                histories = {row[0]: _history_from_row(row) for row in rows}
+                for history_id, kind, content in _select_entries(connection, list(histories)):
+                    self.ENTRY_KINDS[kind][1](histories[history_id], content)
+            if not histories:
+                return
+            yield from histories.items()
+            after_id = rows[-1][0]
+
+    def admissions_and_discharges_per_service(self, admitted_from: datetime = None,
+                                              admitted_to: datetime = None) -> tuple:
+        """ Count the stored admissions and discharges per medical service with a SQL aggregate.
+
+        :returns: Two dictionaries - one for admissions and one for discharges - mapping medical services to counts.
+        :rtype: tuple[dict[str, int], dict[str, int]]
+        """
+        where, parameters = _filters(None, None, admitted_from, admitted_to)
+        sql = ("SELECT h.service, h.discharge_date IS NULL, COUNT(*) FROM clinical_histories h"
+               + (" WHERE " + " AND ".join(where) if where else "") + " GROUP BY 1, 2")
+        admissions_per_service, discharges_per_service = {}, {}
+        with self._reading() as connection:
+            for service, admitted, count in connection.execute(sql, parameters):
+                (admissions_per_service if admitted else discharges_per_service)[service] = count
+        return admissions_per_service, discharges_per_service
+
+    def avg_stay_per_service(self, admitted_from: datetime = None, admitted_to: datetime = None) -> dict:
+        """ Calculate the average length of stay of the stored discharged histories with a SQL aggregate.
+
+        :returns: A dictionary mapping medical services to their average length of stay.
+        :rtype: dict[str, str]
+        """
+        where, parameters = _filters(None, None, admitted_from, admitted_to)
+        where += ["h.discharge_date IS NOT NULL", "h.service != ''"]
+        sql = ("SELECT h.service, AVG(strftime('%s', h.discharge_date) - strftime('%s', h.admission_date)) "
+               "FROM clinical_histories h WHERE " + " AND ".join(where) + " GROUP BY h.service")
+        with self._reading() as connection:
+            return {service: str(timedelta(seconds=seconds)) for service, seconds in connection.execute(sql, parameters)}
+
+    def patients_with_chronic_diseases(self, admitted_from: datetime = None, admitted_to: datetime = None) -> set:
+        """ Identify the stored patients with chronic diseases with a SQL query.
+
+        :returns: A set containing the names of patients with chronic diseases.
+        :rtype: set
+        """
+        where, parameters = _filters(None, None, admitted_from, admitted_to)
+        sql = ("SELECT DISTINCT p.name FROM clinical_histories h JOIN patients p ON p.id = h.patient_id "
+               "WHERE " + " AND ".join(where + ["h.chronic_disease"]))
+        with self._reading() as connection:
+            return {name for name, in connection.execute(sql, parameters)}
+
+    def meds_per_service(self, admitted_from: datetime = None, admitted_to: datetime = None, top: int = None) -> dict:
+        """ Count the stored prescriptions of each medicine per medical service with a SQL aggregate.
+
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping medical services to the prescription count of each medicine, most prescribed first.
+        :rtype: dict[str, dict[str, int]]
+        """
+        where, parameters = _filters(None, None, admitted_from, admitted_to)
+        sql = ("SELECT h.service, e.content, COUNT(*) FROM history_entries e "
+               "JOIN clinical_histories h ON h.id = e.history_id "
+               "WHERE " + " AND ".join(where + ["e.kind = 'medicine'", "h.service != ''"])
+               + " GROUP BY 1, 2 ORDER BY 1, 3 DESC, MIN(e.history_id)")
+        medicines_per_service = {}
+        with self._reading() as connection:
+            for service, medicine, count in connection.execute(sql, parameters):
+                counts = medicines_per_service.setdefault(service, {})
+                if top is None or len(counts) < top:
+                    counts[medicine] = count
+        return medicines_per_service
+
+    def occupancy_rate(self) -> float:
+        """ Calculate the occupancy rate of the stored beds with a SQL aggregate.
+
+        :returns: The occupancy rate as a percentage.
+        :rtype: float
+        """
+        with self._reading() as connection:
+            total_beds, occupied_beds = connection.execute(
+                "SELECT COUNT(*), COUNT(history_id) FROM beds").fetchone()
+        return Report.occupancy_rate(total_beds, occupied_beds)
+
+    def close(self):
+        """ Close every connection of the repository. """
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+    def _assign_id(self, history) -> int:
+        """ Get the id of a history, giving it a new one if it was never saved.
+
+        :param history: The clinical history.
+        :type history: ClinicalHistory
+        :returns: The id of the history.
+        :rtype: int
+        """
+        history_id = self._history_ids.get(history)
+        if history_id is None:
+            history_id = self._next_history_id
+            self._next_history_id += 1
+            self._history_ids[history] = history_id
+        return history_id
+
+
+def _filters(patient_id, service, admitted_from, admitted_to) -> tuple:
+    """ Build the WHERE conditions over the clinical_histories table aliased as h.
+
+    :returns: The list of conditions and the list of parameters.
+    :rtype: tuple[list[str], list]
+    """
+    where, parameters = ["1"], []
+    if patient_id is not None:
+        where.append("h.patient_id = ?")
+        parameters.append(patient_id)
+    if service is not None:
+        where.append("h.service = ?")
+        parameters.append(service)
+    if admitted_from is not None:
+        where.append("h.admission_date >= ?")
+        parameters.append(_format_date(admitted_from))
+    if admitted_to is not None:
+        where.append("h.admission_date < ?")
+        parameters.append(_format_date(admitted_to))
+    return where, parameters
+
+
+def _select_entries(connection: sqlite3.Connection, history_ids: list):
+    """ Yield the entries of some histories, in insertion order, in chunks below the SQLite variables limit.
+
+    :returns: Tuples of (history id, kind, content).
+    :rtype: iterator[tuple[int, str, str]]
+    """
+    for start in range(0, len(history_ids), 500):
+        chunk = history_ids[start:start + 500]
+        yield from connection.execute(
+            "SELECT history_id, kind, content FROM history_entries "
+            f"WHERE history_id IN ({', '.join('?' * len(chunk))}) ORDER BY history_id, kind, position", chunk)
+
+
+def _format_date(date: datetime) -> str:
+    """ Format a date the way it is stored, so stored dates sort as text. """
+    return date.isoformat(sep=" ") if date is not None else None
+
+
+def _patient_row(patient) -> tuple:
+    """ Build the patients row of a patient. """
+    return patient.id, patient.name, patient.gender, _format_date(patient.birth_date)
+
+
+def _history_row(history_id: int, history) -> tuple:
+    """ Build the clinical_histories row of a clinical history. """
+    vital_signs = history.vital_signs
+    return (history_id, history.patient.id, history.service, _format_date(history.admission_date),
+            _format_date(history.discharge_date), int(bool(history.chronic_disease)), vital_signs.blood_pressure,
+            vital_signs.temperature, vital_signs.oxygen_saturation, vital_signs.breathing_rate)
+
+
+def _entry_rows(history_id: int, history):
+    """ Yield the history_entries rows of a clinical history. """
+    for kind, (attribute, _) in SQLiteRepository.ENTRY_KINDS.items():
+        for position, content in enumerate(getattr(history, attribute)):
+            yield history_id, kind, position, content
+
+
+def _history_from_row(row: tuple):
+    """ Build a clinical history, without its entries, from a row of SQLiteRepository._SELECT_HISTORIES. """
+    (_, patient_id, name, gender, birth_date, service, admission_date, discharge_date, chronic_disease,
+     blood_pressure, temperature, oxygen_saturation, breathing_rate) = row
+    patient = Patient(patient_id, name, gender, datetime.fromisoformat(birth_date))
+    vital_signs = VitalSigns(blood_pressure, temperature, oxygen_saturation, breathing_rate)
+    return ClinicalHistory(patient, vital_signs, service, datetime.fromisoformat(admission_date),
+                           datetime.fromisoformat(discharge_date) if discharge_date else None, bool(chronic_disease))
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), "hospital.db")
+    repository = SQLiteRepository(path)
+
+    beds = [Bed(n) for n in range(1, 4)]
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    history = ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date, chronic_disease=True)
+    history.add_medicine("Lisinopril")
+    beds[0].admit_patient(history, "Cardiology")
+    repository.save_beds(beds)
+
+    history.add_evolution_note("The patient is getting better")
+    history.discharge_date = datetime.strptime("2023-10-18 12:00", "%Y-%m-%d %H:%M")
+    repository.save_histories([history])
+    repository.close()
+
+    repository = SQLiteRepository(path)
+    print(repository.load_beds()[0].clinical_history.__str__())
+    print("Admissions And Discharges: ", repository.admissions_and_discharges_per_service())
+    print("Average Stay: ", repository.avg_stay_per_service())
+    print("Chronic Patients: ", repository.patients_with_chronic_diseases())
+    print("Medicines: ", repository.meds_per_service())
+    print(f"Occupancy Rate: {repository.occupancy_rate()} %")
+    repository.close()
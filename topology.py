@@ -0,0 +1,619 @@
+import heapq
+import threading
+
+from bed import Bed
+from bed_pool import BedPool, NoBedAvailableError
+from report import Report, ReportAccumulator
+from ward_statistics import WardStatistics
+
+
+class Ward:
+    """
+    Class used to represent a ward, a shard of beds with its own allocator and statistics.
+
+    The ward follows its beds and the clinical histories of their patients, so it knows
+    when its load or its report changes. The report statistics of its patients are kept in
+    a ReportAccumulator computed again only after a change, so the reports of a site or of
+    the network merge one accumulator per ward instead of walking every bed.
+    """
+
+    def __init__(self, name: str, beds, services=None, service_beds: dict = None, quotas: dict = None,
+                 borrow: dict = None, keep_free: dict = None):
+        """ Ward constructor object.
+
+        :param name: The name of the ward.
+        :type name: str
+        :param beds: The beds of the ward.
+        :type beds: list[Bed]
+        :param services: The medical services admitted to the ward, any service if None.
+        :type services: iterable[str]
+        :param service_beds: Optional mapping of medical service to the bed numbers reserved for it.
+        :type service_beds: dict[str, iterable[int]]
+        :param quotas: Optional mapping of medical service to the largest number of beds its patients hold.
+        :type quotas: dict[str, int]
+        :param borrow: Optional mapping of medical service to the services whose reserved beds it may borrow.
+        :type borrow: dict[str, list[str]]
+        :param keep_free: Optional mapping of medical service to the number of its reserved beds never lent.
+        :type keep_free: dict[str, int]
+        """
+        self._name = name
+        self._beds = list(beds)
+        self._services = tuple(services) if services is not None else None
+        self._pool = BedPool(self._beds, service_beds, quotas, borrow, keep_free)
+        self._statistics = WardStatistics(self._beds)
+        self._site = None
+        self._listeners = []
+        self._version = 0
+        self._accumulators = {}
+        self._lock = threading.RLock()
+        for bed in self._beds:
+            bed.add_listener(self)
+            if bed.occupied:
+                bed.clinical_history.add_listener(self)
+
+    @property
+    def name(self) -> str:
+        """ Get the name of the ward.
+
+        :returns: The name of the ward.
+        :rtype: str
+        """
+        return self._name
+
+    @property
+    def site(self):
+        """ Get the site of the ward.
+
+        :returns: The site, None if the ward was not added to one.
+        :rtype: Site
+        """
+        return self._site
+
+    @property
+    def services(self) -> tuple:
+        """ Get the medical services admitted to the ward.
+
+        :returns: The medical services, None if any service is admitted.
+        :rtype: tuple[str]
+        """
+        return self._services
+
+    @property
+    def beds(self) -> list:
+        """ Get the beds of the ward.
+
+        :returns: The beds.
+        :rtype: list[Bed]
+        """
+        return self._beds
+
+    @property
+    def statistics(self) -> WardStatistics:
+        """ Get the live occupancy statistics of the ward.
+
+        :returns: The statistics.
+        :rtype: WardStatistics
+        """
+        return self._statistics
+
+    @property
+    def total_beds(self) -> int:
+        """ Get the number of beds of the ward.
+
+        :returns: The number of beds.
+        :rtype: int
+        """
+        return self._statistics.total_beds
+
+    @property
+    def occupied_beds(self) -> int:
+        """ Get the number of occupied beds of the ward.
+
+        :returns: The number of occupied beds.
+        :rtype: int
+        """
+        return self._statistics.occupied_beds
+
+    @property
+    def load(self) -> float:
+        """ Get the fraction of occupied beds.
+
+        :returns: The load between 0 and 1, 1 for a ward without beds.
+        :rtype: float
+        """
+        total_beds = self._statistics.total_beds
+        return self._statistics.occupied_beds / total_beds if total_beds else 1.0
+
+    def accepts(self, service: str) -> bool:
+        """ Check whether the ward admits patients of a medical service.
+
+        :param service: The medical service.
+        :type service: str
+        :returns: True if the ward admits the service.
+        :rtype: bool
+        """
+        return self._services is None or service in self._services
+
+    def admit(self, clinical_history, service: str):
+        """ Admit a patient to the first free bed of the ward available for the service.
+
+        :param clinical_history: The clinical history object of the patient.
+        :type clinical_history: ClinicalHistory
+        :param service: The medical service to which the patient is admitted.
+        :type service: str
+        :returns: The bed where the patient was admitted.
+        :rtype: Bed
+        :raises NoBedAvailableError: If the ward has no free bed for the service.
+        """
+        return self._pool.allocate(clinical_history, service)
+
+    def release(self, number: int):
+        """ Release the patient from a bed of the ward.
+
+        :param number: The number of the bed.
+        :type number: int
+        :returns: The clinical history of the released patient.
+        :rtype: ClinicalHistory
+        :raises BedEmptyError: If the bed is already empty.
+        """
+        return self._pool.release(number)
+
+    def accumulator(self, metrics=Report.METRICS) -> ReportAccumulator:
+        """ Get the report statistics of the patients of the ward, computed again only if it changed.
+
+        The accumulator returned is shared; merge it into another one rather than changing it.
+
+        :param metrics: The names of the Report statistic methods to accumulate.
+        :type metrics: list[str]
+        :returns: The statistics of the admitted patients.
+        :rtype: ReportAccumulator
+        """
+        metrics = tuple(metrics)
+        with self._lock:
+            version, accumulator = self._accumulators.get(metrics, (None, None))
+            if version != self._version:
+                accumulator = ReportAccumulator(metrics)
+                accumulator.update(self._statistics.clinical_histories())
+                self._accumulators[metrics] = (self._version, accumulator)
+            return accumulator
+
+    def report(self, metrics=Report.METRICS, top: int = None) -> dict:
+        """ Get the report of the patients of the ward, as Report.compute_all.
+
+        :param metrics: The names of the Report statistic methods to compute.
+        :type metrics: list[str]
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each statistic method name to its result.
+        :rtype: dict[str, object]
+        """
+        return self.accumulator(metrics).result(self.total_beds, top)
+
+    def add_listener(self, listener):
+        """ Register an object notified with ward_changed(ward) after every admission, release or history change.
+
+        :param listener: The object to notify.
+        :type listener: object
+        """
+        self._listeners.append(listener)
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that follows the history of the new patient. """
+        clinical_history.add_listener(self)
+        self._changed()
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that stops following the history of the released patient. """
+        clinical_history.remove_listener(self)
+        self._changed()
+
+    def history_updated(self, clinical_history, attribute, value):
+        """ Clinical history listener hook. Any change may change the report. """
+        self._changed()
+
+    def _changed(self):
+        """ Invalidate the cached reports and notify the listeners. """
+        with self._lock:
+            self._version += 1
+        for listener in self._listeners:
+            listener.ward_changed(self)
+
+    def __str__(self):
+        """ Returns str of ward """
+        return (f"Ward {self._name}: {self.occupied_beds}/{self.total_beds} beds occupied"
+                f" - services: {', '.join(self._services) if self._services is not None else 'any'}")
+
+
+class Site:
+    """
+    Class used to represent a site of the hospital network, a group of wards.
+    """
+
+    def __init__(self, name: str, wards=()):
+        """ Site constructor object.
+
+        :param name: The name of the site.
+        :type name: str
+        :param wards: The wards of the site.
+        :type wards: list[Ward]
+        """
+        self._name = name
+        self._wards = []
+        self._network = None
+        for ward in wards:
+            self.add_ward(ward)
+
+    def add_ward(self, ward: Ward):
+        """ Add a ward to the site.
+
+        :param ward: The ward.
+        :type ward: Ward
+        """
+        ward._site = self
+        self._wards.append(ward)
+        if self._network is not None:
+            self._network._add_ward(ward)
+
+    @property
+    def name(self) -> str:
+        """ Get the name of the site.
+
+        :returns: The name of the site.
+        :rtype: str
+        """
+        return self._name
+
+    @property
+    def wards(self) -> list:
+        """ Get the wards of the site.
+
+        :returns: The wards.
+        :rtype: list[Ward]
+        """
+        return self._wards
+
+    @property
+    def total_beds(self) -> int:
+        """ Get the number of beds of the site.
+
+        :returns: The number of beds.
+        :rtype: int
+        """
+        return sum(ward.total_beds for ward in self._wards)
+
+    @property
+    def occupied_beds(self) -> int:
+        """ Get the number of occupied beds of the site.
+
+        :returns: The number of occupied beds.
+        :rtype: int
+        """
+        return sum(ward.occupied_beds for ward in self._wards)
+
+    def accumulator(self, metrics=Report.METRICS) -> ReportAccumulator:
+        """ Get the report statistics of the patients of the site, merging those of its wards.
+
+        :param metrics: The names of the Report statistic methods to accumulate.
+        :type metrics: list[str]
+        :returns: A new accumulator with the statistics of the admitted patients.
+        :rtype: ReportAccumulator
+        """
+        accumulator = ReportAccumulator(metrics)
+        for ward in self._wards:
+            accumulator.merge(ward.accumulator(metrics))
+        return accumulator
+
+    def report(self, metrics=Report.METRICS, top: int = None) -> dict:
+        """ Get the report of the patients of the site, as Report.compute_all.
+
+        :param metrics: The names of the Report statistic methods to compute.
+        :type metrics: list[str]
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each statistic method name to its result.
+        :rtype: dict[str, object]
+        """
+        return self.accumulator(metrics).result(self.total_beds, top)
+
+
+class HospitalNetwork:
+    """
+    Class used to represent a network of hospital sites and to route admissions between their wards.
+
+    Admissions go to the least loaded ward admitting the service, in the whole network or
+    in one site. The wards of each service are kept in a heap ordered by load, updated when
+    a ward notifies a change, with outdated entries skipped when they reach the top, so
+    routing an admission costs O(log n) in the number of wards.
+    """
+
+    def __init__(self, sites=()):
+        """ HospitalNetwork constructor object.
+
+        :param sites: The sites of the network.
+        :type sites: list[Site]
+        """
+        self._sites = {}
+        self._wards = []
+        self._ward_of_bed = {}
+        self._heaps = {None: []}
+        self._keys = {}
+        self._sequence = 0
+        self._lock = threading.RLock()
+        for site in sites:
+            self.add_site(site)
+
+    @classmethod
+    def from_config(cls, config: dict, beds=None):
+        """ Build a network from a description of its sites and wards.
+
+        For example ``{"sites": [{"name": "North", "wards": [{"name": "Cardiology", "beds": 40,
+        "services": ["Cardiology"]}]}]}``. A ward without services admits any service, and
+        ``"service_beds"``, ``"quotas"``, ``"borrow"`` and ``"keep_free"`` set its allocation
+        rules as in BedPool, with the bed numbers reserved counted within the ward. Beds are
+        numbered from 1 across the whole network, in the order of the description.
+
+        :param config: The description of the network.
+        :type config: dict
+        :param beds: The beds to use instead of new ones, for example the beds saved by a previous run.
+        :type beds: list[Bed]
+        :returns: The network.
+        :rtype: HospitalNetwork
+        :raises ValueError: If the beds given are not as many as the beds of the description.
+        """
+        beds = sorted(beds, key=lambda bed: bed.number) if beds else None
+        n_beds = sum(ward["beds"] for site in config["sites"] for ward in site["wards"])
+        if beds is not None and len(beds) != n_beds:
+            raise ValueError(f"The network has {n_beds} beds but {len(beds)} were given")
+        network = cls()
+        first = 0
+        for site_config in config["sites"]:
+            site = Site(site_config["name"])
+            for ward_config in site_config["wards"]:
+                count = ward_config["beds"]
+                ward_beds = beds[first:first + count] if beds is not None else [
+                    Bed(number) for number in range(first + 1, first + count + 1)]
+                service_beds = {service: [ward_beds[number - 1].number for number in numbers]
+                                for service, numbers in ward_config.get("service_beds", {}).items()}
+                site.add_ward(Ward(ward_config["name"], ward_beds, ward_config.get("services"), service_beds,
+                                   ward_config.get("quotas"), ward_config.get("borrow"), ward_config.get("keep_free")))
+                first += count
+            network.add_site(site)
+        return network
+
+    def add_site(self, site: Site):
+        """ Add a site and its wards to the network.
+
+        :param site: The site.
+        :type site: Site
+        """
+        with self._lock:
+            self._sites[site.name] = site
+            site._network = self
+            for ward in site.wards:
+                self._add_ward(ward)
+
+    def _add_ward(self, ward: Ward):
+        """ Start routing admissions to a ward. """
+        with self._lock:
+            self._wards.append(ward)
+            for bed in ward.beds:
+                self._ward_of_bed[bed.number] = ward
+            for service in ward.services or ():
+                self._heaps.setdefault(service, [])
+            ward.add_listener(self)
+            self.ward_changed(ward)
+
+    def ward_changed(self, ward: Ward):
+        """ Ward listener hook that moves the ward to its new place in the routing heaps. """
+        with self._lock:
+            self._sequence += 1
+            key = (ward.load, self._sequence)
+            self._keys[ward] = key
+            for service in ward.services or (None,):
+                heap = self._heaps[service]
+                heapq.heappush(heap, (*key, ward))
+                if len(heap) > 2 * len(self._wards) + 64:
+                    heap[:] = [entry for entry in heap if self._keys[entry[2]] == entry[:2]]
+                    heapq.heapify(heap)
+
+    def _least_loaded(self, service: str) -> Ward:
+        """ Find the least loaded ward admitting a service. The caller holds the lock.
+
+        :param service: The medical service.
+        :type service: str
+        :returns: The ward, None if no ward admits the service.
+        :rtype: Ward
+        """
+        best = None
+        for heap in (self._heaps.get(service), self._heaps[None]):
+            while heap and self._keys[heap[0][2]] != heap[0][:2]:
+                heapq.heappop(heap)
+            if heap and (best is None or heap[0] < best):
+                best = heap[0]
+        return best[2] if best is not None else None
+
+    def route(self, service: str, site: str = None) -> Ward:
+        """ Find the ward an admission for a service would go to.
+
+        :param service: The medical service.
+        :type service: str
+        :param site: The name of the site the patient must stay in, any site if None.
+        :type site: str
+        :returns: The least loaded ward admitting the service, None if none does.
+        :rtype: Ward
+        """
+        with self._lock:
+            if site is None:
+                return self._least_loaded(service)
+            wards = [ward for ward in self._sites[site].wards if ward.accepts(service)]
+            return min(wards, key=lambda ward: ward.load) if wards else None
+
+    def admit(self, clinical_history, service: str, site: str = None):
+        """ Admit a patient to the least loaded ward admitting the service.
+
+        If that ward has no bed for the service, as when its free beds are reserved for
+        other services, the other wards are tried from the least loaded. The network lock is
+        only held to choose the wards: admitting takes the lock of the bed pool of the ward,
+        whose bed listeners take the network lock in ward_changed, as in a direct Ward.admit.
+
+        :param clinical_history: The clinical history object of the patient.
+        :type clinical_history: ClinicalHistory
+        :param service: The medical service to which the patient is admitted.
+        :type service: str
+        :param site: The name of the site the patient must stay in, any site if None.
+        :type site: str
+        :returns: The bed where the patient was admitted.
+        :rtype: Bed
+        :raises NoBedAvailableError: If no ward has a free bed for the service.
+        """
+        with self._lock:
+            ward = self.route(service, site)
+            candidates = list(self._sites[site].wards if site is not None else self._wards)
+        if ward is not None and ward.load < 1:
+            try:
+                return ward.admit(clinical_history, service)
+            except NoBedAvailableError:
+                pass
+        for ward in sorted((ward for ward in candidates if ward.accepts(service) and ward.load < 1),
+                           key=lambda ward: ward.load):
+            try:
+                return ward.admit(clinical_history, service)
+            except NoBedAvailableError:
+                continue
+        raise NoBedAvailableError(f"No bed available for the service {service}"
+                                  + (f" in the site {site}" if site is not None else ""))
+
+    def ward_of(self, number: int) -> Ward:
+        """ Get the ward of a bed.
+
+        :param number: The number of the bed.
+        :type number: int
+        :returns: The ward.
+        :rtype: Ward
+        """
+        return self._ward_of_bed[number]
+
+    def site(self, name: str) -> Site:
+        """ Get a site by its name.
+
+        :param name: The name of the site.
+        :type name: str
+        :returns: The site.
+        :rtype: Site
+        """
+        return self._sites[name]
+
+    @property
+    def sites(self) -> list:
+        """ Get the sites of the network.
+
+        :returns: The sites, in the order they were added.
+        :rtype: list[Site]
+        """
+        return list(self._sites.values())
+
+    @property
+    def wards(self) -> list:
+        """ Get the wards of every site.
+
+        :returns: The wards.
+        :rtype: list[Ward]
+        """
+        return list(self._wards)
+
+    @property
+    def beds(self) -> list:
+        """ Get the beds of every ward.
+
+        :returns: The beds, in number order.
+        :rtype: list[Bed]
+        """
+        return sorted((bed for ward in self._wards for bed in ward.beds), key=lambda bed: bed.number)
+
+    @property
+    def services(self) -> tuple:
+        """ Get the medical services some ward is restricted to.
+
+        :returns: The medical services in name order.
+        :rtype: tuple[str]
+        """
+        return tuple(sorted(service for service in self._heaps if service is not None))
+
+    @property
+    def total_beds(self) -> int:
+        """ Get the number of beds of the network.
+
+        :returns: The number of beds.
+        :rtype: int
+        """
+        return sum(ward.total_beds for ward in self._wards)
+
+    @property
+    def occupied_beds(self) -> int:
+        """ Get the number of occupied beds of the network.
+
+        :returns: The number of occupied beds.
+        :rtype: int
+        """
+        return sum(ward.occupied_beds for ward in self._wards)
+
+    def accumulator(self, metrics=Report.METRICS) -> ReportAccumulator:
+        """ Get the report statistics of the patients of the network, merging those of its wards.
+
+        :param metrics: The names of the Report statistic methods to accumulate.
+        :type metrics: list[str]
+        :returns: A new accumulator with the statistics of the admitted patients.
+        :rtype: ReportAccumulator
+        """
+        accumulator = ReportAccumulator(metrics)
+        for ward in self._wards:
+            accumulator.merge(ward.accumulator(metrics))
+        return accumulator
+
+    def report(self, metrics=Report.METRICS, top: int = None) -> dict:
+        """ Get the report of the patients of the network, as Report.compute_all.
+
+        :param metrics: The names of the Report statistic methods to compute.
+        :type metrics: list[str]
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping each statistic method name to its result.
+        :rtype: dict[str, object]
+        """
+        return self.accumulator(metrics).result(self.total_beds, top)
+
+    def site_reports(self, metrics=Report.METRICS, top: int = None) -> dict:
+        """ Get the report of every site.
+
+        :param metrics: The names of the Report statistic methods to compute.
+        :type metrics: list[str]
+        :param top: Keep only the top most prescribed medicines of each service, all of them if None.
+        :type top: int
+        :returns: A dictionary mapping site names to their report.
+        :rtype: dict[str, dict[str, object]]
+        """
+        return {name: site.report(metrics, top) for name, site in self._sites.items()}
+
+
+if __name__ == "__main__":
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    network = HospitalNetwork.from_config({"sites": [
+        {"name": "North", "wards": [{"name": "Cardiology", "beds": 4, "services": ["Cardiology"]},
+                                    {"name": "General", "beds": 6}]},
+        {"name": "South", "wards": [{"name": "Heart Unit", "beds": 2, "services": ["Cardiology"]}]}]})
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    for service in ("Cardiology", "Cardiology", "Cardiology", "Neurology", "Cardiology"):
+        bed = network.admit(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), service, admission_date), service)
+        ward = network.ward_of(bed.number)
+        print(f"{service} patient in bed {bed.number} of {ward.site.name} / {ward.name}")
+
+    for ward in network.wards:
+        print(ward)
+    print("Network: ", network.report(("admissions_and_discharges_per_service", "occupancy_rate")))
+    print("Sites: ", network.site_reports(("occupancy_rate",)))
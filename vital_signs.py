@@ -2,6 +2,8 @@ class VitalSigns:
     """
     Class used to represent the vital signs of a patient
     """
+    __slots__ = ("_blood_pressure", "_temperature", "_oxygen_saturation", "_breathing_rate")
+
     def __init__(self, blood_pressure: float = 0.0, temperature: float = 0.0, oxygen_saturation: float = 0.0,
                  breathing_rate: float = 0.0):
         """ VitalSigns constructor object.
@@ -89,6 +91,26 @@ class VitalSigns:
         if breathing_rate >= 0:
             self._breathing_rate = breathing_rate
 
+    def to_dict(self) -> dict:
+        """ Returns the vital signs as a dictionary.
+
+        :returns: The vital signs fields.
+        :rtype: dict
+        """
+        return {"blood_pressure": self._blood_pressure, "temperature": self._temperature,
+                "oxygen_saturation": self._oxygen_saturation, "breathing_rate": self._breathing_rate}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """ Build vital signs from a dictionary made by to_dict.
+
+        :param data: The vital signs fields.
+        :type data: dict
+        :returns: A VitalSigns object.
+        :rtype: VitalSigns
+        """
+        return cls(data["blood_pressure"], data["temperature"], data["oxygen_saturation"], data["breathing_rate"])
+
     def __str__(self):
         """ Returns str of vital signs
         :returns: string vital signs
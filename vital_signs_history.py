@@ -0,0 +1,271 @@
+from array import array
+from datetime import datetime
+
+from vital_signs import VitalSigns
+
+
+class VitalSignsSeries:
+    """
+    Class used to keep the vital signs readings of a patient over time.
+
+    Readings are stored in arrays of doubles, one per vital sign plus one for the timestamps,
+    which grow with the readings up to the capacity and are then used as ring buffers, so a
+    short stay only pays for its own readings and appending to a full series never allocates.
+    When the buffer is full the oldest readings are averaged in groups of downsample_factor
+    into a coarser series, created on the first eviction, so long stays keep their whole
+    trend in bounded memory.
+    """
+
+    COLUMNS = ("blood_pressure", "temperature", "oxygen_saturation", "breathing_rate")
+
+    def __init__(self, capacity: int = 1024, downsample_factor: int = 10, downsampled_capacity: int = 1024):
+        """ VitalSignsSeries constructor object.
+
+        :param capacity: The number of readings kept at full resolution.
+        :type capacity: int
+        :param downsample_factor: The number of old readings averaged into one downsampled reading,
+            or None to simply drop the old readings.
+        :type downsample_factor: int
+        :param downsampled_capacity: The number of downsampled readings kept.
+        :type downsampled_capacity: int
+        :raises ValueError: If the capacity is not positive.
+        """
+        if capacity <= 0:
+            raise ValueError("The capacity must be positive")
+        self._capacity = capacity
+        self._timestamps = array("d")
+        self._columns = {name: array("d") for name in self.COLUMNS}
+        self._start = 0
+        self._count = 0
+        self._downsample_factor = downsample_factor
+        self._downsampled_capacity = downsampled_capacity
+        self._downsampled = None
+        self._pending = None
+
+    def append(self, vital_signs, timestamp: datetime):
+        """ Add a reading at the end of the series.
+
+        :param vital_signs: The vital signs read.
+        :type vital_signs: VitalSigns
+        :param timestamp: The moment of the reading.
+        :type timestamp: datetime
+        """
+        self._append(timestamp.timestamp(), (vital_signs.blood_pressure, vital_signs.temperature,
+                                             vital_signs.oxygen_saturation, vital_signs.breathing_rate))
+
+    def _append(self, timestamp: float, values: tuple):
+        """ Add a reading given as epoch seconds and a tuple of values in COLUMNS order.
+
+        :param timestamp: The moment of the reading in epoch seconds.
+        :type timestamp: float
+        :param values: The values of the vital signs.
+        :type values: tuple[float]
+        """
+        if self._count < self._capacity:
+            self._count += 1
+            self._timestamps.append(timestamp)
+            for column, value in zip(self._columns.values(), values):
+                column.append(value)
+            return
+        index = self._start
+        if self._downsample_factor:
+            self._downsample(index)
+        self._start = (self._start + 1) % self._capacity
+        self._timestamps[index] = timestamp
+        for column, value in zip(self._columns.values(), values):
+            column[index] = value
+
+    def _downsample(self, index: int):
+        """ Accumulate an evicted reading and flush the group mean to the downsampled series.
+
+        :param index: The buffer position of the evicted reading.
+        :type index: int
+        """
+        if self._downsampled is None:
+            self._downsampled = VitalSignsSeries(self._downsampled_capacity, None)
+            self._pending = [0, 0.0, [0.0] * len(self.COLUMNS)]
+        pending = self._pending
+        pending[0] += 1
+        pending[1] += self._timestamps[index]
+        sums = pending[2]
+        for position, column in enumerate(self._columns.values()):
+            sums[position] += column[index]
+        if pending[0] == self._downsample_factor:
+            count = pending[0]
+            self._downsampled._append(pending[1] / count, tuple(total / count for total in sums))
+            self._pending = [0, 0.0, [0.0] * len(self.COLUMNS)]
+
+    def _window(self, last: int = None, seconds: float = None) -> range:
+        """ Get the logical positions of the readings inside a window, oldest first.
+
+        :param last: Keep only the last readings.
+        :type last: int
+        :param seconds: Keep only the readings within these seconds of the newest one.
+        :type seconds: float
+        :returns: The logical positions, 0 being the oldest reading kept.
+        :rtype: range
+        """
+        first = 0
+        if last is not None:
+            first = max(0, self._count - last)
+        if seconds is not None and self._count:
+            oldest = self._timestamp(self._count - 1) - seconds
+            low, high = first, self._count - 1
+            while low < high:
+                middle = (low + high) // 2
+                if self._timestamp(middle) < oldest:
+                    low = middle + 1
+                else:
+                    high = middle
+            first = low
+        return range(first, self._count)
+
+    def _timestamp(self, position: int) -> float:
+        """ Get the epoch timestamp of a logical position. """
+        return self._timestamps[(self._start + position) % self._capacity]
+
+    def values(self, name: str, last: int = None, seconds: float = None) -> list:
+        """ Get the values of a vital sign inside a window, oldest first.
+
+        :param name: The name of the vital sign.
+        :type name: str
+        :param last: Keep only the last readings.
+        :type last: int
+        :param seconds: Keep only the readings within these seconds of the newest one.
+        :type seconds: float
+        :returns: The values.
+        :rtype: list[float]
+        """
+        window = self._window(last, seconds)
+        column = self._columns[name]
+        first = (self._start + window.start) % self._capacity
+        end = first + len(window)
+        if end <= self._capacity:
+            return column[first:end].tolist()
+        return column[first:].tolist() + column[:end - self._capacity].tolist()
+
+    def mean(self, name: str, last: int = None, seconds: float = None) -> float:
+        """ Get the mean of a vital sign inside a window, None if the window is empty. """
+        values = self.values(name, last, seconds)
+        return sum(values) / len(values) if values else None
+
+    def min(self, name: str, last: int = None, seconds: float = None) -> float:
+        """ Get the lowest value of a vital sign inside a window, None if the window is empty. """
+        return min(self.values(name, last, seconds), default=None)
+
+    def max(self, name: str, last: int = None, seconds: float = None) -> float:
+        """ Get the highest value of a vital sign inside a window, None if the window is empty. """
+        return max(self.values(name, last, seconds), default=None)
+
+    def trend(self, name: str, last: int = None, seconds: float = None) -> float:
+        """ Get the least squares slope of a vital sign inside a window.
+
+        :param name: The name of the vital sign.
+        :type name: str
+        :param last: Keep only the last readings.
+        :type last: int
+        :param seconds: Keep only the readings within these seconds of the newest one.
+        :type seconds: float
+        :returns: The change of the vital sign per hour, None with less than two readings at different times.
+        :rtype: float
+        """
+        window = self._window(last, seconds)
+        values = self.values(name, last, seconds)
+        if len(values) < 2:
+            return None
+        origin = self._timestamp(window.start)
+        times = [self._timestamp(position) - origin for position in window]
+        mean_time = sum(times) / len(times)
+        mean_value = sum(values) / len(values)
+        variance = sum((time - mean_time) ** 2 for time in times)
+        if variance == 0:
+            return None
+        covariance = sum((time - mean_time) * (value - mean_value) for time, value in zip(times, values))
+        return covariance / variance * 3600
+
+    def latest(self):
+        """ Get the newest reading.
+
+        :returns: The moment and the vital signs of the newest reading, None if the series is empty.
+        :rtype: tuple[datetime, VitalSigns]
+        """
+        if not self._count:
+            return None
+        return self.reading(self._count - 1)
+
+    def reading(self, position: int):
+        """ Get a reading by its logical position, 0 being the oldest reading kept.
+
+        :param position: The logical position.
+        :type position: int
+        :returns: The moment and the vital signs of the reading.
+        :rtype: tuple[datetime, VitalSigns]
+        :raises IndexError: If the position is out of the series.
+        """
+        if not 0 <= position < self._count:
+            raise IndexError("reading position out of range")
+        index = (self._start + position) % self._capacity
+        return (datetime.fromtimestamp(self._timestamps[index]),
+                VitalSigns(*(column[index] for column in self._columns.values())))
+
+    def to_dict(self) -> dict:
+        """ Returns the series as a dictionary of JSON compatible values.
+
+        :returns: The settings, the timestamps in epoch seconds and the values of each vital sign oldest
+            first, the readings waiting to be downsampled and the downsampled series.
+        :rtype: dict
+        """
+        return {"capacity": self._capacity, "downsample_factor": self._downsample_factor,
+                "downsampled_capacity": self._downsampled_capacity,
+                "timestamps": [self._timestamp(position) for position in range(self._count)],
+                "values": {name: self.values(name) for name in self.COLUMNS},
+                "pending": self._pending,
+                "downsampled": self._downsampled.to_dict() if self._downsampled is not None else None}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """ Build a series from a dictionary made by to_dict.
+
+        :param data: The series fields.
+        :type data: dict
+        :returns: A VitalSignsSeries object.
+        :rtype: VitalSignsSeries
+        """
+        series = cls(data["capacity"], data["downsample_factor"], data["downsampled_capacity"])
+        for position, timestamp in enumerate(data["timestamps"]):
+            series._append(timestamp, tuple(data["values"][name][position] for name in cls.COLUMNS))
+        if data["downsampled"] is not None:
+            series._downsampled = cls.from_dict(data["downsampled"])
+            series._pending = data["pending"]
+        return series
+
+    @property
+    def downsampled(self):
+        """ Get the series of averaged old readings.
+
+        :returns: The downsampled series, None if downsampling is disabled or no reading was evicted yet.
+        :rtype: VitalSignsSeries
+        """
+        return self._downsampled
+
+    def __len__(self):
+        """ Returns the number of readings kept at full resolution.
+
+        :returns: The number of readings.
+        :rtype: int
+        """
+        return self._count
+
+
+if __name__ == "__main__":
+    from datetime import timedelta
+
+    series = VitalSignsSeries(capacity=60, downsample_factor=10)
+    start = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+    for minute in range(120):
+        series.append(VitalSigns(120, 37 + minute / 100, 95 - minute / 20, 16), start + timedelta(minutes=minute))
+
+    print(f"Readings: {len(series)} - Downsampled: {len(series.downsampled)}")
+    print(f"Temperature mean (last 10): {series.mean('temperature', last=10):.2f}")
+    print(f"Oxygen saturation min (last 30 min): {series.min('oxygen_saturation', seconds=1800):.2f}")
+    print(f"Oxygen saturation trend: {series.trend('oxygen_saturation'):.2f} per hour")
@@ -0,0 +1,232 @@
+from array import array
+from itertools import compress
+
+from vital_signs import VitalSigns
+
+
+class VitalSignsTable:
+    """
+    Class used to store the vital signs of many patients column by column.
+
+    Each vital sign is kept in its own contiguous array of doubles, and rows are indexed
+    by any key, usually the bed number or the patient id. Threshold checks run over a
+    whole column at C speed instead of reading the attributes of one object per patient.
+    """
+
+    COLUMNS = ("blood_pressure", "temperature", "oxygen_saturation", "breathing_rate")
+
+    """ Comparison operators of where, written as the method of the threshold value to call """
+    _OPERATORS = {"<": "__gt__", "<=": "__ge__", ">": "__lt__", ">=": "__le__", "==": "__eq__", "!=": "__ne__"}
+
+    """ Thresholds used by alerts when none are given """
+    DEFAULT_ALERTS = (("oxygen_saturation", "<", 90.0), ("temperature", ">", 38.5), ("temperature", "<", 35.0),
+                      ("breathing_rate", ">", 30.0), ("breathing_rate", "<", 8.0))
+
+    def __init__(self):
+        """ VitalSignsTable constructor object. """
+        self._columns = {name: array("d") for name in self.COLUMNS}
+        self._keys = []
+        self._rows = {}
+
+    def set(self, key, vital_signs):
+        """ Store the vital signs of a row, adding the row if the key is new.
+
+        :param key: The key of the row, usually a bed number or a patient id.
+        :type key: object
+        :param vital_signs: The vital signs to store.
+        :type vital_signs: VitalSigns
+        :returns: A view over the stored row.
+        :rtype: VitalSignsRow
+        """
+        values = (vital_signs.blood_pressure, vital_signs.temperature, vital_signs.oxygen_saturation,
+                  vital_signs.breathing_rate)
+        row = self._rows.get(key)
+        if row is None:
+            self._rows[key] = len(self._keys)
+            self._keys.append(key)
+            for name, value in zip(self.COLUMNS, values):
+                self._columns[name].append(value)
+        else:
+            for name, value in zip(self.COLUMNS, values):
+                self._columns[name][row] = value
+        return VitalSignsRow(self, key)
+
+    def remove(self, key):
+        """ Remove a row, moving the last row into its place.
+
+        :param key: The key of the row.
+        :type key: object
+        :raises KeyError: If the key is not in the table.
+        """
+        row = self._rows.pop(key)
+        last_key = self._keys.pop()
+        for column in self._columns.values():
+            last_value = column.pop()
+            if last_key != key:
+                column[row] = last_value
+        if last_key != key:
+            self._keys[row] = last_key
+            self._rows[last_key] = row
+
+    def row(self, key):
+        """ Get a view over a row that behaves like a VitalSigns object.
+
+        :param key: The key of the row.
+        :type key: object
+        :returns: The view over the row.
+        :rtype: VitalSignsRow
+        :raises KeyError: If the key is not in the table.
+        """
+        if key not in self._rows:
+            raise KeyError(key)
+        return VitalSignsRow(self, key)
+
+    def column(self, name: str) -> array:
+        """ Get the array with all the values of a vital sign, in row order.
+
+        :param name: The name of the vital sign.
+        :type name: str
+        :returns: The column array.
+        :rtype: array
+        """
+        return self._columns[name]
+
+    def keys(self) -> list:
+        """ Get the keys of the rows, in row order.
+
+        :returns: The row keys.
+        :rtype: list
+        """
+        return list(self._keys)
+
+    def where(self, name: str, operator: str, value: float) -> list:
+        """ Find the rows whose vital sign compares true against a threshold.
+
+        For example ``where("oxygen_saturation", "<", 90)``.
+
+        :param name: The name of the vital sign.
+        :type name: str
+        :param operator: One of <, <=, >, >=, == or !=.
+        :type operator: str
+        :param value: The threshold.
+        :type value: float
+        :returns: The keys of the matching rows.
+        :rtype: list
+        :raises ValueError: If the operator is not supported.
+        """
+        if operator not in self._OPERATORS:
+            raise ValueError(f"Unsupported operator {operator}")
+        compare = getattr(float(value), self._OPERATORS[operator])
+        return list(compress(self._keys, map(compare, self._columns[name])))
+
+    def outside(self, name: str, low: float, high: float) -> list:
+        """ Find the rows whose vital sign is outside a normal range.
+
+        :param name: The name of the vital sign.
+        :type name: str
+        :param low: The lowest normal value.
+        :type low: float
+        :param high: The highest normal value.
+        :type high: float
+        :returns: The keys of the rows below low or above high.
+        :rtype: list
+        """
+        return self.where(name, "<", low) + self.where(name, ">", high)
+
+    def alerts(self, thresholds=None) -> dict:
+        """ Screen every row against a set of thresholds.
+
+        :param thresholds: Tuples of (vital sign, operator, value), DEFAULT_ALERTS if None.
+        :type thresholds: list[tuple[str, str, float]]
+        :returns: A dictionary mapping the key of each alerting row to the thresholds it crossed.
+        :rtype: dict[object, list[tuple[str, str, float]]]
+        """
+        alerts = {}
+        for threshold in thresholds or self.DEFAULT_ALERTS:
+            for key in self.where(*threshold):
+                alerts.setdefault(key, []).append(threshold)
+        return alerts
+
+    def __len__(self):
+        """ Returns the number of rows.
+
+        :returns: The number of rows.
+        :rtype: int
+        """
+        return len(self._keys)
+
+    def __contains__(self, key):
+        """ Check if a key has a row in the table.
+
+        :returns: True if the key is in the table, False otherwise.
+        :rtype: bool
+        """
+        return key in self._rows
+
+
+def _cell(name: str) -> property:
+    """ Build a property reading and writing one column of the row of a VitalSignsRow.
+
+    :param name: The name of the column.
+    :type name: str
+    :returns: The property.
+    :rtype: property
+    """
+    def get(self):
+        return self._table._columns[name][self._table._rows[self._key]]
+
+    def set(self, value):
+        self._table._columns[name][self._table._rows[self._key]] = value
+
+    return property(get, set)
+
+
+class VitalSignsRow(VitalSigns):
+    """
+    Class used to view one row of a VitalSignsTable as a VitalSigns object.
+
+    Reads and writes go straight to the table, so the usual properties, validations and
+    string representation of VitalSigns all work on the stored values.
+    """
+
+    __slots__ = ("_table", "_key")
+
+    _blood_pressure = _cell("blood_pressure")
+    _temperature = _cell("temperature")
+    _oxygen_saturation = _cell("oxygen_saturation")
+    _breathing_rate = _cell("breathing_rate")
+
+    def __init__(self, table: VitalSignsTable, key):
+        """ VitalSignsRow constructor object.
+
+        :param table: The table holding the row.
+        :type table: VitalSignsTable
+        :param key: The key of the row.
+        :type key: object
+        """
+        self._table = table
+        self._key = key
+
+    @property
+    def key(self):
+        """ Get the key of the row in the table.
+
+        :returns: The key of the row.
+        :rtype: object
+        """
+        return self._key
+
+
+if __name__ == "__main__":
+    table = VitalSignsTable()
+    table.set(1, VitalSigns(120, 37, 98, 16))
+    table.set(2, VitalSigns(110, 39.2, 95, 22))
+    row = table.set(3, VitalSigns(90, 36.5, 85, 32))
+
+    print(row.__str__())
+    print("SpO2 < 90: ", table.where("oxygen_saturation", "<", 90))
+    print("Alerts: ", table.alerts())
+
+    row.oxygen_saturation = 94
+    table.remove(1)
+    print("SpO2 < 90 after treatment: ", table.where("oxygen_saturation", "<", 90))
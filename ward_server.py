@@ -0,0 +1,403 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from batch_admission import admit_many, discharge_many
+from bed_pool import BedPool
+from note_search import NoteIndex
+from patient_registry import PatientRegistry
+from report import Report
+from ward_statistics import WardStatistics
+
+
+class WardServer:
+    """
+    Class used to serve the ward as a local HTTP/JSON API, so many operators can work at once.
+
+    Every admission, annotation and discharge is queued to a single writer task, which applies
+    them one after another, so the beds and clinical histories are only changed from one place.
+    Reports are not queued: they are answered from the counters kept by WardStatistics and from
+    a Report cached until the next change, so reading them never waits behind the writer.
+    Searches run on a worker thread against the NoteIndex the writer keeps up to date, through
+    their own read connection to its file, so they never block the writer; the writer commits
+    the index whenever it has applied every queued change.
+    Connections are kept alive and may pipeline requests; their responses are sent in order.
+
+    Endpoints:
+
+    - ``POST /admit`` with the fields read by batch_admission.admit_many, returns the bed.
+    - ``POST /annotate`` with ``bed``, ``attribute`` (one of ANNOTATIONS) and ``value``.
+    - ``POST /discharge`` with ``discharge_date`` and either ``bed`` or ``patient_id``.
+    - ``GET /report`` returns the same statistics as the menu report.
+    - ``GET /beds/<number>`` returns the clinical history of the patient in a bed.
+    - ``GET /search?q=<query>`` finds the histories whose notes or exam results match a query,
+      optionally with ``service``, ``admitted=1`` to skip the discharged patients and ``limit``.
+    - ``GET /metrics`` returns the measures of the instrumentation in the Prometheus text format,
+      when the server was given one.
+    """
+
+    """ History changes accepted by /annotate, with the function applying them """
+    ANNOTATIONS = {"evolution_note": lambda history, value: history.add_evolution_note(value),
+                   "diagnostic_image": lambda history, value: history.add_diagnostic_image(value),
+                   "exam_result": lambda history, value: history.add_exam_results(value),
+                   "medicine": lambda history, value: history.add_medicine(value),
+                   "chronic_disease": lambda history, value: setattr(history, "chronic_disease", bool(value))}
+
+    """ Largest number of pipelined requests of a connection waiting for their response """
+    PIPELINE_DEPTH = 64
+
+    def __init__(self, beds, services=None, instrumentation=None, notes_path: str = None):
+        """ WardServer constructor object.
+
+        :param beds: The beds of the ward.
+        :type beds: list[Bed]
+        :param services: The accepted medical services, any service if None.
+        :type services: tuple[str]
+        :param instrumentation: The instrumentation served on /metrics, if any.
+        :type instrumentation: Instrumentation
+        :param notes_path: The SQLite file of the note index, a temporary one removed on close if None.
+        :type notes_path: str
+        """
+        self._beds = list(beds)
+        self._services = services
+        self._instrumentation = instrumentation
+        self._pool = BedPool(self._beds)
+        self._statistics = WardStatistics(self._beds)
+        self._registry = PatientRegistry(self._beds)
+        self._notes_directory = tempfile.mkdtemp() if notes_path is None else None
+        self._notes = NoteIndex(notes_path or os.path.join(self._notes_directory, "notes.db"), self._beds)
+        self._mutations = None
+        self._writer = None
+        self._server = None
+        self._version = 0
+        self._report = None
+        self._report_version = -1
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        """ Start the writer task and listen for connections.
+
+        :param host: The address to listen on.
+        :type host: str
+        :param port: The port to listen on, 0 for any free port.
+        :type port: int
+        :returns: The port the server listens on.
+        :rtype: int
+        """
+        self._mutations = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        self._server = await asyncio.start_server(self._serve_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """ Serve connections until the server is cancelled. """
+        await self._server.serve_forever()
+
+    async def close(self):
+        """ Stop listening, then let the writer apply the changes already queued, stop it and close the note index. """
+        self._server.close()
+        await self._server.wait_closed()
+        await self._mutations.join()
+        self._writer.cancel()
+        self._notes.close()
+        if self._notes_directory is not None:
+            shutil.rmtree(self._notes_directory, ignore_errors=True)
+
+    async def _serve_connection(self, reader, writer):
+        """ Read the requests of a connection, handling them while the previous responses are sent.
+
+        :param reader: The stream of the connection requests.
+        :type reader: asyncio.StreamReader
+        :param writer: The stream of the connection responses.
+        :type writer: asyncio.StreamWriter
+        """
+        responses = asyncio.Queue(self.PIPELINE_DEPTH)
+        sender = asyncio.create_task(self._send_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.LimitOverrunError, asyncio.IncompleteReadError) as error:
+                    await responses.put((_completed((400, {"error": f"Bad request: {error}"})), False))
+                    break
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+                await responses.put((asyncio.create_task(self._respond(method, target, body)), keep_alive))
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+
+    @staticmethod
+    async def _send_responses(responses, writer):
+        """ Send the responses of a connection in the order its requests arrived.
+
+        :param responses: Tuples of (response task, keep alive), ended by None.
+        :type responses: asyncio.Queue
+        :param writer: The stream of the connection responses.
+        :type writer: asyncio.StreamWriter
+        """
+        while True:
+            item = await responses.get()
+            if item is None:
+                return
+            response, keep_alive = item
+            status, payload = await response
+            try:
+                writer.write(_encode_response(status, payload, keep_alive))
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, method: str, target: str, body: bytes) -> tuple:
+        """ Route a request to its handler.
+
+        :param method: The HTTP method.
+        :type method: str
+        :param target: The path of the request, with the query if any.
+        :type target: str
+        :param body: The request body.
+        :type body: bytes
+        :returns: The HTTP status and the JSON payload, or the text of /metrics.
+        :rtype: tuple[int, object]
+        """
+        path, _, query = target.partition("?")
+        if path in ("/admit", "/annotate", "/discharge"):
+            if method != "POST":
+                return 405, {"error": f"Use POST for {path}"}
+            try:
+                record = json.loads(body or b"{}")
+            except ValueError as error:
+                return 400, {"error": f"Invalid JSON: {error}"}
+            if not isinstance(record, dict):
+                return 400, {"error": "The body must be a JSON object"}
+            return await self.submit(path[1:], record)
+        if method != "GET":
+            return 405, {"error": f"Use GET for {path}"}
+        if path == "/report":
+            return 200, self.report()
+        if path.startswith("/beds/"):
+            return self._bed_history(path[len("/beds/"):])
+        if path == "/search":
+            return await self._search(parse_qs(query))
+        if path == "/metrics" and self._instrumentation is not None:
+            return 200, self._instrumentation.to_prometheus()
+        return 404, {"error": f"Unknown path {path}"}
+
+    async def submit(self, kind: str, record: dict) -> tuple:
+        """ Queue a change for the writer task and wait until it is applied.
+
+        :param kind: The change: "admit", "annotate" or "discharge".
+        :type kind: str
+        :param record: The fields of the change.
+        :type record: dict
+        :returns: The HTTP status and the JSON payload.
+        :rtype: tuple[int, object]
+        """
+        result = asyncio.get_running_loop().create_future()
+        self._mutations.put_nowait((kind, record, result))
+        return await result
+
+    async def _write_loop(self):
+        """ Apply the queued changes one at a time, as the only task changing the ward. """
+        handlers = {"admit": self._admit, "annotate": self._annotate, "discharge": self._discharge}
+        while True:
+            kind, record, result = await self._mutations.get()
+            try:
+                outcome = handlers[kind](record)
+            except Exception as error:
+                outcome = 500, {"error": f"{type(error).__name__}: {error}"}
+            self._version += 1
+            if self._mutations.empty():
+                self._notes.flush()
+            if not result.cancelled():
+                result.set_result(outcome)
+            self._mutations.task_done()
+
+    def _admit(self, record: dict) -> tuple:
+        """ Admit the patient of an admission record. """
+        result = admit_many(self._pool, [record], self._services)
+        if result.errors:
+            message = result.errors[0][1]
+            return (409 if message == "No bed available" else 400), {"error": message}
+        return 200, {"bed": result.succeeded[0][1].number}
+
+    def _annotate(self, record: dict) -> tuple:
+        """ Add a note, image, exam result, medicine or chronic disease to the history in a bed. """
+        try:
+            bed = self._pool.bed(int(record["bed"]))
+        except (KeyError, TypeError, ValueError):
+            return 404, {"error": f"Non existent bed {record.get('bed')}"}
+        annotate = self.ANNOTATIONS.get(record.get("attribute"))
+        if annotate is None:
+            return 400, {"error": f"The attribute must be one of {sorted(self.ANNOTATIONS)}"}
+        if "value" not in record:
+            return 400, {"error": "Missing field value"}
+        if not bed.occupied:
+            return 409, {"error": f"The bed {bed.number} is not occupied"}
+        annotate(bed.clinical_history, record["value"])
+        return 200, {"bed": bed.number}
+
+    def _discharge(self, record: dict) -> tuple:
+        """ Discharge the patient of a discharge record. """
+        result = discharge_many(self._pool, [record], self._registry)
+        if result.errors:
+            return 400, {"error": result.errors[0][1]}
+        return 200, {"bed": result.succeeded[0][1].number}
+
+    def report(self) -> dict:
+        """ Get the ward report, computing it again only if the ward changed since the last one.
+
+        :returns: The statistics of the menu report, ready to be encoded as JSON.
+        :rtype: dict
+        """
+        if self._report_version != self._version:
+            report = Report.compute_all(self._statistics.clinical_histories(),
+                                        ("admissions_and_discharges_per_service", "avg_stay_per_service",
+                                         "patients_with_chronic_diseases", "meds_per_service"))
+            admissions, discharges = report["admissions_and_discharges_per_service"]
+            self._report = {"admissions_per_service": admissions,
+                            "discharges_per_service": discharges,
+                            "occupancy_rate": self._statistics.occupancy_rate,
+                            "occupied_per_service": self._statistics.occupied_per_service,
+                            "avg_stay_per_service": report["avg_stay_per_service"],
+                            "patients_with_chronic_diseases": sorted(report["patients_with_chronic_diseases"]),
+                            "meds_per_service": report["meds_per_service"]}
+            self._report_version = self._version
+        return self._report
+
+    async def _search(self, parameters: dict) -> tuple:
+        """ Search the notes and exam results, see NoteIndex.search. """
+        if not parameters.get("q"):
+            return 400, {"error": "Missing parameter q"}
+        try:
+            limit = int(parameters.get("limit", ["20"])[0])
+        except ValueError:
+            return 400, {"error": "The limit must be a number"}
+        matches = await asyncio.to_thread(self._notes.search, parameters["q"][0], limit,
+                                          parameters.get("service", [None])[0],
+                                          parameters.get("admitted", ["0"])[0] != "1")
+        return 200, [{name: value for name, value in match.items() if name != "history"} for match in matches]
+
+    def _bed_history(self, number: str) -> tuple:
+        """ Get the clinical history of the patient in a bed. """
+        try:
+            bed = self._pool.bed(int(number))
+        except (KeyError, ValueError):
+            return 404, {"error": f"Non existent bed {number}"}
+        if not bed.occupied:
+            return 200, {"bed": bed.number, "service": None, "history": None}
+        return 200, {"bed": bed.number, "service": bed.service, "history": bed.clinical_history.to_dict()}
+
+
+async def _read_request(reader):
+    """ Read one HTTP/1.1 request.
+
+    :param reader: The stream of the connection requests.
+    :type reader: asyncio.StreamReader
+    :returns: The method, target, body and whether the connection stays open, None if the client closed it.
+    :rtype: tuple[str, str, bytes, bool]
+    :raises ValueError: If the request is malformed.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as error:
+        if not error.partial.strip():
+            return None
+        raise
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+    method, target, version = request_line.split(" ")
+    headers = {}
+    for line in header_lines:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method, target, body, keep_alive
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+            500: "Internal Server Error"}
+
+
+def _encode_response(status: int, payload, keep_alive: bool) -> bytes:
+    """ Encode a JSON response, or a Prometheus text response for a str payload.
+
+    :param status: The HTTP status.
+    :type status: int
+    :param payload: The object sent as JSON, or the text sent as is.
+    :type payload: object
+    :param keep_alive: Whether the connection stays open.
+    :type keep_alive: bool
+    :returns: The response bytes.
+    :rtype: bytes
+    """
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body = json.dumps(payload, separators=(",", ":"), default=_json_default).encode()
+        content_type = "application/json"
+    head = (f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+def _json_default(value):
+    """ Encode the values json does not know: dates as ISO text, sets as sorted lists. """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _completed(outcome) -> asyncio.Future:
+    """ Wrap an already known response in a finished future.
+
+    :param outcome: The HTTP status and the JSON payload.
+    :type outcome: tuple[int, object]
+    :returns: The finished future.
+    :rtype: asyncio.Future
+    """
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(outcome)
+    return future
+
+
+if __name__ == "__main__":
+    import sys
+    from bed import Bed
+    from event_log import EventJournal
+
+    """ List of available medical services """
+    medical_services_available = ("Internal Medicine", "General Surgery", "Pediatrics", "Cardiology", "Neurology",
+                                  "Psychiatry", "Radiology", "Rehabilitation")
+
+    """ Journal keeping the beds between runs """
+    journal = EventJournal("hospital_journal")
+    beds = journal.recover([Bed(n) for n in range(1, 301)])
+    journal.attach(beds)
+
+    async def serve(port):
+        server = WardServer(beds, medical_services_available, notes_path="hospital_notes.db")
+        port = await server.start(port=port)
+        print(f"Hospital San Vicente´s System listening on http://127.0.0.1:{port}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8080))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        journal.close()
@@ -0,0 +1,135 @@
+import threading
+
+from bed import BedEmptyError
+from bed_pool import BedPool, NoBedAvailableError
+
+
+class WardService:
+    """
+    Class used to admit, annotate and discharge patients from several threads at once.
+
+    Every bed has its own lock, held while its patient is admitted, annotated or released,
+    so operations on different beds never wait for each other. Free beds come from a
+    BedPool, whose lock is only held while a bed is taken out of the free lists, and
+    never while waiting for a bed lock, so the locks cannot deadlock.
+    """
+
+    def __init__(self, beds, service_beds: dict = None):
+        """ WardService constructor object.
+
+        :param beds: The beds of the ward.
+        :type beds: list[Bed]
+        :param service_beds: Optional mapping of medical service to the bed numbers reserved for it.
+        :type service_beds: dict[str, list[int]]
+        """
+        beds = list(beds)
+        self._beds = {bed.number: bed for bed in beds}
+        self._locks = {bed.number: threading.Lock() for bed in beds}
+        self._pool = BedPool(beds, service_beds)
+
+    def admit(self, clinical_history, service: str):
+        """ Admit a patient to the first free bed available for the service.
+
+        :param clinical_history: The clinical history object of the patient.
+        :type clinical_history: ClinicalHistory
+        :param service: The medical service to which the patient is admitted.
+        :type service: str
+        :returns: The bed where the patient was admitted.
+        :rtype: Bed
+        :raises NoBedAvailableError: If there is no free bed for the service.
+        """
+        bed = self._pool.take(service)
+        if bed is None:
+            raise NoBedAvailableError(f"No bed available for the service {service}")
+        with self._locks[bed.number]:
+            bed.admit_patient(clinical_history, service)
+        return bed
+
+    def update_history(self, number: int, update):
+        """ Change the clinical history of the patient in a bed while holding the bed lock.
+
+        For example ``ward.update_history(3, lambda history: history.add_medicine("Lisinopril"))``.
+
+        :param number: The number of the bed.
+        :type number: int
+        :param update: A function receiving the clinical history.
+        :type update: callable
+        :returns: What the function returns.
+        :rtype: object
+        :raises BedEmptyError: If the bed is empty.
+        """
+        bed = self._beds[number]
+        with self._locks[number]:
+            if not bed.occupied:
+                raise BedEmptyError(f"The bed {number} is empty")
+            return update(bed.clinical_history)
+
+    def discharge(self, number: int, discharge_date=None):
+        """ Discharge the patient of a bed.
+
+        :param number: The number of the bed.
+        :type number: int
+        :param discharge_date: The date of discharge, left unset if None.
+        :type discharge_date: datetime
+        :returns: The clinical history of the discharged patient.
+        :rtype: ClinicalHistory
+        :raises BedEmptyError: If the bed is already empty.
+        """
+        bed = self._beds[number]
+        with self._locks[number]:
+            clinical_history = bed.clinical_history
+            if bed.occupied and discharge_date is not None:
+                clinical_history.discharge_date = discharge_date
+            bed.release_patient()
+        return clinical_history
+
+    def bed(self, number: int):
+        """ Get a bed of the ward by its number.
+
+        :param number: The number of the bed.
+        :type number: int
+        :returns: The bed object.
+        :rtype: Bed
+        """
+        return self._beds[number]
+
+    @property
+    def beds(self) -> list:
+        """ Get the beds of the ward.
+
+        :returns: The beds in number order.
+        :rtype: list[Bed]
+        """
+        return [self._beds[number] for number in sorted(self._beds)]
+
+    @property
+    def pool(self):
+        """ Get the pool giving the free beds of the ward.
+
+        :returns: The bed pool.
+        :rtype: BedPool
+        """
+        return self._pool
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    ward = WardService([Bed(n) for n in range(1, 101)])
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    def admit(n):
+        patient = Patient(str(n), f"Patient {n}", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+        bed = ward.admit(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date),
+                         "Cardiology")
+        ward.update_history(bed.number, lambda history: history.add_evolution_note("Admitted"))
+        return bed.number
+
+    with ThreadPoolExecutor(8) as executor:
+        numbers = list(executor.map(admit, range(100)))
+    print(f"Admitted {len(numbers)} patients in {len(set(numbers))} different beds")
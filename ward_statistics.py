@@ -0,0 +1,226 @@
+import threading
+
+from report import Report
+
+
+class WardStatistics:
+    """
+    Class used to keep live occupancy statistics of a set of beds.
+
+    The counters are updated by the beds and clinical histories themselves, through their
+    listener hooks, every time a patient is admitted, released or marked as chronic, so
+    reading any of them never walks the beds again. The hooks hold a lock, so the beds can
+    be updated from several threads.
+    """
+
+    def __init__(self, beds):
+        """ WardStatistics constructor object.
+
+        :param beds: The beds to follow.
+        :type beds: list[Bed]
+        """
+        self._total_beds = 0
+        self._occupied_beds = 0
+        self._occupied_per_service = {}
+        self._admissions_per_service = {}
+        self._discharges_per_service = {}
+        self._chronic_per_service = {}
+        self._chronic_histories = set()
+        self._histories = {}
+        self._history_services = {}
+        self._history_beds = {}
+        self._lock = threading.RLock()
+
+        for bed in beds:
+            self._total_beds += 1
+            bed.add_listener(self)
+            if bed.occupied:
+                self._add_occupied(bed, bed.clinical_history)
+
+    @property
+    def total_beds(self) -> int:
+        """ Get the number of beds followed.
+
+        :returns: The number of beds.
+        :rtype: int
+        """
+        return self._total_beds
+
+    @property
+    def occupied_beds(self) -> int:
+        """ Get the number of beds currently occupied.
+
+        :returns: The number of occupied beds.
+        :rtype: int
+        """
+        return self._occupied_beds
+
+    @property
+    def occupancy_rate(self) -> float:
+        """ Get the occupancy rate of the beds.
+
+        :returns: The occupancy rate as a percentage.
+        :rtype: float
+        """
+        return Report.occupancy_rate(self._total_beds, self._occupied_beds)
+
+    @property
+    def occupied_per_service(self) -> dict:
+        """ Get the number of occupied beds per medical service.
+
+        :returns: A copy of the dictionary mapping medical services to occupied beds, taken under the lock.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._occupied_per_service)
+
+    @property
+    def admissions_per_service(self) -> dict:
+        """ Get the number of admissions per medical service since the statistics started.
+
+        :returns: A copy of the dictionary mapping medical services to admissions, taken under the lock.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._admissions_per_service)
+
+    @property
+    def discharges_per_service(self) -> dict:
+        """ Get the number of discharges per medical service since the statistics started.
+
+        :returns: A copy of the dictionary mapping medical services to discharges, taken under the lock.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._discharges_per_service)
+
+    @property
+    def chronic_patients(self) -> int:
+        """ Get the number of admitted patients with a chronic disease.
+
+        :returns: The number of chronic patients.
+        :rtype: int
+        """
+        return len(self._chronic_histories)
+
+    @property
+    def chronic_per_service(self) -> dict:
+        """ Get the number of admitted patients with a chronic disease per medical service.
+
+        :returns: A copy of the dictionary mapping medical services to chronic patients, taken under the lock.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._chronic_per_service)
+
+    def clinical_histories(self) -> list:
+        """ Get the clinical histories of the admitted patients.
+
+        :returns: The clinical histories in bed order.
+        :rtype: list[ClinicalHistory]
+        """
+        with self._lock:
+            return [self._histories[number] for number in sorted(self._histories)]
+
+    def patient_admitted(self, bed, clinical_history):
+        """ Bed listener hook that counts the admission. """
+        with self._lock:
+            service = bed.service
+            self._admissions_per_service[service] = self._admissions_per_service.get(service, 0) + 1
+            self._add_occupied(bed, clinical_history)
+
+    def patient_released(self, bed, clinical_history):
+        """ Bed listener hook that counts the discharge. """
+        with self._lock:
+            service = bed.service
+            self._discharges_per_service[service] = self._discharges_per_service.get(service, 0) + 1
+            self._occupied_beds -= 1
+            _decrement(self._occupied_per_service, service)
+            del self._histories[bed.number]
+            _decrement(self._history_beds, clinical_history)
+            if clinical_history not in self._history_beds:
+                if clinical_history in self._chronic_histories:
+                    self._chronic_histories.discard(clinical_history)
+                    _decrement(self._chronic_per_service, self._history_services[clinical_history])
+                del self._history_services[clinical_history]
+                clinical_history.remove_listener(self)
+
+    def history_updated(self, clinical_history, attribute, value):
+        """ Clinical history listener hook that follows the chronic disease flag. """
+        if attribute != "chronic_disease":
+            return
+        with self._lock:
+            service = self._history_services[clinical_history]
+            if value and clinical_history not in self._chronic_histories:
+                self._chronic_histories.add(clinical_history)
+                self._chronic_per_service[service] = self._chronic_per_service.get(service, 0) + 1
+            elif not value and clinical_history in self._chronic_histories:
+                self._chronic_histories.discard(clinical_history)
+                _decrement(self._chronic_per_service, service)
+
+    def _add_occupied(self, bed, clinical_history):
+        """ Count an occupied bed and start following its clinical history.
+
+        A history admitted to several beds is followed until it leaves the last of them, its
+        chronic disease being counted once, in the service of its first bed.
+
+        :param bed: The occupied bed.
+        :type bed: Bed
+        :param clinical_history: The clinical history of the patient in the bed.
+        :type clinical_history: ClinicalHistory
+        """
+        service = bed.service
+        self._occupied_beds += 1
+        self._occupied_per_service[service] = self._occupied_per_service.get(service, 0) + 1
+        self._histories[bed.number] = clinical_history
+        self._history_beds[clinical_history] = self._history_beds.get(clinical_history, 0) + 1
+        if clinical_history not in self._history_services:
+            self._history_services[clinical_history] = service
+            clinical_history.add_listener(self)
+            if clinical_history.chronic_disease:
+                self.history_updated(clinical_history, "chronic_disease", True)
+
+    def __str__(self):
+        """ Returns a string representation of the statistics.
+
+        :returns: String representation of the statistics.
+        :rtype: str
+        """
+        return (f"Occupied Beds: {self._occupied_beds}/{self._total_beds} - "
+                f"Occupancy Rate: {self.occupancy_rate} % - Chronic Patients: {self.chronic_patients}")
+
+
+def _decrement(counters: dict, key):
+    """ Decrement a counter, removing the key when it reaches zero.
+
+    :param counters: The counters dictionary.
+    :type counters: dict
+    :param key: The key to decrement.
+    :type key: object
+    """
+    if counters[key] == 1:
+        del counters[key]
+    else:
+        counters[key] -= 1
+
+
+if __name__ == "__main__":
+    from bed import Bed
+    from patient import Patient
+    from vital_signs import VitalSigns
+    from clinical_history import ClinicalHistory
+    from datetime import datetime
+
+    beds = [Bed(n) for n in range(1, 11)]
+    statistics = WardStatistics(beds)
+    patient = Patient("1234", "Andres", "F", datetime.strptime("2004-05-15", "%Y-%m-%d"))
+    admission_date = datetime.strptime("2023-10-15 02:40", "%Y-%m-%d %H:%M")
+
+    beds[0].admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Cardiology", admission_date), "Cardiology")
+    beds[1].admit_patient(ClinicalHistory(patient, VitalSigns(120, 37, 80, 80), "Neurology", admission_date), "Neurology")
+    beds[0].clinical_history.chronic_disease = True
+    print(statistics)
+
+    beds[0].release_patient()
+    print(statistics)
+    print("Discharges Per Service: ", statistics.discharges_per_service)